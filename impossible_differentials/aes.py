@@ -2,6 +2,8 @@ import gurobipy
 from primitive import AesLike
 from itertools import product as itp
 import utilities
+import gf2
+import random
 
 # Compute the ShiftRows transformation.
 shift_rows = [0] * 16
@@ -100,6 +102,14 @@ def qmat_on_state(x):
     return out
 
 
+# Same as qmat_on_state on many states at once.
+qmat_gf2 = gf2.cellwise([qmat(1 << i) for i in range(8)], 16)
+
+
+def qmat_on_states(values):
+    return qmat_gf2.apply_ints(values)
+
+
 class Aes(AesLike):
     """ Gurobi Model for AES differential trails. """
 
@@ -120,6 +130,7 @@ class Aes(AesLike):
 
         self.mat = mixcol_matrix
         self.mixcol = mixcol
+        self.mixcol_name = mixcol
 
         AesLike.__init__(self, 128, nb_rounds, sbox_file)
 
@@ -147,25 +158,30 @@ class Aes(AesLike):
 
             self.add_bin_matrix_constr(self.mat, bit_list, 0, mode="binary")
 
-    def set_output_diff(self, out_diff):
+    def output_fixings(self, out_diff):
         """
-        Sets the output difference for impossible differential
-        search. Replaces the original function if this model
-        uses the equivalent linear mixcolumns. Indeed, this
+        Fixings of the output difference for impossible differential
+        search (see set_output_diff). Replaces the original function if
+        this model uses the equivalent linear mixcolumns. Indeed, this
         mixcolumns matrix has a modified input and then a
         modified output for the Sbox. This function makes it
         transparent.
         """
+        return AesLike.output_fixings(self, self.to_model_output(out_diff))
+
+    def to_model_output(self, out_diff):
+        """
+        Value of the model variables for the output difference out_diff
+        (see output_fixings).
+        """
         if self.mixcol == "equiv":
-            x = qmat_on_state(out_diff)
-        else:
-            x = out_diff
-        AesLike.set_output_diff(self, x)
+            return qmat_on_state(out_diff)
+        return out_diff
 
     def last_output_diff(self):
         """
         Returns the value of the output difference in the last solution.
-        Replacement for the same reason as set_output_diff.
+        Replacement for the same reason as output_fixings.
         """
         out_diff = AesLike.last_output_diff(self)
 
@@ -177,7 +193,7 @@ class Aes(AesLike):
     def get_state_out_sbox(self, r):
         """
         Gets the state at the output of round r.
-        Replacement for the same reason as set_output_diff.
+        Replacement for the same reason as output_fixings.
         """
         x = AesLike.get_state_out_sbox(self, r)
         if self.mixcol == "equiv":
@@ -185,84 +201,6 @@ class Aes(AesLike):
 
         return x
 
-    def set_active_input_cell(self, cell):
-        """
-        Adds constraints that speed up the computation when one input byte is active.
-        Those new constraints just ecplicit which variables are 0 for sure in and out
-        the first and second SBox layers.
-        """
-        assert 0 <= cell and cell < 16
-        # Checks that no active input cell has been set before.
-        for i in range(16):
-            key = "in_cell_{}".format(i)
-            assert key not in self.misc
-
-        key = "in_cell_{}".format(cell)
-        self.misc[key] = set()
-
-        # For each state bit...
-        for i in range(128):
-            # Fix 0 values in and out the first SBox layer.
-            if i // 8 != cell:
-                self.misc[key].add(self.model.addConstr(self.in_sbox[0, i] == 0))
-                self.misc[key].add(self.model.addConstr(self.out_sbox[0, i] == 0))
-
-            # Fix 0 values in and out the second SBox layer.
-            if self.nb_rounds >= 2 and shift_rows[i // 8] // 4 != cell // 4:
-                self.misc[key].add(self.model.addConstr(self.in_sbox[1, i] == 0))
-                self.misc[key].add(self.model.addConstr(self.out_sbox[1, i] == 0))
-
-    def unset_active_input_cell(self):
-        """
-        Removes active input bytes constraints.
-        """
-        for cell in range(16):
-            key = "in_cell_{}".format(cell)
-            if key in self.misc:
-                for constr in self.misc[key]:
-                    self.model.remove(constr)
-                del self.misc[key]
-
-    def unset_active_output_cell(self):
-        """
-        Same as above but for the output.
-        """
-        for cell in range(16):
-            key = "out_cell_{}".format(cell)
-            if key in self.misc:
-                for constr in self.misc[key]:
-                    self.model.remove(constr)
-                del self.misc[key]
-
-    def set_active_output_cell(self, cell):
-        """
-        Same as above but for the output.
-        """
-        assert 0 <= cell and cell < 16
-        for i in range(16):
-            key = "out_cell_{}".format(i)
-            assert key not in self.misc
-
-        key = "out_cell_{}".format(cell)
-        self.misc[key] = set()
-
-        for i in range(128):
-            if i // 8 != cell:
-                self.misc[key].add(
-                    self.model.addConstr(self.in_sbox[self.nb_rounds - 1, i] == 0)
-                )
-                self.misc[key].add(
-                    self.model.addConstr(self.out_sbox[self.nb_rounds - 1, i] == 0)
-                )
-
-            if self.nb_rounds >= 2 and (i // 8) // 4 != shift_rows[cell] // 4:
-                self.misc[key].add(
-                    self.model.addConstr(self.in_sbox[self.nb_rounds - 2, i] == 0)
-                )
-                self.misc[key].add(
-                    self.model.addConstr(self.out_sbox[self.nb_rounds - 2, i] == 0)
-                )
-
 
 # Some test vectors from the FIPS197.
 original_tv = [
@@ -345,6 +283,12 @@ def test_equiv_lin_layer():
     print("Original Equiv Linear Layer ok")
 
 
+def test_gf2_qmat():
+    states = [random.getrandbits(128) for _ in range(1000)]
+    assert qmat_on_states(states) == [qmat_on_state(x) for x in states]
+    print("GF(2) qmat ok")
+
+
 def test_equiv_sbox(sbox_file):
     mid = Aes(1, sbox_file, mixcol="equiv")
     mid.model.setParam("LogToConsole", 0)
@@ -372,4 +316,5 @@ if __name__ == "__main__":
     test_shift_rows()
     test_original_lin_layer()
     test_equiv_lin_layer()
+    test_gf2_qmat()
     test_equiv_sbox("greedy_sbox_ineg_aes_equiv.pkl")
@@ -0,0 +1,238 @@
+"""
+Reproducible benchmarks of the model construction and of the queries.
+
+Results are written as JSON and can be compared with a stored baseline:
+timings may not grow by more than a tolerance and counts (model sizes,
+answers, impossible differentials found) must be identical.
+"""
+from aes import Aes
+from skinny import Skinny
+from metrics import Metrics
+import tuning
+import argparse
+import json
+import platform
+import sys
+import time
+import gurobipy
+
+ciphers = {"aes": Aes, "skinny": Skinny}
+
+# (cipher, Sbox model, list of round numbers) for model construction.
+build_configs = [
+    ("skinny", "skinny_sbox.pkl", [2, 5, 9, 13]),
+    ("aes", "aes_equiv_sbox.pkl", [2, 3, 5]),
+]
+
+# (cipher, rounds, Sbox model, number of random queries) for query latencies.
+query_configs = [
+    ("skinny", 12, "arbitrary_sbox_8_8.pkl", 20),
+    ("skinny", 13, "skinny_sbox.pkl", 10),
+    ("aes", 5, "aes_equiv_sbox.pkl", 10),
+]
+
+# (cipher, rounds, Sbox model, expected number of impossible differentials).
+# The 12 impossible differentials of Skinny with only the lowest bit of one
+# input and one output cell active, given by the designers of Skinny.
+search_configs = [
+    ("skinny", 12, "arbitrary_sbox_8_8.pkl", 12),
+]
+
+
+def new_model(cipher, nb_rounds, sbox_file):
+    primitive = ciphers[cipher](nb_rounds, sbox_file)
+    primitive.model.setParam("LogToConsole", 0)
+    return primitive
+
+
+def unit_pairs(primitive):
+    """
+    Pairs with only the lowest bit of one input and one output cell active.
+    """
+    d = primitive.nibble_size
+    n = primitive.nb_nibbles
+    return [(1 << (d * i), 1 << (d * o)) for i in range(n) for o in range(n)]
+
+
+def timed_build(cipher, sbox_file, nb_rounds):
+    """
+    Returns the new model and its build statistics.
+    """
+    start = time.perf_counter()
+    primitive = new_model(cipher, nb_rounds, sbox_file)
+    primitive.model.update()
+    build_time = time.perf_counter() - start
+    return (
+        primitive,
+        {
+            "build_time": build_time,
+            "nb_vars": primitive.model.NumVars,
+            "nb_constrs": primitive.model.NumConstrs,
+        },
+    )
+
+
+def bench_build(cipher, sbox_file, nb_rounds):
+    return timed_build(cipher, sbox_file, nb_rounds)[1]
+
+
+def bench_queries(cipher, nb_rounds, sbox_file, nb_queries, seed):
+    """
+    Latencies of is_possible on seeded random queries and on the unit pairs,
+    split by answer.
+    """
+    primitive = new_model(cipher, nb_rounds, sbox_file)
+    query_sets = {
+        "random": tuning.sample_queries(primitive, nb_queries, seed=seed),
+        "unit": unit_pairs(primitive)[:nb_queries],
+    }
+
+    out = {}
+    for (name, queries) in query_sets.items():
+        latencies = {True: [], False: []}
+        for (x, y) in queries:
+            primitive.model.reset()
+            start = time.perf_counter()
+            possible = primitive.is_possible(x, y)
+            latencies[possible].append(time.perf_counter() - start)
+
+        for (answer, label) in [(True, "possible"), (False, "impossible")]:
+            times = sorted(latencies[answer])
+            out["{}_{}_count".format(name, label)] = len(times)
+            if len(times) != 0:
+                out["{}_{}_mean_time".format(name, label)] = sum(times) / len(times)
+                out["{}_{}_median_time".format(name, label)] = times[len(times) // 2]
+    return out
+
+
+def bench_search(cipher, nb_rounds, sbox_file, expected):
+    """
+    End to end equimip_search over the unit pairs.
+    """
+    mid = new_model(cipher, nb_rounds, sbox_file)
+    aux_in = new_model(cipher, 2, sbox_file)
+    aux_out = new_model(cipher, 2, sbox_file)
+
+    the_dict = {}
+    for (x, y) in unit_pairs(mid):
+        the_dict.setdefault(x, set()).add(y)
+    nb_pairs = len(unit_pairs(mid))
+
+    metrics = Metrics()
+    start = time.perf_counter()
+    res = mid.equimip_search(the_dict, aux_in, aux_out, metrics=metrics)
+    search_time = time.perf_counter() - start
+
+    assert len(res) == expected, "Found {} instead of {}.".format(len(res), expected)
+
+    return {
+        "search_time": search_time,
+        "pairs_per_second": nb_pairs / search_time,
+        "found": len(res),
+        "main_queries": metrics.queries["main"],
+        "aux_in_queries": metrics.queries["aux_in"],
+        "aux_out_queries": metrics.queries["aux_out"],
+    }
+
+
+def run(suites, seed=0):
+    results = {}
+    if "build" in suites:
+        for (cipher, sbox_file, rounds) in build_configs:
+            for nb_rounds in rounds:
+                name = "build/{}/{}/{}".format(cipher, nb_rounds, sbox_file)
+                print(name)
+                results[name] = bench_build(cipher, sbox_file, nb_rounds)
+    if "query" in suites:
+        for (cipher, nb_rounds, sbox_file, nb_queries) in query_configs:
+            name = "query/{}/{}/{}".format(cipher, nb_rounds, sbox_file)
+            print(name)
+            results[name] = bench_queries(
+                cipher, nb_rounds, sbox_file, nb_queries, seed
+            )
+    if "search" in suites:
+        for (cipher, nb_rounds, sbox_file, expected) in search_configs:
+            name = "search/{}/{}/{}".format(cipher, nb_rounds, sbox_file)
+            print(name)
+            results[name] = bench_search(cipher, nb_rounds, sbox_file, expected)
+
+    return {
+        "meta": {
+            "time": time.time(),
+            "seed": seed,
+            "python": platform.python_version(),
+            "gurobi": ".".join(str(v) for v in gurobipy.gurobi.version()),
+            "machine": platform.node(),
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, tolerance):
+    """
+    Returns the list of regressions of current with respect to baseline.
+    Timings (keys ending with "_time") may grow by a factor 1 + tolerance,
+    rates ("_per_second") may drop by the same factor and all the other
+    values must be equal.
+    """
+    regressions = []
+    for (name, values) in baseline["results"].items():
+        if name not in current["results"]:
+            continue
+        for (key, old) in values.items():
+            new = current["results"][name].get(key)
+            if key.endswith("_time"):
+                bad = new is None or new > old * (1 + tolerance)
+            elif key.endswith("_per_second"):
+                bad = new is None or new * (1 + tolerance) < old
+            else:
+                bad = new != old
+            if bad:
+                regressions.append((name, key, old, new))
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the model construction and the queries."
+    )
+    parser.add_argument(
+        "--suite",
+        type=str,
+        nargs="+",
+        dest="suites",
+        default=["build", "query", "search"],
+        choices=["build", "query", "search"],
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the queries.")
+    parser.add_argument(
+        "-o", type=str, dest="output_file", help="JSON file for the results."
+    )
+    parser.add_argument(
+        "-b", type=str, dest="baseline_file", help="JSON file of the baseline."
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative slowdown allowed with respect to the baseline.",
+    )
+    args = parser.parse_args()
+
+    current = run(args.suites, seed=args.seed)
+    print(json.dumps(current["results"], indent=2, sort_keys=True))
+
+    if args.output_file is not None:
+        with open(args.output_file, "w") as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+
+    if args.baseline_file is not None:
+        with open(args.baseline_file, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.tolerance)
+        for (name, key, old, new) in regressions:
+            print("REGRESSION {} {}: {} -> {}".format(name, key, old, new))
+        if len(regressions) != 0:
+            sys.exit(1)
+        print("No regression with respect to {}.".format(args.baseline_file))
@@ -0,0 +1,321 @@
+from aes import Aes
+from skinny import Skinny
+from symmetry import CellSymmetry
+from metrics import Metrics, ConsoleSink, JsonlSink
+from trails import TrailLibrary
+from results_store import ResultStore
+from sampler import Sampler
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import itertools
+import pickle
+import queue
+import time
+
+# Cipher name -> (class, default Sbox model).
+ciphers = {
+    "aes": (Aes, "aes_equiv_sbox.pkl"),
+    "skinny": (Skinny, "skinny_sbox.pkl"),
+}
+
+
+class Campaign:
+    """
+    Impossible differential search over a set of pairs of active
+    (input cell, output cell).
+    The models are built once and shared by all the pairs through a pool,
+    and so are the answers of the auxiliary models.
+    sinks: event sinks of the searches (see metrics.py), defaults to the console.
+    time_limit: optional initial budget of the main queries (see equimip_search).
+    trails: if True, the main queries are warm started with the trails of
+    the previous feasible ones (see trails.py), shared by the workers.
+    store: optional results_store.ResultStore. The pairs with a verdict are
+    skipped and the new verdicts, replayed ones included, are written to it.
+    compress: if True, only one pair per class of values with the same
+    DDT supports is searched (see AesLike.support_classes).
+    nb_samples: if set, pairs are proven possible by sampling this number of
+    trails per difference before the queries (see sampler.py).
+    batch: number of pairs solved by each call on the main model
+    (see Primitive.is_possible_batch).
+    """
+
+    def __init__(
+        self,
+        cipher,
+        nb_rounds,
+        sbox_file=None,
+        aux_rounds=2,
+        workers=1,
+        symmetry=True,
+        sinks=None,
+        time_limit=None,
+        trails=False,
+        store=None,
+        compress=False,
+        nb_samples=None,
+        batch=1,
+    ):
+        (cls, default_sbox) = ciphers[cipher]
+        if sbox_file is None:
+            sbox_file = default_sbox
+
+        self.name = cls.__name__
+        self.nb_rounds = nb_rounds
+
+        # Models are built once, then copied for each worker.
+        main = cls(nb_rounds, sbox_file)
+        main.model.setParam("LogToConsole", 0)
+        if trails:
+            main.trails = TrailLibrary()
+        aux = cls(aux_rounds, sbox_file)
+        aux.model.setParam("LogToConsole", 0)
+
+        self.nibble_size = main.nibble_size
+        self.nb_nibbles = main.nb_nibbles
+        self.format_state = main.format_state
+        self.symmetry = CellSymmetry(main) if symmetry else None
+
+        # Each copy has its own Gurobi environment, as the workers solve in
+        # parallel.
+        self.pool = queue.Queue()
+        self.pool.put((main, aux, aux.copy()))
+        for _ in range(workers - 1):
+            self.pool.put((main.copy(), aux.copy(), aux.copy()))
+        self.workers = workers
+
+        # Answers of the auxiliary models, shared by all the searches.
+        self.in_cache = {}
+        self.out_cache = {}
+
+        # Map from a pair of cells to the list of its impossible differentials.
+        self.results = {}
+
+        self.sinks = [ConsoleSink()] if sinks is None else sinks
+        self.time_limit = time_limit
+        self.store = store
+        self.compress = compress
+        self.nb_samples = nb_samples
+        self.batch = batch
+        self.config = main.config()
+
+    def candidates(self, in_cell, out_cell):
+        """
+        All the pairs with only in_cell active in input and
+        out_cell active in output.
+        """
+        d = self.nibble_size
+        the_dict = dict()
+        for valx in range(1, 1 << d):
+            x = valx << (d * in_cell)
+            the_dict[x] = set()
+            for valy in range(1, 1 << d):
+                the_dict[x].add(valy << (d * out_cell))
+        return the_dict
+
+    def search_pair(self, in_cell, out_cell):
+        """
+        Searches for impossible differentials with models from the pool.
+        """
+        (mid, aux_in, aux_out) = self.pool.get()
+        try:
+            # Cell specific pruning.
+            mid.set_active_input_cell(in_cell)
+            mid.set_active_output_cell(out_cell)
+            aux_in.set_active_input_cell(in_cell)
+            aux_out.set_active_output_cell(out_cell)
+
+            message = "{} {}r in {} out {}.".format(
+                self.name, self.nb_rounds, in_cell, out_cell
+            )
+            sampler = None
+            if self.nb_samples is not None:
+                sampler = Sampler(mid, nb_samples=self.nb_samples)
+            res = mid.equimip_search(
+                self.candidates(in_cell, out_cell),
+                aux_in,
+                aux_out,
+                message=message,
+                in_cache=self.in_cache,
+                out_cache=self.out_cache,
+                metrics=Metrics(self.sinks),
+                time_limit=self.time_limit,
+                store=self.store,
+                compress=self.compress,
+                sampler=sampler,
+                batch=self.batch,
+            )
+
+            mid.unset_active_input_cell()
+            mid.unset_active_output_cell()
+            aux_in.unset_active_input_cell()
+            aux_out.unset_active_output_cell()
+        finally:
+            self.pool.put((mid, aux_in, aux_out))
+
+        return res
+
+    def run(self, cell_pairs):
+        """
+        Searches all the pairs of cells in cell_pairs.
+        Only one pair per symmetry orbit is searched, the results are
+        replayed to the others.
+        Returns a map from the pairs of cells to their impossible differentials.
+        """
+        cell_pairs = sorted(set(cell_pairs))
+        if self.symmetry is not None:
+            orbits = self.symmetry.cell_pair_orbits(cell_pairs)
+        else:
+            orbits = {pair: [(pair, None)] for pair in cell_pairs}
+
+        start = time.time()
+        nb_done = 0
+        nb_found = 0
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(self.search_pair, *rep): rep for rep in sorted(orbits)
+            }
+            for future in as_completed(futures):
+                res = future.result()
+                for (pair, perm) in orbits[futures[future]]:
+                    if perm is None:
+                        self.results[pair] = res
+                    else:
+                        replayed = self.symmetry.replay_cells(res, perm)
+                        self.results[pair] = replayed
+                        if self.store is not None:
+                            verdicts = [(x, y, False, None) for (x, y) in replayed]
+                            self.store.record_many(self.config, verdicts)
+                    nb_done += 1
+                    nb_found += len(self.results[pair])
+
+                print(
+                    "| Campaign | {:4} / {:4} pairs of cells | {:6} found |".format(
+                        nb_done, len(cell_pairs), nb_found
+                    )
+                    + " {:8} aux answers | {:8.0f}s |".format(
+                        len(self.in_cache) + len(self.out_cache), time.time() - start
+                    )
+                )
+
+        return self.results
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Launches the search for impossible differentials "
+        + "over many pairs of active input and output cells."
+    )
+    parser.add_argument("cipher", type=str, choices=list(ciphers))
+    parser.add_argument("nb_rounds", type=int, help="Number of rounds.")
+    parser.add_argument(
+        "-s", type=str, dest="sbox_file", help="Pickle file of the Sbox model."
+    )
+    parser.add_argument(
+        "-i",
+        type=int,
+        nargs="+",
+        dest="in_cells",
+        default=list(range(16)),
+        help="Active input cells.",
+    )
+    parser.add_argument(
+        "-o",
+        type=int,
+        nargs="+",
+        dest="out_cells",
+        default=list(range(16)),
+        help="Active output cells.",
+    )
+    parser.add_argument(
+        "-w", type=int, dest="workers", default=1, help="Number of parallel searches."
+    )
+    parser.add_argument(
+        "-f", type=str, dest="output_file", help="Pickle file for the results."
+    )
+    parser.add_argument(
+        "-l", type=str, dest="log_file", help="JSONL file for the search events."
+    )
+    parser.add_argument(
+        "-q", action="store_true", dest="quiet", help="No progress on the console."
+    )
+    parser.add_argument(
+        "-t",
+        type=float,
+        dest="time_limit",
+        help="Initial budget in seconds of the main queries.",
+    )
+    parser.add_argument(
+        "-T",
+        action="store_true",
+        dest="trails",
+        help="Warm start the main queries with previous trails.",
+    )
+    parser.add_argument(
+        "-r",
+        type=str,
+        dest="store_file",
+        help="SQLite file of the results. Pairs with a verdict are skipped.",
+    )
+    parser.add_argument(
+        "-c",
+        action="store_true",
+        dest="compress",
+        help="Search one pair per class of values with the same DDT supports.",
+    )
+    parser.add_argument(
+        "-m",
+        type=int,
+        dest="nb_samples",
+        help="Number of sampled trails per difference proving pairs possible "
+        + "before the queries.",
+    )
+    parser.add_argument(
+        "-b",
+        type=int,
+        dest="batch",
+        default=1,
+        help="Number of pairs solved together by each call on the main model.",
+    )
+    args = parser.parse_args()
+
+    sinks = [] if args.quiet else [ConsoleSink()]
+    log = None
+    if args.log_file is not None:
+        log = JsonlSink(args.log_file)
+        sinks.append(log)
+
+    try:
+        campaign = Campaign(
+            args.cipher,
+            args.nb_rounds,
+            sbox_file=args.sbox_file,
+            workers=args.workers,
+            sinks=sinks,
+            time_limit=args.time_limit,
+            trails=args.trails,
+            store=ResultStore(args.store_file) if args.store_file is not None else None,
+            compress=args.compress,
+            nb_samples=args.nb_samples,
+            batch=args.batch,
+        )
+        results = campaign.run(itertools.product(args.in_cells, args.out_cells))
+    finally:
+        if log is not None:
+            log.close()
+
+    for (in_cell, out_cell) in sorted(results):
+        for (x, y) in results[in_cell, out_cell]:
+            print(
+                "Impossible (in {}, out {}): {} -> {}".format(
+                    in_cell,
+                    out_cell,
+                    campaign.format_state(x),
+                    campaign.format_state(y),
+                )
+            )
+
+    if args.output_file is not None:
+        with open(args.output_file, "wb") as f:
+            pickle.dump(results, f, 3)
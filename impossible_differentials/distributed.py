@@ -0,0 +1,585 @@
+"""
+Distributed version of equimip_search.
+
+The coordinator owns the candidate pairs and hands out tasks to workers:
+    ("main", x, y): query on the main model. The worker reports whether the
+        pair is possible and the middle states (x_mid, y_mid) of the path.
+    ("discard", x_mid, y_mid, x_start, ys, skip_in): discard phase of a path
+        for the input x_start. The worker reports the list of the y in ys such
+        that (x_start, y) is possible through (x_mid, y_mid).
+Tasks are leased: a task that is not reported in time (lost worker) is handed
+out again, and a late report is ignored. Workers renew the leases of their
+running tasks every few seconds (heartbeat), so that a main query lasting
+hours keeps its lease while its worker is alive. The socket transport also
+hands out again the tasks of a worker as soon as its connection is lost.
+
+Workers talk to the coordinator either directly (same process), through a
+local socket (serve_socket / SocketCoordinator) or through files in a shared
+directory (serve_files / FileCoordinator).
+"""
+from campaign import ciphers
+from multiprocessing.connection import Listener, Client
+import argparse
+import collections
+import json
+import os
+import pickle
+import threading
+import time
+import uuid
+
+
+class Coordinator:
+    """
+    Owns the candidate pairs (the_dict as in equimip_search) and the leases.
+    lease_time: seconds without a renewal (see Worker) before a discard
+        task is handed out again.
+    main_lease_time: same for the main queries (None for never).
+    config: python dict identifying the search, checked by the workers.
+    All the methods are thread safe.
+    """
+
+    def __init__(self, the_dict, lease_time=3600.0, main_lease_time=600.0, config=None):
+        self.the_dict = {x: set(ys) for (x, ys) in the_dict.items() if len(ys) != 0}
+        self.lease_time = lease_time
+        self.main_lease_time = main_lease_time
+        self.config = config
+        self.pending = collections.deque()
+        self.leases = {}
+        self.found = []
+        self.lock = threading.Lock()
+        self.next_id = 0
+
+    def deadline(self, task):
+        lease_time = self.main_lease_time if task[0] == "main" else self.lease_time
+        if lease_time is None:
+            return float("inf")
+        return time.time() + lease_time
+
+    def requeue(self, task_id):
+        """
+        Hands out again the task of a lease.
+        """
+        (task, _, _) = self.leases.pop(task_id)
+        if task[0] == "main":
+            self.the_dict.setdefault(task[1], set()).add(task[2])
+        else:
+            self.pending.appendleft(task)
+
+    def expire(self):
+        """
+        Hands out again the tasks whose lease has expired.
+        """
+        now = time.time()
+        for task_id in list(self.leases):
+            if self.leases[task_id][2] < now:
+                self.requeue(task_id)
+
+    def lease(self, worker):
+        """
+        Returns (task_id, task) or None if there is nothing to do for now.
+        Discard tasks come first since they remove main queries.
+        """
+        with self.lock:
+            self.expire()
+            if len(self.pending) != 0:
+                task = self.pending.popleft()
+            elif len(self.the_dict) != 0:
+                x = next(iter(self.the_dict))
+                y = self.the_dict[x].pop()
+                if len(self.the_dict[x]) == 0:
+                    del self.the_dict[x]
+                task = ("main", x, y)
+            else:
+                return None
+
+            task_id = self.next_id
+            self.next_id += 1
+            self.leases[task_id] = (task, worker, self.deadline(task))
+            return (task_id, task)
+
+    def renew(self, task_id):
+        """
+        Extends the lease of a running task. Returns False if it has
+        expired (the task has been handed out again).
+        """
+        with self.lock:
+            if task_id not in self.leases:
+                return False
+            (task, worker, _) = self.leases[task_id]
+            self.leases[task_id] = (task, worker, self.deadline(task))
+            return True
+
+    def release(self, worker):
+        """
+        Hands out again the tasks leased by a lost worker.
+        """
+        with self.lock:
+            for task_id in list(self.leases):
+                if self.leases[task_id][1] == worker:
+                    self.requeue(task_id)
+
+    def report(self, task_id, result):
+        with self.lock:
+            lease = self.leases.pop(task_id, None)
+            # The lease has expired and the task has been handed out again.
+            if lease is None:
+                return
+            task = lease[0]
+
+            if task[0] == "main":
+                (_, x, y) = task
+                (possible, x_mid, y_mid) = result
+                if not possible:
+                    self.found.append((x, y))
+                else:
+                    for x_start in self.the_dict:
+                        self.pending.append(
+                            (
+                                "discard",
+                                x_mid,
+                                y_mid,
+                                x_start,
+                                sorted(self.the_dict[x_start]),
+                                x_start == x,
+                            )
+                        )
+            else:
+                x_start = task[3]
+                if x_start in self.the_dict:
+                    self.the_dict[x_start].difference_update(result)
+                    if len(self.the_dict[x_start]) == 0:
+                        del self.the_dict[x_start]
+
+    def done(self):
+        with self.lock:
+            return (
+                len(self.the_dict) == 0
+                and len(self.pending) == 0
+                and len(self.leases) == 0
+            )
+
+    def remaining(self):
+        with self.lock:
+            return sum(len(ys) for ys in self.the_dict.values())
+
+    def search_config(self):
+        return self.config
+
+
+class Worker:
+    """
+    Runs the tasks of a coordinator (or of a proxy with the same
+    lease/renew/report/done/search_config methods) on its own models.
+    heartbeat: seconds between two renewals of the lease of the running task,
+    less than the lease times of the coordinator.
+    config: python dict identifying the search of the models, which must be
+    the one of the coordinator (not checked if None).
+    """
+
+    def __init__(
+        self,
+        coordinator,
+        mid,
+        aux_in,
+        aux_out,
+        name=None,
+        poll=1.0,
+        heartbeat=60.0,
+        config=None,
+    ):
+        self.coordinator = coordinator
+        self.config = config
+        self.mid = mid
+        self.aux_in = aux_in
+        self.aux_out = aux_out
+        self.name = name if name is not None else uuid.uuid4().hex
+        self.poll = poll
+        self.heartbeat = heartbeat
+
+        self.r_in = aux_in.nb_rounds - 1
+        self.r_out = aux_out.nb_rounds - 1
+        assert self.r_in + self.r_out < mid.nb_rounds
+
+    def execute(self, task):
+        if task[0] == "main":
+            (_, x, y) = task
+            if not self.mid.is_possible(x, y):
+                return (False, None, None)
+            x_mid = self.mid.get_state_out_sbox(self.r_in)
+            y_mid = self.mid.get_state_in_sbox(self.mid.nb_rounds - self.r_out - 1)
+            return (True, x_mid, y_mid)
+
+        (_, x_mid, y_mid, x_start, ys, skip_in) = task
+        if not skip_in and not self.aux_in.is_possible(x_start, x_mid):
+            return []
+        return [y for y in ys if self.aux_out.is_possible(y_mid, y)]
+
+    def execute_leased(self, task_id, task):
+        """
+        Executes the task while a thread renews its lease.
+        """
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(self.heartbeat):
+                self.coordinator.renew(task_id)
+
+        thread = threading.Thread(target=renew, daemon=True)
+        thread.start()
+        try:
+            return self.execute(task)
+        finally:
+            stop.set()
+            thread.join()
+
+    def run(self):
+        if self.config is not None:
+            expected = self.coordinator.search_config()
+            message = "The worker searches {} but the coordinator {}.".format(
+                self.config, expected
+            )
+            assert expected is None or expected == self.config, message
+
+        while True:
+            lease = self.coordinator.lease(self.name)
+            if lease is None:
+                if self.coordinator.done():
+                    return
+                time.sleep(self.poll)
+                continue
+            (task_id, task) = lease
+            self.coordinator.report(task_id, self.execute_leased(task_id, task))
+
+
+def run_local(
+    the_dict, mid, aux_in, aux_out, workers=2, lease_time=3600.0, main_lease_time=600.0
+):
+    """
+    In-process stand-in: runs workers threads on copies of the models.
+    Returns the list of impossible pairs like equimip_search.
+    """
+    coordinator = Coordinator(
+        the_dict, lease_time=lease_time, main_lease_time=main_lease_time
+    )
+    threads = []
+    for k in range(workers):
+        # The threads solve in parallel: the models of a thread must not share
+        # a Gurobi environment with the ones of another thread. The copies
+        # have their own environments (see Primitive.copy).
+        if k == 0:
+            models = (mid, aux_in, aux_out)
+        else:
+            models = (mid.copy(), aux_in.copy(), aux_out.copy())
+        worker = Worker(coordinator, *models, name="local-{}".format(k), poll=0.01)
+        threads.append(threading.Thread(target=worker.run))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return coordinator.found
+
+
+# Local socket transport.
+
+
+def serve_socket(coordinator, address, authkey, poll=1.0):
+    """
+    Serves the coordinator on address (host, port) until all the pairs
+    are done. One thread per worker connection.
+    """
+    listener = Listener(address, authkey=authkey)
+
+    def handle(conn):
+        # Workers which leased tasks through this connection.
+        workers = set()
+        try:
+            while True:
+                request = conn.recv()
+                if request[0] == "lease":
+                    workers.add(request[1])
+                    conn.send(coordinator.lease(request[1]))
+                elif request[0] == "renew":
+                    conn.send(coordinator.renew(request[1]))
+                elif request[0] == "report":
+                    coordinator.report(request[1], request[2])
+                    conn.send(None)
+                elif request[0] == "config":
+                    conn.send(coordinator.search_config())
+                else:
+                    conn.send(coordinator.done())
+        except (EOFError, ConnectionError):
+            conn.close()
+            for worker in workers:
+                coordinator.release(worker)
+
+    def accept():
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    while not coordinator.done():
+        time.sleep(poll)
+    listener.close()
+    return coordinator.found
+
+
+class SocketCoordinator:
+    """
+    Proxy of a coordinator served by serve_socket.
+    """
+
+    def __init__(self, address, authkey):
+        self.conn = Client(address, authkey=authkey)
+        self.lock = threading.Lock()
+
+    def call(self, *request):
+        with self.lock:
+            self.conn.send(request)
+            return self.conn.recv()
+
+    def lease(self, worker):
+        return self.call("lease", worker)
+
+    def renew(self, task_id):
+        return self.call("renew", task_id)
+
+    def report(self, task_id, result):
+        return self.call("report", task_id, result)
+
+    def search_config(self):
+        return self.call("config")
+
+    def done(self):
+        try:
+            return self.call("done")
+        except (EOFError, ConnectionError):
+            # The coordinator stops serving once everything is done.
+            return True
+
+
+# Shared filesystem transport. Each request is a JSON file written
+# atomically (written under a temporary name, then renamed).
+
+
+def write_json(file_name, data):
+    tmp = "{}.{}.tmp".format(file_name, uuid.uuid4().hex)
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, file_name)
+
+
+def read_json(file_name):
+    with open(file_name, "r") as f:
+        return json.load(f)
+
+
+def as_task(data):
+    """
+    JSON turns tuples into lists.
+    """
+    if data[0] == "main":
+        return tuple(data)
+    return tuple(data[:4]) + (list(data[4]), data[5])
+
+
+def serve_files(coordinator, directory, poll=0.5):
+    """
+    Serves the coordinator through the files of directory until all the
+    pairs are done. Workers write requests in directory/requests and read
+    the answers in directory/answers.
+    """
+    requests = os.path.join(directory, "requests")
+    answers = os.path.join(directory, "answers")
+    os.makedirs(requests, exist_ok=True)
+    os.makedirs(answers, exist_ok=True)
+
+    while True:
+        done = coordinator.done()
+        status = {"done": done, "config": coordinator.search_config()}
+        write_json(os.path.join(directory, "status.json"), status)
+        if done:
+            return coordinator.found
+
+        for file_name in sorted(os.listdir(requests)):
+            if file_name.endswith(".tmp"):
+                continue
+            path = os.path.join(requests, file_name)
+            request = read_json(path)
+            os.remove(path)
+            if request["kind"] == "lease":
+                lease = coordinator.lease(request["worker"])
+                write_json(os.path.join(answers, file_name), {"lease": lease})
+            elif request["kind"] == "renew":
+                coordinator.renew(request["task_id"])
+            else:
+                coordinator.report(request["task_id"], request["result"])
+        time.sleep(poll)
+
+
+class FileCoordinator:
+    """
+    Proxy of a coordinator served by serve_files. A lost worker is only
+    noticed when the leases of its tasks expire, without renewals.
+    """
+
+    def __init__(self, directory, worker, poll=0.5):
+        self.directory = directory
+        self.poll = poll
+        self.prefix = "{}-{}".format(worker, uuid.uuid4().hex)
+        self.count = 0
+        # The renewals come from another thread of the worker.
+        self.lock = threading.Lock()
+
+    def request(self, data, wait):
+        with self.lock:
+            self.count += 1
+            file_name = "{}-{:08}.json".format(self.prefix, self.count)
+        write_json(os.path.join(self.directory, "requests", file_name), data)
+        if not wait:
+            return None
+        answer = os.path.join(self.directory, "answers", file_name)
+        while not os.path.exists(answer):
+            if self.done():
+                return None
+            time.sleep(self.poll)
+        data = read_json(answer)
+        os.remove(answer)
+        return data
+
+    def lease(self, worker):
+        answer = self.request({"kind": "lease", "worker": worker}, wait=True)
+        if answer is None or answer["lease"] is None:
+            return None
+        (task_id, task) = answer["lease"]
+        return (task_id, as_task(task))
+
+    def renew(self, task_id):
+        self.request({"kind": "renew", "task_id": task_id}, wait=False)
+
+    def report(self, task_id, result):
+        data = {"kind": "report", "task_id": task_id, "result": list(result)}
+        self.request(data, wait=False)
+
+    def done(self):
+        status = os.path.join(self.directory, "status.json")
+        return os.path.exists(status) and read_json(status)["done"]
+
+    def search_config(self):
+        """
+        Waits for the first status of the coordinator.
+        """
+        status = os.path.join(self.directory, "status.json")
+        while not os.path.exists(status):
+            time.sleep(self.poll)
+        return read_json(status)["config"]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Distributed search for impossible differentials with one "
+        + "active input cell and one active output cell."
+    )
+    parser.add_argument("role", type=str, choices=["coordinator", "worker"])
+    parser.add_argument("cipher", type=str, choices=list(ciphers))
+    parser.add_argument("nb_rounds", type=int, help="Number of rounds.")
+    parser.add_argument("in_cell", type=int, help="Active input cell.")
+    parser.add_argument("out_cell", type=int, help="Active output cell.")
+    parser.add_argument(
+        "-s", type=str, dest="sbox_file", help="Pickle file of the Sbox model."
+    )
+    parser.add_argument(
+        "-a", type=str, dest="address", help="host:port of the coordinator socket."
+    )
+    parser.add_argument(
+        "-k", type=str, dest="authkey", default="equimip", help="Socket key."
+    )
+    parser.add_argument(
+        "-d", type=str, dest="directory", help="Shared directory of the queue."
+    )
+    parser.add_argument(
+        "-l",
+        type=float,
+        dest="lease_time",
+        default=3600.0,
+        help="Seconds without a heartbeat before a discard task is handed out again.",
+    )
+    parser.add_argument(
+        "-L",
+        type=float,
+        dest="main_lease_time",
+        default=600.0,
+        help="Seconds without a heartbeat before a main query is handed out again.",
+    )
+    parser.add_argument(
+        "-H",
+        type=float,
+        dest="heartbeat",
+        default=60.0,
+        help="Seconds between two heartbeats of a worker.",
+    )
+    args = parser.parse_args()
+    assert (args.address is None) != (args.directory is None)
+
+    (cls, default_sbox) = ciphers[args.cipher]
+    sbox_file = default_sbox if args.sbox_file is None else args.sbox_file
+
+    # The coordinator and its workers must search the same pairs of cells
+    # on the same number of rounds.
+    config = {
+        "cipher": args.cipher,
+        "rounds": args.nb_rounds,
+        "sbox": os.path.basename(sbox_file),
+        "in_cell": args.in_cell,
+        "out_cell": args.out_cell,
+    }
+
+    if args.role == "coordinator":
+        with open(sbox_file, "rb") as f:
+            (d, _, _, _) = pickle.load(f)
+        the_dict = {}
+        for valx in range(1, 1 << d):
+            x = valx << (d * args.in_cell)
+            the_dict[x] = set(valy << (d * args.out_cell) for valy in range(1, 1 << d))
+        coordinator = Coordinator(
+            the_dict,
+            lease_time=args.lease_time,
+            main_lease_time=args.main_lease_time,
+            config=config,
+        )
+
+        if args.address is not None:
+            (host, port) = args.address.split(":")
+            found = serve_socket(coordinator, (host, int(port)), args.authkey.encode())
+        else:
+            found = serve_files(coordinator, args.directory)
+
+        for (x, y) in found:
+            print("Impossible: {} -> {}".format(hex(x), hex(y)))
+
+    else:
+        mid = cls(args.nb_rounds, sbox_file)
+        mid.model.setParam("LogToConsole", 0)
+        aux_in = cls(2, sbox_file)
+        aux_in.model.setParam("LogToConsole", 0)
+        aux_out = cls(2, sbox_file)
+        aux_out.model.setParam("LogToConsole", 0)
+        mid.set_active_input_cell(args.in_cell)
+        mid.set_active_output_cell(args.out_cell)
+        aux_in.set_active_input_cell(args.in_cell)
+        aux_out.set_active_output_cell(args.out_cell)
+
+        if args.address is not None:
+            (host, port) = args.address.split(":")
+            proxy = SocketCoordinator((host, int(port)), args.authkey.encode())
+        else:
+            proxy = FileCoordinator(args.directory, "worker")
+
+        Worker(
+            proxy, mid, aux_in, aux_out, heartbeat=args.heartbeat, config=config
+        ).run()
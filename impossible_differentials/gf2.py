@@ -0,0 +1,166 @@
+"""
+Binary matrices packed into uint64 words, applied to many states at once.
+
+States of n bits are packed into arrays of shape (N, ceil(n / 64)) of uint64
+(bit j of a state is bit j % 64 of its word j // 64), so that a linear layer
+is evaluated on thousands of differences per call. A matrix is applied with
+one table per input byte (the XOR of the columns selected by the 256 values
+of the byte): 16 lookups and XORs for a state of 128 bits.
+Matrices use the format of linear_layer_matrix: bit j of rows[i] is set if
+output bit i depends on input bit j.
+"""
+import numpy as np
+import utilities
+
+
+def nb_words(nb_bits):
+    return (nb_bits + 63) // 64
+
+
+def pack(values, nb_bits):
+    """
+    Packs a list of integers of nb_bits bits.
+    """
+    size = 8 * nb_words(nb_bits)
+    data = b"".join([v.to_bytes(size, "little") for v in values])
+    return np.frombuffer(data, dtype="<u8").reshape(len(values), size // 8).copy()
+
+
+def unpack(states):
+    """
+    Inverse of pack.
+    """
+    data = np.ascontiguousarray(states, dtype="<u8")
+    size = 8 * data.shape[1]
+    raw = data.tobytes()
+    return [
+        int.from_bytes(raw[i : i + size], "little") for i in range(0, len(raw), size)
+    ]
+
+
+class BitMatrix:
+    """
+    Binary matrix with nb_rows rows of nb_cols bits (list of integers).
+    words: the rows packed into uint64 (see pack).
+    """
+
+    def __init__(self, rows, nb_cols=None):
+        self.rows = list(rows)
+        self.nb_rows = len(self.rows)
+        self.nb_cols = self.nb_rows if nb_cols is None else nb_cols
+        self.words = pack(self.rows, self.nb_cols)
+        self.tables = None
+
+    @classmethod
+    def from_function(cls, function, nb_bits):
+        """
+        Matrix of a linear function on nb_bits bits (from the images
+        of the unit vectors).
+        """
+        images = [function(1 << j) for j in range(nb_bits)]
+        return cls.from_columns(images, nb_bits)
+
+    @classmethod
+    def from_columns(cls, columns, nb_rows):
+        rows = [0] * nb_rows
+        for (j, column) in enumerate(columns):
+            for i in range(nb_rows):
+                rows[i] |= ((column >> i) & 1) << j
+        return cls(rows, len(columns))
+
+    def columns(self):
+        out = [0] * self.nb_cols
+        for (i, row) in enumerate(self.rows):
+            for j in range(self.nb_cols):
+                out[j] |= ((row >> j) & 1) << i
+        return out
+
+    def __eq__(self, other):
+        return self.nb_cols == other.nb_cols and self.rows == other.rows
+
+    def __call__(self, x):
+        """
+        Image of one state (integer).
+        """
+        out = 0
+        for (i, row) in enumerate(self.rows):
+            out |= (utilities.hwt(row & x) & 1) << i
+        return out
+
+    def __matmul__(self, other):
+        """
+        Composition: (self @ other)(x) = self(other(x)).
+        """
+        assert self.nb_cols == other.nb_rows
+        rows = []
+        for row in self.rows:
+            out = 0
+            for j in range(self.nb_cols):
+                if (row >> j) & 1:
+                    out ^= other.rows[j]
+            rows.append(out)
+        return BitMatrix(rows, other.nb_cols)
+
+    def inverse(self):
+        assert self.nb_rows == self.nb_cols
+        return BitMatrix(utilities.inverse_matrix(self.rows), self.nb_cols)
+
+    def byte_tables(self):
+        """
+        tables[k][v] is the image of the state whose byte k is v
+        (the other bytes are zero), packed.
+        """
+        if self.tables is None:
+            columns = pack(self.columns(), self.nb_rows)
+            nb_bytes = (self.nb_cols + 7) // 8
+            # Unused columns of the last byte are zero.
+            padding = np.zeros(
+                (8 * nb_bytes - self.nb_cols, columns.shape[1]), dtype=np.uint64
+            )
+            columns = np.concatenate([columns, padding])
+            values = np.arange(256)
+            self.tables = np.zeros((nb_bytes, 256, columns.shape[1]), dtype=np.uint64)
+            for k in range(nb_bytes):
+                for b in range(8):
+                    selected = ((values >> b) & 1).astype(bool)
+                    self.tables[k, selected] ^= columns[8 * k + b]
+        return self.tables
+
+    def apply(self, states):
+        """
+        Images of the packed states (array of shape (N, nb_words(nb_cols))).
+        """
+        tables = self.byte_tables()
+        data = np.ascontiguousarray(states, dtype="<u8").view(np.uint8)
+        out = np.zeros((len(data), tables.shape[2]), dtype=np.uint64)
+        for k in range(tables.shape[0]):
+            out ^= tables[k][data[:, k]]
+        return out
+
+    def apply_ints(self, values):
+        """
+        Same as apply on a list of integers.
+        """
+        return unpack(self.apply(pack(values, self.nb_cols)))
+
+
+def cellwise(images, nb_cells):
+    """
+    Same linear map on each cell of a state: images are the images of the
+    unit vectors of a cell (as in linear_equiv.py).
+    """
+    d = len(images)
+    rows = [0] * (d * nb_cells)
+    for c in range(nb_cells):
+        for (j, image) in enumerate(images):
+            for i in range(d):
+                rows[(d * c) + i] |= ((image >> i) & 1) << ((d * c) + j)
+    return BitMatrix(rows)
+
+
+def cell_permutation(perm, d):
+    """
+    Cell i of the output is cell perm[i] of the input.
+    """
+    rows = [1 << ((d * perm[i // d]) + (i % d)) for i in range(d * len(perm))]
+    return BitMatrix(rows)
@@ -0,0 +1,304 @@
+"""
+Search for equivalent models of a linear layer with less inequalities.
+
+A linear layer on n bits is modeled by the rows of A = (M|I) (as integers,
+bit j < n for the input x, bit n + j for the output y) and each row of weight w
+costs 2^(w - 1) inequalities in add_bin_matrix_constr. Two changes keep the
+model equivalent:
+    - row operations P (any basis of the row space of A),
+    - S-box compatible column transforms: the same linear map T on every cell
+      of x (the output of the S-boxes) and R on every cell of y (the input of
+      the S-boxes). The model then uses the variables u = T x and v = R y
+      and the equivalent S-box v -> T S(R^-1 v).
+For the AES, T is qmat and R is the identity (mixcolA in aes.py).
+
+Linear maps on cells of d bits are given by the list of the images of
+the d unit vectors.
+"""
+from aes import mixcolA, mixcolA_original, qmat
+from skinny import mixcol_origin
+import argparse
+import json
+import random
+import utilities
+
+
+def xor_cost(rows):
+    """
+    Number of inequalities of add_bin_matrix_constr in binary mode.
+    """
+    return sum([1 << (utilities.hwt(row) - 1) for row in rows if row != 0])
+
+
+def apply_map(images, x):
+    out = 0
+    for i in range(len(images)):
+        if (x >> i) & 1:
+            out ^= images[i]
+    return out
+
+
+def inverse_map(images):
+    """
+    Inverse of an invertible linear map on d bits.
+    """
+    d = len(images)
+    # Gauss-Jordan on the rows (image of e_i | e_i).
+    rows = [images[i] | (1 << (d + i)) for i in range(d)]
+    for col in range(d):
+        pivot = [i for i in range(col, d) if (rows[i] >> col) & 1]
+        assert len(pivot) != 0, "Not invertible."
+        (rows[col], rows[pivot[0]]) = (rows[pivot[0]], rows[col])
+        for i in range(d):
+            if i != col and (rows[i] >> col) & 1:
+                rows[i] ^= rows[col]
+    # Row col is now e_col | (combination of the e_i mapped to e_col).
+    return [rows[col] >> d for col in range(d)]
+
+
+def on_state(images, x, nb_cells):
+    """
+    Applies the map to each cell of the state x.
+    """
+    d = len(images)
+    out = 0
+    for i in range(nb_cells):
+        out ^= apply_map(images, (x >> (d * i)) & ((1 << d) - 1)) << (d * i)
+    return out
+
+
+def transform_rows(rows, n, out_map, in_map):
+    """
+    Rows of the same model in the variables u = T x and v = R y where
+    out_map is T (output of the S-boxes) and in_map is R.
+    A row a becomes a T^-1 on x and a R^-1 on y.
+    """
+    d = len(out_map)
+    nb_cells = n // d
+    cols = [inverse_map(out_map), inverse_map(in_map)]
+
+    out = []
+    for row in rows:
+        new_row = 0
+        for (side, inv) in enumerate(cols):
+            for c in range(nb_cells):
+                a = (row >> ((side * n) + (d * c))) & ((1 << d) - 1)
+                for j in range(d):
+                    bit = utilities.hwt(a & inv[j]) & 1
+                    new_row ^= bit << ((side * n) + (d * c) + j)
+        out.append(new_row)
+    return out
+
+
+def echelon_insert(basis, row):
+    """
+    basis: map from a pivot bit to a row. Inserts row if it is independent.
+    """
+    while row != 0:
+        pivot = utilities.log2(row)
+        if pivot not in basis:
+            basis[pivot] = row
+            return True
+        row ^= basis[pivot]
+    return False
+
+
+def low_weight_basis(rows, nb_trials=32, seed=0):
+    """
+    Basis of the row space of rows with a small xor_cost. Low weight
+    vectors are collected from systematic bases with random information
+    sets (and their pairwise sums), then the cheapest basis among them is
+    taken greedily (greedy is optimal for the cost of a basis of a matroid).
+    """
+    rng = random.Random(seed)
+    basis = {}
+    for row in rows:
+        echelon_insert(basis, row)
+    k = len(basis)
+    width = max(basis) + 1
+
+    candidates = set(basis.values())
+    for _ in range(nb_trials):
+        order = list(range(width))
+        rng.shuffle(order)
+        systematic = list(basis.values())
+        pivot = 0
+        for col in order:
+            found = [i for i in range(pivot, k) if (systematic[i] >> col) & 1]
+            if len(found) == 0:
+                continue
+            i = found[0]
+            (systematic[pivot], systematic[i]) = (systematic[i], systematic[pivot])
+            for i in range(k):
+                if i != pivot and (systematic[i] >> col) & 1:
+                    systematic[i] ^= systematic[pivot]
+            pivot += 1
+            if pivot == k:
+                break
+        candidates.update(systematic)
+        for i in range(k):
+            for j in range(i + 1, k):
+                candidates.add(systematic[i] ^ systematic[j])
+
+    out = []
+    greedy = {}
+    for row in sorted(candidates, key=lambda r: (utilities.hwt(r), r)):
+        if echelon_insert(greedy, row):
+            out.append(row)
+            if len(out) == k:
+                break
+    return sorted(out)
+
+
+def rank(rows):
+    basis = {}
+    for row in rows:
+        echelon_insert(basis, row)
+    return len(basis)
+
+
+def transvections(d):
+    """
+    Moves of the local search: x -> x ^ (x_j << i).
+    """
+    return [(i, j) for i in range(d) for j in range(d) if i != j]
+
+
+def apply_transvection(images, move):
+    (i, j) = move
+    return [image ^ (((image >> j) & 1) << i) for image in images]
+
+
+def search(rows, n, d, iterations=10, nb_trials=32, seed=0, starts=()):
+    """
+    Local search over the column transforms (T, R), each one evaluated
+    with the basis of low_weight_basis.
+    starts: known equivalent models (rows, out_map, in_map). The search
+    starts from the cheapest one of them, of rows and of the model with
+    row operations only, so it never returns a more expensive model.
+    Returns (rows, out_map, in_map, cost).
+    """
+    identity = [1 << i for i in range(d)]
+
+    def evaluate(out_map, in_map):
+        basis = low_weight_basis(
+            transform_rows(rows, n, out_map, in_map), nb_trials, seed
+        )
+        return (xor_cost(basis), basis)
+
+    (out_map, in_map) = (identity, identity)
+    (cost, basis) = evaluate(out_map, in_map)
+    print("Cost with row operations only: {}".format(cost))
+
+    known = [(rows, identity, identity)] + list(starts)
+    for (start_rows, start_out, start_in) in known:
+        transformed = transform_rows(rows, n, start_out, start_in)
+        assert rank(start_rows) == rank(transformed) == rank(start_rows + transformed)
+        (new_cost, new_basis) = evaluate(start_out, start_in)
+        if xor_cost(start_rows) < new_cost:
+            (new_cost, new_basis) = (xor_cost(start_rows), sorted(start_rows))
+        if new_cost < cost:
+            (out_map, in_map) = (start_out, start_in)
+            (cost, basis) = (new_cost, new_basis)
+    print("Starting cost: {}".format(cost))
+
+    rng = random.Random(seed)
+    for it in range(iterations):
+        moves = [(0, m) for m in transvections(d)] + [(1, m) for m in transvections(d)]
+        rng.shuffle(moves)
+        improved = False
+        for (side, move) in moves:
+            if side == 0:
+                maps = (apply_transvection(out_map, move), in_map)
+            else:
+                maps = (out_map, apply_transvection(in_map, move))
+            (new_cost, new_basis) = evaluate(*maps)
+            if new_cost < cost:
+                (out_map, in_map) = maps
+                (cost, basis) = (new_cost, new_basis)
+                improved = True
+        print("Iteration {}: cost {}".format(it, cost))
+        if not improved:
+            break
+
+    return (basis, out_map, in_map, cost)
+
+
+# Name: (rows, n, d, known equivalent models as in search).
+presets = {
+    "aes": (
+        mixcolA_original,
+        32,
+        8,
+        [(mixcolA, [qmat(1 << i) for i in range(8)], [1 << i for i in range(8)])],
+    ),
+    "skinny": (
+        [sum([bit << j for (j, bit) in enumerate(row)]) for row in mixcol_origin],
+        4,
+        1,
+        [],
+    ),
+}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Searches an equivalent model of a linear layer (M|I) "
+        + "with less inequalities."
+    )
+    parser.add_argument(
+        "matrix",
+        type=str,
+        help="One of {} or a file with one hex row of (M|I) per line.".format(
+            list(presets)
+        ),
+    )
+    parser.add_argument("-n", type=int, dest="n", help="Size of the input.")
+    parser.add_argument("-d", type=int, dest="d", help="Size of the S-box.")
+    parser.add_argument(
+        "-i", type=int, dest="iterations", default=10, help="Local search iterations."
+    )
+    parser.add_argument(
+        "-t", type=int, dest="nb_trials", default=32, help="Information sets."
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", type=str, dest="output_file", help="JSON output file.")
+    args = parser.parse_args()
+
+    if args.matrix in presets:
+        (rows, n, d, starts) = presets[args.matrix]
+    else:
+        with open(args.matrix, "r") as f:
+            rows = [int(line, 16) for line in f if line.strip() != ""]
+        (n, d, starts) = (args.n, args.d, [])
+    assert n % d == 0
+
+    print("Original cost: {}".format(xor_cost(rows)))
+    (basis, out_map, in_map, cost) = search(
+        rows, n, d, args.iterations, args.nb_trials, args.seed, starts
+    )
+
+    print("Cost: {}".format(cost))
+    print("matrix = [")
+    for row in basis:
+        print("    {},".format(hex(row).upper().replace("X", "x")))
+    print("]")
+    print("S-box output map T (x -> u = T x, output difference): {}".format(out_map))
+    print("S-box input map R (y -> v = R y, input difference): {}".format(in_map))
+    print("Equivalent S-box: v -> T S(R^-1 v), R^-1 = {}".format(inverse_map(in_map)))
+
+    if args.output_file is not None:
+        with open(args.output_file, "w") as f:
+            json.dump(
+                {
+                    "matrix": [hex(row) for row in basis],
+                    "n": n,
+                    "d": d,
+                    "out_map": out_map,
+                    "in_map": in_map,
+                    "cost": cost,
+                },
+                f,
+                indent=2,
+            )
@@ -1,4 +1,7 @@
 from aes import *
+from symmetry import CellSymmetry
+from results_store import ResultStore
+from sampler import Sampler
 import argparse
 import itertools
 
@@ -16,14 +19,67 @@ if __name__ == "__main__":
     parser.add_argument(
         "out_cell", type=int, help="Nibble of output.", choices=[i for i in range(16)],
     )
+    parser.add_argument(
+        "-t",
+        type=float,
+        dest="time_limit",
+        help="Initial budget in seconds of the main queries. "
+        + "Queries running out of budget are deferred and retried later.",
+    )
+    parser.add_argument(
+        "-r",
+        type=str,
+        dest="store_file",
+        help="SQLite file of the results. Pairs with a verdict are skipped.",
+    )
+    parser.add_argument(
+        "-c",
+        action="store_true",
+        dest="compress",
+        help="Search one pair per class of values with the same DDT supports.",
+    )
+    parser.add_argument(
+        "-m",
+        type=int,
+        dest="nb_samples",
+        help="Number of sampled trails per difference proving pairs possible "
+        + "before the queries.",
+    )
+    parser.add_argument(
+        "-b",
+        type=int,
+        dest="batch",
+        default=1,
+        help="Number of pairs solved together by each call on the main model.",
+    )
     args = parser.parse_args()
 
     in_cell = args.in_cell
     out_cell = args.out_cell
+    store = ResultStore(args.store_file) if args.store_file is not None else None
 
     # Main model.
     mid = Aes(nb_rounds, "aes_equiv_sbox.pkl")
     mid.model.setParam("LogToConsole", 0)
+    sampler = None
+    if args.nb_samples is not None:
+        sampler = Sampler(mid, nb_samples=args.nb_samples)
+
+    # Pairs of cells equivalent under a cell permutation give the same results.
+    # Only the canonical pair of each orbit is searched.
+    sym = CellSymmetry(mid)
+    orbits = sym.cell_pair_orbits(itertools.product(range(16), range(16)))
+    for rep in orbits:
+        if (in_cell, out_cell) in [pair for (pair, _) in orbits[rep]]:
+            break
+    if rep != (in_cell, out_cell):
+        print(
+            "Cells (in {}, out {}) are equivalent to (in {}, out {}).".format(
+                in_cell, out_cell, rep[0], rep[1]
+            )
+        )
+        exit(0)
+
     mid.set_active_input_cell(in_cell)
     mid.set_active_output_cell(out_cell)
 
@@ -46,4 +102,27 @@ if __name__ == "__main__":
             the_dict[x].add(y)
 
     message = "Aes 5r in {} out {}.".format(in_cell, out_cell)
-    mid.equimip_search(the_dict, aux_in, aux_out, message=message)
+    res = mid.equimip_search(
+        the_dict,
+        aux_in,
+        aux_out,
+        message=message,
+        time_limit=args.time_limit,
+        store=store,
+        compress=args.compress,
+        sampler=sampler,
+        batch=args.batch,
+    )
+
+    # Replays the results to the equivalent pairs of cells.
+    for ((i, o), perm) in orbits[rep]:
+        replayed = sym.replay_cells(res, perm)
+        if store is not None:
+            config = mid.config()
+            store.record_many(config, [(x, y, False, None) for (x, y) in replayed])
+        for (x, y) in replayed:
+            print(
+                "Impossible (in {}, out {}): {} -> {}".format(
+                    i, o, mid.format_state(x), mid.format_state(y)
+                )
+            )
@@ -1,4 +1,7 @@
 from skinny import *
+from symmetry import CellSymmetry
+from results_store import ResultStore
+from sampler import Sampler
 import argparse
 import itertools
 
@@ -13,13 +16,50 @@ if __name__ == "__main__":
     parser.add_argument(
         "cell", type=int, help="Active input cell.", choices=[i for i in range(16)],
     )
+    parser.add_argument(
+        "-t",
+        type=float,
+        dest="time_limit",
+        help="Initial budget in seconds of the main queries. "
+        + "Queries running out of budget are deferred and retried later.",
+    )
+    parser.add_argument(
+        "-r",
+        type=str,
+        dest="store_file",
+        help="SQLite file of the results. Pairs with a verdict are skipped.",
+    )
+    parser.add_argument(
+        "-c",
+        action="store_true",
+        dest="compress",
+        help="Search one pair per class of values with the same DDT supports.",
+    )
+    parser.add_argument(
+        "-m",
+        type=int,
+        dest="nb_samples",
+        help="Number of sampled trails per difference proving pairs possible "
+        + "before the queries.",
+    )
+    parser.add_argument(
+        "-b",
+        type=int,
+        dest="batch",
+        default=1,
+        help="Number of pairs solved together by each call on the main model.",
+    )
     args = parser.parse_args()
 
     cell = args.cell
+    store = ResultStore(args.store_file) if args.store_file is not None else None
 
     # Main model
     mid = Skinny(nb_rounds, "skinny_sbox.pkl")
     mid.model.setParam("LogToConsole", 0)
+    sampler = None
+    if args.nb_samples is not None:
+        sampler = Sampler(mid, nb_samples=args.nb_samples)
 
     # Auxiliary input model
     aux_in = Skinny(2, "skinny_sbox.pkl")
@@ -29,14 +69,69 @@ if __name__ == "__main__":
     aux_out = Skinny(2, "skinny_sbox.pkl")
     aux_out.model.setParam("LogToConsole", 0)
 
-    for out_cell in range(16):
+    # Pairs of cells equivalent under a cell permutation give the same results.
+    # This process only searches the orbits whose canonical input cell is cell.
+    sym = CellSymmetry(mid)
+    orbits = sym.cell_pair_orbits(itertools.product(range(16), range(16)))
+    if all(in_cell != cell for (in_cell, _) in orbits):
+        covering = sorted(
+            set(
+                rep[0]
+                for rep in orbits
+                if any(i == cell for ((i, _), _) in orbits[rep])
+            )
+        )
+        print(
+            "Input cell {} is not canonical, its pairs are searched ".format(cell)
+            + "with the input cells {}.".format(covering)
+        )
+        exit(1)
+
+    for (in_cell, out_cell) in sorted(orbits):
+        if in_cell != cell:
+            continue
+
         the_dict = dict()
         for valx in range(1, 1 << 8):
-            x = valx << (8 * cell)
+            x = valx << (8 * in_cell)
             the_dict[x] = set()
             for valy in range(1, 1 << 8):
                 y = valy << (8 * out_cell)
                 the_dict[x].add(y)
 
-        message = "Skinny {}r in {} out {}.".format(nb_rounds, cell, out_cell)
-        res = mid.equimip_search(the_dict, aux_in, aux_out, message=message)
+        # Fixes the bits forced to zero by the active cells.
+        mid.set_active_input_cell(in_cell)
+        mid.set_active_output_cell(out_cell)
+        aux_in.set_active_input_cell(in_cell)
+        aux_out.set_active_output_cell(out_cell)
+
+        message = "Skinny {}r in {} out {}.".format(nb_rounds, in_cell, out_cell)
+        res = mid.equimip_search(
+            the_dict,
+            aux_in,
+            aux_out,
+            message=message,
+            time_limit=args.time_limit,
+            store=store,
+            compress=args.compress,
+            sampler=sampler,
+            batch=args.batch,
+        )
+
+        mid.unset_active_input_cell()
+        mid.unset_active_output_cell()
+        aux_in.unset_active_input_cell()
+        aux_out.unset_active_output_cell()
+
+        # Replays the results to the equivalent pairs of cells.
+        for ((i, o), perm) in orbits[in_cell, out_cell]:
+            replayed = sym.replay_cells(res, perm)
+            if store is not None:
+                config = mid.config()
+                store.record_many(config, [(x, y, False, None) for (x, y) in replayed])
+            for (x, y) in replayed:
+                print(
+                    "Impossible (in {}, out {}): {} -> {}".format(
+                        i, o, mid.format_state(x), mid.format_state(y)
+                    )
+                )
@@ -0,0 +1,319 @@
+"""
+Metrics and events of the impossible differential searches.
+
+A Metrics object counts the MIP queries of a search, their latencies and
+Gurobi statistics, the discards and the cache hits. It sends events
+(python dicts) to a list of sinks, progress events being throttled.
+"""
+import contextlib
+import json
+import math
+import threading
+import time
+
+
+class Histogram:
+    """
+    Histogram of latencies with buckets [2^k, 2^(k + 1)) milliseconds.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        ms = 1000.0 * seconds
+        k = math.floor(math.log2(ms)) if ms >= 1.0 else 0
+        self.buckets[k] = self.buckets.get(k, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count != 0 else 0.0,
+            "max": self.max,
+            "buckets_ms": {str(1 << k): self.buckets[k] for k in sorted(self.buckets)},
+        }
+
+
+class Metrics:
+    """
+    Metrics of one equimip search.
+    Query kinds are "main", "aux_in" and "aux_out".
+    sinks: callables taking an event (python dict).
+    interval: minimum number of seconds between two progress events.
+    """
+
+    kinds = ["main", "aux_in", "aux_out"]
+
+    def __init__(self, sinks=(), interval=0.5):
+        self.sinks = list(sinks)
+        self.interval = interval
+        self.message = ""
+        self.start_time = time.time()
+        self.last_event = {}
+        # Queries may be recorded from several threads.
+        self.lock = threading.Lock()
+
+        self.total = 0
+        self.done = 0
+        self.found = 0
+        self.discarded = 0
+        self.deferred = 0
+
+        self.queries = {kind: 0 for kind in self.kinds}
+        self.cache_hits = {kind: 0 for kind in self.kinds}
+        self.latency = {kind: Histogram() for kind in self.kinds}
+        self.solver = {
+            kind: {"Runtime": 0.0, "NodeCount": 0.0, "IterCount": 0.0}
+            for kind in self.kinds
+        }
+
+    def start(self, message, total):
+        self.message = message
+        self.total = total
+        self.start_time = time.time()
+        self.emit("start", force=True)
+
+    def query(self, kind, primitive, x, y, time_limit=None):
+        """
+        Times the query primitive.is_possible(x, y, time_limit) and records
+        its Gurobi statistics.
+        """
+        start = time.perf_counter()
+        possible = primitive.is_possible(x, y, time_limit=time_limit)
+        latency = time.perf_counter() - start
+        stats = {attr: primitive.model.getAttr(attr) for attr in self.solver[kind]}
+        with self.lock:
+            self.latency[kind].add(latency)
+            self.queries[kind] += 1
+            for attr in stats:
+                self.solver[kind][attr] += stats[attr]
+        return possible
+
+    def batch_query(self, kind, primitive, pairs, time_limit=None):
+        """
+        Same as query for primitive.is_possible_batch(pairs, time_limit).
+        Each pair counts as a query whose latency is its share of the call.
+        """
+        start = time.perf_counter()
+        answers = primitive.is_possible_batch(pairs, time_limit=time_limit)
+        latency = (time.perf_counter() - start) / max(1, len(pairs))
+        stats = {attr: primitive.model.getAttr(attr) for attr in self.solver[kind]}
+        with self.lock:
+            for _ in pairs:
+                self.latency[kind].add(latency)
+            self.queries[kind] += len(pairs)
+            for attr in stats:
+                self.solver[kind][attr] += stats[attr]
+        return answers
+
+    def cached_query(self, kind, primitive, cache, x, y):
+        """
+        Same as query but goes through cache (a python dict or None).
+        """
+        if cache is not None and (x, y) in cache:
+            with self.lock:
+                self.cache_hits[kind] += 1
+            return cache[x, y]
+        possible = self.query(kind, primitive, x, y)
+        if cache is not None:
+            cache[x, y] = possible
+        return possible
+
+    def discard_rate(self):
+        """
+        Number of discarded pairs per auxiliary answer. It may exceed 1 as
+        each answer of a discard phase is shared by several pairs.
+        """
+        nb = self.queries["aux_in"] + self.queries["aux_out"]
+        nb += self.cache_hits["aux_in"] + self.cache_hits["aux_out"]
+        return self.discarded / nb if nb != 0 else 0.0
+
+    def snapshot(self):
+        """
+        Current values of the metrics as a python dict.
+        """
+        return {
+            "total": self.total,
+            "done": self.done,
+            "found": self.found,
+            "discarded": self.discarded,
+            "deferred": self.deferred,
+            "discard_rate": self.discard_rate(),
+            "queries": dict(self.queries),
+            "cache_hits": dict(self.cache_hits),
+            "cache_hit_rate": {
+                kind: self.cache_hits[kind] / (self.cache_hits[kind] + self.queries[kind])
+                if self.cache_hits[kind] + self.queries[kind] != 0
+                else 0.0
+                for kind in self.kinds
+            },
+            "solver": {kind: dict(self.solver[kind]) for kind in self.kinds},
+        }
+
+    def emit(self, name, force=False, **fields):
+        """
+        Sends the event name to the sinks. Unless force is set,
+        events with the same name are sent at most once per interval.
+        """
+        now = time.time()
+        if not force and now - self.last_event.get(name, 0.0) < self.interval:
+            return
+        self.last_event[name] = now
+
+        event = {
+            "event": name,
+            "message": self.message,
+            "time": now,
+            "elapsed": now - self.start_time,
+        }
+        event.update(self.snapshot())
+        event.update(fields)
+        for sink in self.sinks:
+            sink(event)
+
+    def end(self, profiler=None):
+        """
+        Sends the final event with the latency histograms and the
+        phases of the profiler of the main model if any.
+        """
+        fields = {
+            "latency": {kind: self.latency[kind].to_dict() for kind in self.kinds}
+        }
+        if profiler is not None:
+            fields["phases"] = profiler.to_dict()
+        self.emit("end", force=True, **fields)
+
+
+class PhaseProfiler:
+    """
+    Total time spent in each phase of the queries of a model
+    ("fix", "build", "optimize" and "extract" for Primitive.is_possible).
+    """
+
+    def __init__(self):
+        self.totals = {}
+        self.counts = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[name] = self.totals.get(name, 0.0) + time.perf_counter() - start
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def to_dict(self):
+        return {
+            name: {"total": self.totals[name], "count": self.counts[name]}
+            for name in self.totals
+        }
+
+    def report(self):
+        """
+        One line per phase with its total time and its share.
+        """
+        total = sum(self.totals.values())
+        return "\n".join(
+            "{:10} {:10.3f}s {:5.1f} % ({} calls)".format(
+                name,
+                self.totals[name],
+                (100.0 * self.totals[name]) / total if total != 0 else 0.0,
+                self.counts[name],
+            )
+            for name in sorted(self.totals, key=self.totals.get, reverse=True)
+        )
+
+
+class JsonlSink:
+    """
+    Writes the events to a file, one JSON object per line.
+    Can be shared by searches running in different threads.
+    """
+
+    def __init__(self, file_name):
+        self.file = open(file_name, "a")
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(event) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ConsoleSink:
+    """
+    Prints the progress of the search as a table on the console.
+    """
+
+    def __call__(self, event):
+        name = event["event"]
+        if name == "start":
+            self.header(event)
+        elif name in ["progress", "end"]:
+            print(self.line(event), end="\n")
+        elif name == "retry":
+            print(
+                "Retrying {} deferred pairs with a budget of {}s.".format(
+                    event["pairs"], event["time_limit"]
+                )
+            )
+        elif name == "query":
+            print(
+                "MIP query on input {} and output {}".format(event["x"], event["y"]),
+                end="\r",
+            )
+        elif name == "discard":
+            print(
+                "Discarding progress "
+                + "{:.1f} %   rate {:.1f} %".format(
+                    (100.0 * event["visited"]) / max(event["remaining"], 1),
+                    (100.0 * event["path_discarded"]) / max(event["visited"], 1),
+                )
+                + " " * 30,
+                end="\r",
+            )
+
+    def header(self, event):
+        print(
+            "| {}Message |".format(" " * (len(event["message"]) - 7))
+            + " {}Time |".format(" " * (17 - 4))
+            + "  Results / {:10} |".format(event["total"])
+            + " {}MIP queries |".format(" " * (20 - 11))
+            + "  x queries |"
+            + "  y queries |"
+            + " Dis. rate |"
+            + " Found |"
+        )
+
+    def line(self, event):
+        seconds = int(event["elapsed"])
+        minutes = seconds // 60
+        hours = minutes // 60
+        str_time = "{:4}h, {:2}min, {:2}s".format(hours, minutes % 60, seconds % 60)
+        total = max(event["total"], 1)
+        queries = event["queries"]
+
+        return (
+            "| {} | {} |  {:5.1f} % = {:10} |".format(
+                event["message"], str_time, (100.0 * event["done"]) / total, event["done"]
+            )
+            + " {:10} = {:5.2f} % |".format(
+                queries["main"], (100.0 * queries["main"]) / total
+            )
+            + " {:10} |".format(queries["aux_in"])
+            + " {:10} |".format(queries["aux_out"])
+            + "   {:5.1f} % |".format(100.0 * event["discard_rate"])
+            + " {:5} |".format(event["found"])
+        )
@@ -1,9 +1,18 @@
 from gurobipy import *
 import pickle
+import numpy as np
 import utilities
+import gf2
+from metrics import Metrics, ConsoleSink
+import contextlib
+import tuning
+import os
 from itertools import product as itp
 import random
 import time
+import copy
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 class Primitive:
@@ -24,6 +33,16 @@ class Primitive:
         # Miscellaneous objects
         self.misc = {}
 
+        # Optional metrics.PhaseProfiler timing the phases of the queries.
+        self.profiler = None
+
+        # Optional trails.TrailLibrary warm starting the queries.
+        self.trails = None
+
+        # Scenario of the last is_possible_batch whose solution is read,
+        # None after is_possible.
+        self.scenario = None
+
         # Gurobi Model
         self.model = Model()
 
@@ -42,11 +61,9 @@ class Primitive:
             if other_name is None:
                 other_name = file_name
             (in_size, out_size, ddt, ineq) = pickle.load(f)
-            self.sbox_modelings[other_name] = (
-                utilities.ddt_rows(ddt, in_size, out_size),
-                utilities.ddt_cols(ddt, in_size, out_size),
-                ineq,
-            )
+            # Supports of the rows and columns as bit masks.
+            (rows, cols) = utilities.ddt_masks(ddt, in_size, out_size)
+            self.sbox_modelings[other_name] = (rows, cols, ineq)
 
     def add_sbox_constr(self, sbox_name, a, b):
         """ 
@@ -54,20 +71,25 @@ class Primitive:
         add_sbox_modelings[sbox_name].
         a is a list of input variables,
         b is a list of output variables,
+        Returns the list of the constraints.
         """
 
         n = len(a)
         m = len(b)
         (_, _, ineqs) = self.sbox_modelings[sbox_name]
         # ineqs = self.sbox_modelings[sbox_name]
+        constrs = []
         for ineg in ineqs:
             assert len(ineg) == n + m + 1
-            self.model.addConstr(
-                quicksum(ineg[i] * a[i] for i in range(n))
-                + quicksum(ineg[i + n] * b[i] for i in range(m))
-                + ineg[n + m]
-                >= 0
+            constrs.append(
+                self.model.addConstr(
+                    quicksum(ineg[i] * a[i] for i in range(n))
+                    + quicksum(ineg[i + n] * b[i] for i in range(m))
+                    + ineg[n + m]
+                    >= 0
+                )
             )
+        return constrs
 
     def add_xor_constr(self, variables, offset=0, mode="binary"):
         """
@@ -110,53 +132,73 @@ class Primitive:
             variables = [x[j] for j in range(len(x)) if row[j] != 0]
             self.add_xor_constr(variables, offset=y[i], mode=mode)
 
+    def phase(self, name):
+        """
+        Context timing the phase name of a query if there is a profiler.
+        """
+        if self.profiler is None:
+            return contextlib.nullcontext()
+        return self.profiler.phase(name)
+
+    def solution_value(self, variables):
+        """
+        Returns the integer whose bit i is the value of variables[i]
+        in the last solution.
+        """
+        attr = "X" if self.scenario is None else "ScenNX"
+        with self.phase("extract"):
+            return utilities.from_bits(self.model.getAttr(attr, variables))
+
     def last_input_diff(self):
         """
         Returns the value of the input difference in the last solution.
         """
-        x = 0
-        for i in range(self.in_size):
-            if self.in_var[i].x >= 0.5:
-                x ^= 1 << i
-
-        return x
+        return self.solution_value([self.in_var[i] for i in range(self.in_size)])
 
     def last_output_diff(self):
         """
         Returns the value of the output difference in the last solution.
         """
-        x = 0
-        for i in range(self.out_size):
-            if self.out_var[i].x >= 0.5:
-                x ^= 1 << i
+        return self.solution_value([self.out_var[i] for i in range(self.out_size)])
+
+    def fix_variables(self, variables, value):
+        """
+        Fixes the binary variables to the bits of value through their bounds.
+        """
+        bit_list = utilities.bits_array(value, len(variables)).tolist()
+        self.fix_bits(variables, bit_list)
 
-        return x
+    def fix_bits(self, variables, bit_list):
+        self.model.setAttr("LB", variables, bit_list)
+        self.model.setAttr("UB", variables, bit_list)
+
+    def input_fixings(self, in_diff):
+        """
+        Returns (variables, bits) fixed by set_input_diff(in_diff).
+        """
+        variables = [self.in_var[i] for i in range(self.in_size)]
+        return (variables, utilities.bits_array(in_diff, self.in_size).tolist())
+
+    def output_fixings(self, out_diff):
+        """
+        Returns (variables, bits) fixed by set_output_diff(out_diff).
+        """
+        variables = [self.out_var[i] for i in range(self.out_size)]
+        return (variables, utilities.bits_array(out_diff, self.out_size).tolist())
 
     def set_input_diff(self, in_diff):
         """
         Sets the input difference for impossible differential
         search.
         """
-        bit_list = utilities.bits(in_diff, self.in_size)
-
-        for i in range(self.in_size):
-            key = "in_{}".format(i)
-            if key in self.misc:
-                self.model.remove(self.misc[key])
-            self.misc[key] = self.model.addConstr(self.in_var[i] == bit_list[i])
+        self.fix_bits(*self.input_fixings(in_diff))
 
     def set_output_diff(self, out_diff):
         """
         Sets the output difference for impossible differential
         search.
         """
-        bit_list = utilities.bits(out_diff, self.out_size)
-
-        for i in range(self.out_size):
-            key = "out_{}".format(i)
-            if key in self.misc:
-                self.model.remove(self.misc[key])
-            self.misc[key] = self.model.addConstr(self.out_var[i] == bit_list[i])
+        self.fix_bits(*self.output_fixings(out_diff))
 
     def set_search_space(self, the_set):
         """
@@ -171,21 +213,298 @@ class Primitive:
         """
         return "{}".format(x)
 
-    def is_possible(self, x, y):
+    def copy(self, env=None):
+        """
+        Returns an independent copy of this primitive with its own
+        copy of the Gurobi model. Much cheaper than building the model
+        again.
+        The copy is made in the Gurobi environment env, a new one by default:
+        environments are not thread-safe, so models solved in parallel
+        must not share one.
+        """
+        self.model.update()
+        other = copy.copy(self)
+        if env is None:
+            env = Env(empty=True)
+            for name in ["OutputFlag", "LogToConsole"]:
+                env.setParam(name, self.model.getParamInfo(name)[2])
+            env.start()
+        other.model = self.model.copy(env=env)
+
+        # The parameters of the model are not copied to another environment.
+        for name in dir(GRB.Param):
+            if not name.startswith("_"):
+                (_, _, value, _, _, default) = self.model.getParamInfo(name)
+                if value != default:
+                    other.model.setParam(name, value)
+
+        variables = other.model.getVars()
+        constrs = other.model.getConstrs()
+
+        # Maps a Gurobi variable or constraint of this model (or a set or list
+        # of them) to the same object in the model of the copy.
+        def remap(obj):
+            if isinstance(obj, Var):
+                return variables[obj.index]
+            if isinstance(obj, Constr):
+                return constrs[obj.index]
+            if isinstance(obj, (set, list)):
+                return type(obj)(remap(o) for o in obj)
+            return obj
+
+        self.copy_attributes(other, remap)
+        return other
+
+    def copy_attributes(self, other, remap):
+        """
+        Sets the attributes of the copy other that refer to
+        Gurobi objects. remap maps them from this model to the other one.
+        """
+        other.in_var = {i: remap(v) for (i, v) in self.in_var.items()}
+        other.out_var = {i: remap(v) for (i, v) in self.out_var.items()}
+        other.misc = {key: remap(v) for (key, v) in self.misc.items()}
+
+    def is_possible(self, x, y, time_limit=None):
         """
         Outputs whether the pair (x, y) is a possible transition
         or not.
+        If time_limit is given, the solver stops at the first solution
+        or after time_limit seconds. In the latter case, the answer is None.
         """
-        self.set_input_diff(x)
-        self.set_output_diff(y)
-        self.model.optimize()
+        self.clear_scenarios()
+        with self.phase("fix"):
+            self.set_input_diff(x)
+            self.set_output_diff(y)
+            if self.trails is not None:
+                self.trails.warm_start(self, x, y)
+        # Gurobi builds the pending modifications of the model lazily.
+        with self.phase("build"):
+            self.model.update()
+        callback = self.optimize_callback()
+        with self.phase("optimize"):
+            if time_limit is None:
+                self.model.optimize(callback)
+            else:
+                params = self.model.Params
+                saved = (params.TimeLimit, params.SolutionLimit)
+                params.TimeLimit = time_limit
+                params.SolutionLimit = 1
+                try:
+                    self.model.optimize(callback)
+                finally:
+                    (params.TimeLimit, params.SolutionLimit) = saved
         status = self.model.status
+        if status == gurobipy.GRB.TIME_LIMIT:
+            assert time_limit is not None
+            if self.model.SolCount == 0:
+                return None
+            if self.trails is not None:
+                self.trails.record(self, x, y)
+            return True
+        # SOLUTION_LIMIT when the solver stops at the first solution.
         output_choices = [
             gurobipy.GRB.OPTIMAL,
+            gurobipy.GRB.SOLUTION_LIMIT,
             gurobipy.GRB.INFEASIBLE,
         ]
         assert status in output_choices
-        return status == gurobipy.GRB.OPTIMAL
+        possible = status != gurobipy.GRB.INFEASIBLE
+        if possible and self.trails is not None:
+            self.trails.record(self, x, y)
+        return possible
+
+    def is_possible_batch(self, pairs, time_limit=None):
+        """
+        Same as is_possible on each pair of the list pairs, in one call:
+        the pairs only change the bounds of the input and output variables,
+        then they are solved as the scenarios of the model (Gurobi
+        multi-scenario), which share the presolve and the tree.
+        Returns the list of the answers. With time_limit, the pairs that are
+        not decided after time_limit seconds get None.
+        The solution of the scenario of pair i is read after select_scenario(i).
+        """
+        self.clear_scenarios()
+        if len(pairs) == 0:
+            return []
+
+        with self.phase("fix"):
+            # The trail of the last warm start is not one of the scenarios.
+            self.clear_warm_start()
+            # The fixings of set_input_diff and set_output_diff become the
+            # bounds of the scenarios.
+            self.model.NumScenarios = len(pairs)
+            for (s, (x, y)) in enumerate(pairs):
+                (in_vars, in_bits) = self.input_fixings(x)
+                (out_vars, out_bits) = self.output_fixings(y)
+                self.model.Params.ScenarioNumber = s
+                self.model.setAttr("ScenNLB", in_vars + out_vars, in_bits + out_bits)
+                self.model.setAttr("ScenNUB", in_vars + out_vars, in_bits + out_bits)
+        with self.phase("build"):
+            self.model.update()
+        callback = self.optimize_callback()
+        with self.phase("optimize"):
+            # A solution limit (see tuning.py) would stop the search before
+            # all the scenarios are solved.
+            params = self.model.Params
+            saved = (params.TimeLimit, params.SolutionLimit)
+            if time_limit is not None:
+                params.TimeLimit = time_limit
+            params.SolutionLimit = GRB.MAXINT
+            try:
+                self.model.optimize(callback)
+            finally:
+                (params.TimeLimit, params.SolutionLimit) = saved
+
+        # All the scenarios are solved unless the time limit is reached, then
+        # the ones without a solution are not decided.
+        status = self.model.status
+        if status == GRB.TIME_LIMIT:
+            assert time_limit is not None
+        else:
+            assert status in [GRB.OPTIMAL, GRB.INFEASIBLE]
+        out = []
+        for (s, (x, y)) in enumerate(pairs):
+            self.select_scenario(s)
+            # The objective is zero: ScenNObjVal is finite iff there is a solution.
+            if self.model.ScenNObjVal < GRB.INFINITY:
+                out.append(True)
+                if self.trails is not None:
+                    self.trails.record(self, x, y)
+            else:
+                out.append(False if status != GRB.TIME_LIMIT else None)
+        return out
+
+    def clear_warm_start(self):
+        """
+        Removes the hints and the MIP start given to the trail variables
+        (see trails.py).
+        """
+        variables = self.trail_vars()
+        undefined = [GRB.UNDEFINED] * len(variables)
+        self.model.setAttr("VarHintVal", variables, undefined)
+        self.model.setAttr("Start", variables, undefined)
+
+    def select_scenario(self, scenario):
+        """
+        The solution values (see solution_value) are read from this scenario
+        of the last is_possible_batch.
+        """
+        self.scenario = scenario
+        self.model.Params.ScenarioNumber = scenario
+
+    def clear_scenarios(self):
+        """
+        Removes the scenarios of the last is_possible_batch.
+        """
+        if self.scenario is not None:
+            self.model.NumScenarios = 0
+            self.scenario = None
+
+    def trail_vars(self):
+        """
+        Variables whose values make a trail (see trails.py).
+        """
+        return [self.in_var[i] for i in range(self.in_size)] + [
+            self.out_var[i] for i in range(self.out_size)
+        ]
+
+    def get_trail(self):
+        """
+        Values of trail_vars in the last solution, packed into an integer.
+        """
+        return self.solution_value(self.trail_vars())
+
+    def optimize_callback(self):
+        """
+        Returns the Gurobi callback of the queries or None.
+        Bound to this model, so that copies get their own.
+        """
+        return None
+
+    def fast_filters(self):
+        """
+        Returns the list of filters applied by search_impossible_diff
+        before solving. A filter takes a list of pairs (x, y) and returns a
+        map (python dict) from the pairs it can decide to whether they are
+        possible.
+        """
+        return []
+
+    def possibility_stream(self, pairs, workers=1, filters=None):
+        """
+        Yields (x, y, possible) for all the pairs (x, y) of the iterable pairs,
+        as soon as they are known.
+        Duplicates are removed and the pairs are sorted so that queries with
+        the same input are consecutive. The pairs decided by the filters
+        (defaults to fast_filters()) come first, then the other ones are solved
+        by workers copies of this model running concurrently.
+        """
+        pairs = sorted(set(pairs))
+        if filters is None:
+            filters = self.fast_filters()
+
+        for the_filter in filters:
+            decided = the_filter(pairs)
+            for (x, y) in pairs:
+                if (x, y) in decided:
+                    yield (x, y, decided[x, y])
+            pairs = [pair for pair in pairs if pair not in decided]
+
+        if len(pairs) == 0:
+            return
+
+        # A model is solved by one thread at a time and the copies have their
+        # own Gurobi environments (see copy), as environments are not
+        # thread-safe.
+        models = queue.Queue()
+        models.put(self)
+        for _ in range(min(workers, len(pairs)) - 1):
+            models.put(self.copy())
+
+        def solve(x, y):
+            primitive = models.get()
+            try:
+                return primitive.is_possible(x, y)
+            finally:
+                models.put(primitive)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(solve, x, y): (x, y) for (x, y) in pairs}
+            for future in as_completed(futures):
+                (x, y) = futures[future]
+                yield (x, y, future.result())
+
+    def search_impossible_diff(self, pairs=None, message="", workers=1, filters=None):
+        """
+        Returns the list of the impossible pairs among the iterable pairs
+        (defaults to the search space given by set_search_space).
+        See possibility_stream for the other parameters.
+        """
+        if pairs is None:
+            pairs = self.misc["imp_diff_search_space"]
+
+        out = []
+        nb_pairs = 0
+        start = time.time()
+        for (x, y, possible) in self.possibility_stream(pairs, workers, filters):
+            nb_pairs += 1
+            if not possible:
+                out.append((x, y))
+
+        print(
+            "{} {} impossible out of {} pairs in {:.1f}s.".format(
+                message, len(out), nb_pairs, time.time() - start
+            )
+        )
+        return out
+
+
+def zero_filter(pairs):
+    """
+    Filter deciding the pairs with a zero input or output difference
+    for bijective primitives.
+    """
+    return {(x, y): x == y for (x, y) in pairs if x == 0 or y == 0}
 
 
 class AesLike(Primitive):
@@ -233,11 +552,18 @@ class AesLike(Primitive):
             self.in_var[i] = in_sbox[0, i]
             self.out_var[i] = out_sbox[nb_rounds - 1, i]
 
+        # Constraints of each Sbox (round, cell), None when it is removed
+        # from the model because its cell is forced to zero.
+        self.sbox_constrs = {}
+        # See set_sbox_mode.
+        self.sbox_mode = "full"
         for i in range(nb_rounds):
-            self.subcell(
+            groups = self.subcell(
                 [in_sbox[i, j] for j in range(state_size)],
                 [out_sbox[i, j] for j in range(state_size)],
             )
+            for (cell, constrs) in enumerate(groups):
+                self.sbox_constrs[i, cell] = constrs
 
         for i in range(nb_rounds - 1):
             self.linear_layer(
@@ -248,15 +574,250 @@ class AesLike(Primitive):
         self.in_sbox = in_sbox
         self.out_sbox = out_sbox
 
+        # Gurobi parameters found by tuning.py for this configuration, if any.
+        tuning.apply_tuned_params(self)
+
         random.seed()
 
+    def config(self):
+        """
+        Identifies the configuration of this model.
+        mixcol_name is set by the subclasses.
+        """
+        return {
+            "cipher": type(self).__name__,
+            "rounds": self.nb_rounds,
+            "sbox": os.path.basename(self.sbox_name),
+            "mixcol": self.mixcol_name,
+        }
+
+    def add_round(self):
+        """
+        Extends the model by one round instead of building it again:
+        adds the linear layer after the last Sbox layer and a new Sbox layer
+        whose output becomes the output of the model.
+        """
+        # Constraints on the last rounds would be wrong after the extension.
+        assert not any(key.startswith("out_cell") for key in self.misc)
+
+        r = self.nb_rounds
+        n = self.state_size
+
+        # The previous output is not fixed anymore.
+        old_out = [self.out_var[i] for i in range(n)]
+        self.model.setAttr("LB", old_out, [0] * n)
+        self.model.setAttr("UB", old_out, [1] * n)
+
+        for j in range(n):
+            self.in_sbox[r, j] = self.model.addVar(
+                name="in_sbox_\{%s, %s\}" % (r, j), vtype=gurobipy.GRB.BINARY
+            )
+        for j in range(n):
+            self.out_sbox[r, j] = self.model.addVar(
+                name="out_sbox_\{%s, %s\}" % (r, j), vtype=gurobipy.GRB.BINARY
+            )
+
+        self.linear_layer(
+            [self.out_sbox[r - 1, j] for j in range(n)],
+            [self.in_sbox[r, j] for j in range(n)],
+        )
+        for cell in range(self.nb_nibbles):
+            self.sbox_constrs[r, cell] = self.add_sbox_group(r, cell)
+
+        for i in range(n):
+            self.out_var[i] = self.out_sbox[r, i]
+        self.nb_rounds = r + 1
+
+        # The propagation from the active input cell goes one round further.
+        for key in list(self.misc):
+            if key.startswith("in_cell_"):
+                cell = int(key[len("in_cell_") :])
+                self.misc[key] = self.truncated_masks(self.cell_mask(cell), True)
+        self.update_zero_fixings()
+
+        # The stored trails do not cover the new round.
+        if self.trails is not None:
+            self.trails.clear()
+
+        tuning.apply_tuned_params(self)
+
+    def round_sweep(
+        self, pairs, max_rounds, aux_in=None, aux_out=None, workers=1, message=""
+    ):
+        """
+        Searches for the longest impossible differentials among pairs.
+        The impossible pairs for the current number of rounds r are the
+        candidates for r + 1 rounds and the model is extended with add_round
+        until no candidate is left or max_rounds is reached. Restricting the
+        candidates this way assumes that the impossible differentials on
+        r + 1 rounds are also impossible on r rounds, which is the usual
+        behaviour of these truncated-like searches but not a theorem.
+        With auxiliary models, each round count is searched with
+        equimip_search, otherwise with search_impossible_diff.
+        Returns a map from the number of rounds to the impossible pairs.
+        """
+        candidates = list(pairs)
+        results = {}
+        while True:
+            round_message = "{} {}r.".format(message, self.nb_rounds)
+            if aux_in is not None and aux_out is not None:
+                the_dict = {}
+                for (x, y) in candidates:
+                    the_dict.setdefault(x, set()).add(y)
+                impossible = self.equimip_search(
+                    the_dict, aux_in, aux_out, message=round_message
+                )
+            else:
+                impossible = self.search_impossible_diff(
+                    candidates, message=round_message, workers=workers
+                )
+            results[self.nb_rounds] = impossible
+
+            if len(impossible) == 0 or self.nb_rounds >= max_rounds:
+                return results
+
+            candidates = impossible
+            self.add_round()
+
     def subcell(self, in_sbox, out_sbox):
+        """
+        Adds the Sbox constraints of one round.
+        Returns the list of the constraints of each cell.
+        """
         n = self.nb_nibbles
         d = self.nibble_size
+        groups = []
         for nibble in range(n):
             a = [in_sbox[(d * nibble) + i] for i in range(d)]
             b = [out_sbox[(d * nibble) + i] for i in range(d)]
-            self.add_sbox_constr(self.sbox_name, a, b)
+            groups.append(self.add_sbox_constr(self.sbox_name, a, b))
+        return groups
+
+    def sbox_vars(self, r, cell):
+        """
+        Input and output variables of the Sbox (r, cell).
+        """
+        d = self.nibble_size
+        a = [self.in_sbox[r, (d * cell) + i] for i in range(d)]
+        b = [self.out_sbox[r, (d * cell) + i] for i in range(d)]
+        return (a, b)
+
+    def add_sbox_group(self, r, cell):
+        """
+        Adds the constraints of the Sbox (r, cell) for the current sbox_mode.
+        Returns the list of the constraints.
+        """
+        (a, b) = self.sbox_vars(r, cell)
+        if self.sbox_mode == "full":
+            return self.add_sbox_constr(self.sbox_name, a, b)
+
+        constrs = self.add_sbox_constr(self.sbox_name + ":core", a, b)
+        if self.sbox_mode == "lazy":
+            rest = self.add_sbox_constr(self.sbox_name + ":rest", a, b)
+            self.model.setAttr("Lazy", rest, [1] * len(rest))
+            constrs += rest
+        return constrs
+
+    def set_sbox_mode(self, mode, core=16):
+        """
+        Chooses how the Sbox inequalities are added to the model:
+            "full": all of them (default).
+            "lazy": the core inequalities, the others with the Lazy attribute.
+                Gurobi only adds them to the LP when a solution violates them.
+            "callback": only the core inequalities. A callback checks the
+                candidate solutions against the DDT and adds a violated
+                inequality when an Sbox transition is impossible.
+        The core inequalities are the core ones cutting the largest numbers
+        of impossible transitions of the DDT.
+        """
+        assert mode in ["full", "lazy", "callback"]
+        (rows, cols, ineqs) = self.sbox_modelings[self.sbox_name]
+        ineqs = sorted(ineqs)
+        d = self.nibble_size
+
+        # Number of impossible transitions cut by each inequality.
+        support = np.array(
+            [utilities.bits_array(row, 1 << d) for row in rows], dtype=bool
+        )
+        (a, b) = np.nonzero(~support)
+        shifts = np.arange(d)
+        impossible = np.concatenate(
+            [
+                (a[:, None] >> shifts) & 1,
+                (b[:, None] >> shifts) & 1,
+                np.ones((len(a), 1), dtype=np.int64),
+            ],
+            axis=1,
+        )
+        matrix = np.array(ineqs, dtype=np.int64)
+        counts = np.zeros(len(ineqs), dtype=np.int64)
+        for start in range(0, len(impossible), 4096):
+            counts += ((impossible[start : start + 4096] @ matrix.T) < 0).sum(axis=0)
+        order = sorted(range(len(ineqs)), key=lambda k: -counts[k])
+
+        self.sbox_modelings[self.sbox_name + ":core"] = (
+            rows,
+            cols,
+            [ineqs[k] for k in order[:core]],
+        )
+        self.sbox_modelings[self.sbox_name + ":rest"] = (
+            rows,
+            cols,
+            [ineqs[k] for k in order[core:]],
+        )
+        self.rest_matrix = matrix[order[core:]]
+
+        self.sbox_mode = mode
+        for key in self.sbox_constrs:
+            constrs = self.sbox_constrs[key]
+            # Sboxes removed by the active cells stay removed.
+            if constrs is not None:
+                for constr in constrs:
+                    self.model.remove(constr)
+                self.sbox_constrs[key] = self.add_sbox_group(*key)
+
+        self.model.setParam("LazyConstraints", 1 if mode == "callback" else 0)
+
+    def optimize_callback(self):
+        if self.sbox_mode != "callback":
+            return None
+        # Parameters may have been reset since set_sbox_mode (tuning.py).
+        self.model.Params.LazyConstraints = 1
+
+        (rows, _, _) = self.sbox_modelings[self.sbox_name]
+        d = self.nibble_size
+        groups = [
+            key for key in self.sbox_constrs if self.sbox_constrs[key] is not None
+        ]
+        variables = []
+        for key in groups:
+            (a, b) = self.sbox_vars(*key)
+            variables += a + b
+
+        def callback(model, where):
+            if where != GRB.Callback.MIPSOL:
+                return
+            values = model.cbGetSolution(variables)
+            for (k, key) in enumerate(groups):
+                bits = values[(2 * d * k) : (2 * d * (k + 1))]
+                a = utilities.from_bits(bits[:d])
+                b = utilities.from_bits(bits[d:])
+                if (rows[a] >> b) & 1:
+                    continue
+                # One of the other inequalities of the model cuts (a, b).
+                point = np.array([round(v) for v in bits] + [1], dtype=np.int64)
+                violated = np.nonzero(self.rest_matrix @ point < 0)[0]
+                assert len(violated) != 0
+                ineg = self.rest_matrix[violated[0]]
+                (a_vars, b_vars) = self.sbox_vars(*key)
+                model.cbLazy(
+                    quicksum(int(ineg[i]) * a_vars[i] for i in range(d))
+                    + quicksum(int(ineg[i + d]) * b_vars[i] for i in range(d))
+                    + int(ineg[2 * d])
+                    >= 0
+                )
+
+        return callback
 
     def linear_layer(self, x_in, x_out):
         """
@@ -265,6 +826,319 @@ class AesLike(Primitive):
         # To be implemented for each primitive
         raise NotImplementedError
 
+    def copy_attributes(self, other, remap):
+        Primitive.copy_attributes(self, other, remap)
+        other.in_sbox = {key: remap(v) for (key, v) in self.in_sbox.items()}
+        other.out_sbox = {key: remap(v) for (key, v) in self.out_sbox.items()}
+        other.sbox_constrs = {key: remap(v) for (key, v) in self.sbox_constrs.items()}
+
+    def trail_vars(self):
+        """
+        Input and output of the Sbox layers, round by round.
+        """
+        out = []
+        for r in range(self.nb_rounds):
+            out += [self.in_sbox[r, i] for i in range(self.state_size)]
+            out += [self.out_sbox[r, i] for i in range(self.state_size)]
+        return out
+
+    def fast_filters(self):
+        """
+        The Sbox is a permutation and the linear layer is invertible,
+        then a zero difference can only go to a zero difference.
+        """
+        return Primitive.fast_filters(self) + [zero_filter, self.truncated_filter]
+
+    def linear_layer_masks(self):
+        """
+        Returns the rows of linear_layer_matrix and of its inverse,
+        computed once for all the copies of the model.
+        """
+        if not hasattr(self, "lin_masks"):
+            rows = self.linear_layer_matrix()
+            self.lin_masks = (rows, utilities.inverse_matrix(rows))
+        return self.lin_masks
+
+    def linear_layer_gf2(self):
+        """
+        Returns the linear layer and its inverse as gf2.BitMatrix objects,
+        to evaluate them on many states at once.
+        """
+        if not hasattr(self, "lin_gf2"):
+            (rows, inv_rows) = self.linear_layer_masks()
+            self.lin_gf2 = (gf2.BitMatrix(rows), gf2.BitMatrix(inv_rows))
+        return self.lin_gf2
+
+    def cell_mask(self, cell):
+        d = self.nibble_size
+        return ((1 << d) - 1) << (d * cell)
+
+    def cells_mask(self, mask):
+        """
+        Mask of all the bits of the cells with a bit in mask.
+        """
+        out = 0
+        for cell in range(self.nb_nibbles):
+            if mask & self.cell_mask(cell):
+                out |= self.cell_mask(cell)
+        return out
+
+    def truncated_masks(self, mask, forward):
+        """
+        Truncated propagation of the differences whose bits are in mask,
+        from the input of the first Sbox layer if forward is True, else
+        from the output of the last Sbox layer.
+        An Sbox may set any bit of an active cell and the linear layer may
+        set an output bit iff it depends on a bit that may be set.
+        Returns (in_masks, out_masks): in_masks[r] (resp. out_masks[r]) is the
+        mask of the bits of in_sbox[r] (resp. out_sbox[r]) that may be set.
+        """
+        (rows, inv_rows) = self.linear_layer_masks()
+        n = self.state_size
+        in_masks = [0] * self.nb_rounds
+        out_masks = [0] * self.nb_rounds
+
+        def propagate(matrix, mask):
+            return sum([1 << i for i in range(n) if matrix[i] & mask])
+
+        if forward:
+            in_masks[0] = mask
+            for r in range(self.nb_rounds):
+                out_masks[r] = self.cells_mask(in_masks[r])
+                if r + 1 < self.nb_rounds:
+                    in_masks[r + 1] = propagate(rows, out_masks[r])
+        else:
+            out_masks[-1] = mask
+            for r in reversed(range(self.nb_rounds)):
+                in_masks[r] = self.cells_mask(out_masks[r])
+                if r > 0:
+                    out_masks[r - 1] = propagate(inv_rows, in_masks[r])
+
+        return (tuple(in_masks), tuple(out_masks))
+
+    def truncated_filter(self, pairs):
+        """
+        Filter deciding the pairs that are impossible at the truncated level:
+        a cell of y is not reachable from x, or the truncated propagations of
+        x forward and of y backward have no common non zero state.
+        """
+        forward = {}
+        backward = {}
+        out = {}
+        for (x, y) in pairs:
+            if x == 0 or y == 0:
+                continue
+            x_cells = self.cells_mask(x)
+            y_cells = self.cells_mask(y)
+            if x_cells not in forward:
+                forward[x_cells] = self.truncated_masks(x_cells, True)
+            if y_cells not in backward:
+                backward[y_cells] = self.truncated_masks(y_cells, False)
+            (fwd_in, fwd_out) = forward[x_cells]
+            (bwd_in, bwd_out) = backward[y_cells]
+
+            if y_cells & ~fwd_out[-1] or x_cells & ~bwd_in[0]:
+                out[x, y] = False
+            elif any(
+                fwd_in[r] & bwd_in[r] == 0 or fwd_out[r] & bwd_out[r] == 0
+                for r in range(self.nb_rounds)
+            ):
+                out[x, y] = False
+        return out
+
+    def to_model_output(self, out_diff):
+        """
+        Value of the output variables for the output difference out_diff.
+        """
+        return out_diff
+
+    def support_classes(self, the_dict):
+        """
+        Groups the pairs of the_dict (see equimip_search) by the supports of
+        the DDT rows of their input cells and of the DDT columns of their
+        output cells. Only the support of the first and last Sbox layers
+        depends on them, so the pairs of a class have the same answer.
+        With one round, these layers are the same and the pairs are grouped
+        by the DDT support of each of their (input cell, output cell).
+        Returns a dict in the format of the_dict with one representative
+        pair per class and the map from a representative to its class.
+        """
+        (rows, cols, _) = self.sbox_modelings[self.sbox_name]
+        d = self.nibble_size
+        mask = (1 << d) - 1
+
+        def key(x, masks):
+            return tuple(masks[(x >> (d * i)) & mask] for i in range(self.nb_nibbles))
+
+        reps = {}
+        classes = {}
+        if self.nb_rounds == 1:
+            pair_reps = {}
+            for x in the_dict:
+                for y in the_dict[x]:
+                    y_model = self.to_model_output(y)
+                    pair_key = tuple(
+                        (rows[(x >> (d * i)) & mask] >> ((y_model >> (d * i)) & mask))
+                        & 1
+                        for i in range(self.nb_nibbles)
+                    )
+                    (x_rep, y_rep) = pair_reps.setdefault(pair_key, (x, y))
+                    reps.setdefault(x_rep, set()).add(y_rep)
+                    classes.setdefault((x_rep, y_rep), []).append((x, y))
+            return (reps, classes)
+
+        in_reps = {}
+        out_reps = {}
+        out_keys = {}
+        for x in the_dict:
+            x_rep = in_reps.setdefault(key(x, rows), x)
+            for y in the_dict[x]:
+                if y not in out_keys:
+                    out_keys[y] = key(self.to_model_output(y), cols)
+                y_rep = out_reps.setdefault(out_keys[y], y)
+                reps.setdefault(x_rep, set()).add(y_rep)
+                classes.setdefault((x_rep, y_rep), []).append((x, y))
+        return (reps, classes)
+
+    def update_zero_fixings(self):
+        """
+        Fixes to zero the internal variables that the active input and
+        output cells force to zero (the input and output variables are fixed
+        by the queries) and removes the Sbox constraints of the cells forced
+        to zero. Brings back the ones that are no longer forced to zero.
+        """
+        n = self.state_size
+        d = self.nibble_size
+        full = (1 << n) - 1
+        in_masks = [full] * self.nb_rounds
+        out_masks = [full] * self.nb_rounds
+        for key in self.misc:
+            if key.startswith("in_cell_") or key.startswith("out_cell_"):
+                (key_in, key_out) = self.misc[key]
+                for r in range(self.nb_rounds):
+                    in_masks[r] &= key_in[r]
+                    out_masks[r] &= key_out[r]
+
+        variables = []
+        bounds = []
+        for r in range(self.nb_rounds):
+            for i in range(n):
+                if r != 0:
+                    variables.append(self.in_sbox[r, i])
+                    bounds.append((in_masks[r] >> i) & 1)
+                if r != self.nb_rounds - 1:
+                    variables.append(self.out_sbox[r, i])
+                    bounds.append((out_masks[r] >> i) & 1)
+        self.model.setAttr("UB", variables, bounds)
+
+        # The Sbox constraints linking an input or output variable
+        # are kept: they force the query to respect the active cells.
+        for (r, cell) in self.sbox_constrs:
+            mask = self.cell_mask(cell)
+            internal = r != 0 and r != self.nb_rounds - 1
+            zero = in_masks[r] & mask == 0 and out_masks[r] & mask == 0
+            constrs = self.sbox_constrs[r, cell]
+            if internal and zero and constrs is not None:
+                for constr in constrs:
+                    self.model.remove(constr)
+                self.sbox_constrs[r, cell] = None
+            elif not (internal and zero) and constrs is None:
+                self.sbox_constrs[r, cell] = self.add_sbox_group(r, cell)
+
+    def set_active_input_cell(self, cell):
+        """
+        Restricts the model to the input differences with only cell active.
+        The bits forced to zero by the truncated propagation of this cell
+        are fixed and the Sbox constraints of the inactive cells are removed.
+        """
+        assert 0 <= cell and cell < self.nb_nibbles
+        # Checks that no active input cell has been set before.
+        assert not any(key.startswith("in_cell_") for key in self.misc)
+
+        key = "in_cell_{}".format(cell)
+        self.misc[key] = self.truncated_masks(self.cell_mask(cell), True)
+        self.update_zero_fixings()
+
+    def set_active_output_cell(self, cell):
+        """
+        Same as above but for the output.
+        """
+        assert 0 <= cell and cell < self.nb_nibbles
+        assert not any(key.startswith("out_cell_") for key in self.misc)
+
+        key = "out_cell_{}".format(cell)
+        self.misc[key] = self.truncated_masks(self.cell_mask(cell), False)
+        self.update_zero_fixings()
+
+    def unset_active_input_cell(self):
+        """
+        Removes the active input cell restriction.
+        """
+        for key in list(self.misc):
+            if key.startswith("in_cell_"):
+                del self.misc[key]
+        self.update_zero_fixings()
+
+    def unset_active_output_cell(self):
+        """
+        Same as above but for the output.
+        """
+        for key in list(self.misc):
+            if key.startswith("out_cell_"):
+                del self.misc[key]
+        self.update_zero_fixings()
+
+    def linear_layer_matrix(self):
+        """
+        Returns the binary matrix of the linear layer exactly as it is
+        modeled by linear_layer, as a list of state_size integers:
+        bit j of row i is set if output bit i depends on input bit j.
+        The XOR constraints that linear_layer would add are recorded
+        instead of added, then solved for the output bits.
+        """
+        n = self.state_size
+        relations = []
+
+        def record(matrix, x, b, mode="binary"):
+            y = utilities.bits(b, len(matrix))
+            for i in range(len(matrix)):
+                assert y[i] == 0
+                mask = 0
+                for j in range(len(x)):
+                    if matrix[i][j] != 0:
+                        mask ^= 1 << x[j]
+                relations.append(mask)
+
+        # Variables are replaced by their indices: 0..n-1 for the input
+        # and n..2n-1 for the output.
+        self.add_bin_matrix_constr = record
+        try:
+            self.linear_layer(list(range(n)), list(range(n, 2 * n)))
+        finally:
+            del self.add_bin_matrix_constr
+
+        # Gaussian elimination on the output bits.
+        rows = [0] * n
+        for i in range(n):
+            pivot = 1 << (n + i)
+            index = None
+            for k in range(len(relations)):
+                if relations[k] & pivot:
+                    index = k
+                    break
+            assert index is not None, "Linear layer is not invertible."
+            relation = relations.pop(index)
+            relations = [r ^ relation if r & pivot else r for r in relations]
+            rows = [r ^ relation if r & pivot else r for r in rows]
+            rows[i] = relation
+
+        mask = (1 << n) - 1
+        for i in range(n):
+            assert rows[i] >> n == 1 << i
+            rows[i] &= mask
+
+        return rows
+
     def format_state(self, x):
         """
         Gives a nice representation of a state.
@@ -295,24 +1169,33 @@ class AesLike(Primitive):
         Gets the state at the input of round r.
         """
         assert r < self.nb_rounds
-        out = 0
-        for i in range(self.state_size):
-            if self.in_sbox[r, i].x >= 0.5:
-                out ^= 1 << i
-        return out
+        return self.solution_value([self.in_sbox[r, i] for i in range(self.state_size)])
 
     def get_state_out_sbox(self, r):
         """
         Gets the state at the output of round r.
         """
         assert r < self.nb_rounds
-        out = 0
-        for i in range(self.state_size):
-            if self.out_sbox[r, i].x >= 0.5:
-                out ^= 1 << i
-        return out
+        return self.solution_value(
+            [self.out_sbox[r, i] for i in range(self.state_size)]
+        )
 
-    def equimip_search(self, the_dict, aux_in, aux_out, message=""):
+    def equimip_search(
+        self,
+        the_dict,
+        aux_in,
+        aux_out,
+        message="",
+        in_cache=None,
+        out_cache=None,
+        metrics=None,
+        time_limit=None,
+        budget_growth=4,
+        store=None,
+        compress=False,
+        sampler=None,
+        batch=1,
+    ):
         """
         More general version of the differential possibility equivalence technique
         of Sasaki and Todo EC17.
@@ -321,155 +1204,197 @@ class AesLike(Primitive):
         aux_in: auxiliary input model of the same class with a smaller
             number of rounds.
         aux_out: same for output.
+        in_cache: optional map (python dict) from pairs (x_start, x_mid)
+            to the answers of aux_in. It is read and filled during the search
+            and can be shared between searches with the same aux_in rounds.
+        out_cache: same for aux_out with pairs (y_mid, y).
+        metrics: optional metrics.Metrics object receiving the statistics
+            and the events of the search. Defaults to printing on the console.
+        time_limit: optional budget in seconds of the queries on the main model.
+            A query that runs out of budget is deferred: it stays in the
+            discard phase and is retried with a budget multiplied by
+            budget_growth once all the other pairs are done.
+        store: optional results_store.ResultStore. The pairs with a verdict
+            in the store are skipped (the impossible ones are in the output)
+            and the new verdicts are written to it as they are found.
+        compress: if True, only one pair per class of support_classes is
+            searched and its answer is given to the whole class.
+        sampler: optional sampler.Sampler on this model. The pairs it proves
+            possible are removed before the first query, their witness trails
+            go to the store and to the trail library (see trails.py).
+        batch: number of pairs with the same input difference solved by each
+            call on the main model (see is_possible_batch).
         """
 
+        if compress:
+            (reps, classes) = self.support_classes(the_dict)
+            found = self.equimip_search(
+                reps,
+                aux_in,
+                aux_out,
+                message=message,
+                in_cache=in_cache,
+                out_cache=out_cache,
+                metrics=metrics,
+                time_limit=time_limit,
+                budget_growth=budget_growth,
+                store=store,
+                sampler=sampler,
+                batch=batch,
+            )
+            the_dict.clear()
+
+            found = set(found)
+            out = [pair for rep in classes if rep in found for pair in classes[rep]]
+            if store is not None:
+                verdicts = [
+                    (x, y, rep not in found, None)
+                    for rep in classes
+                    for (x, y) in classes[rep]
+                    if (x, y) != rep
+                ]
+                store.record_many(self.config(), verdicts)
+            return out
+
         r_in = aux_in.nb_rounds - 1
         r_out = aux_out.nb_rounds - 1
         assert r_in + r_out < self.nb_rounds
         assert r_in >= 0
         assert r_out >= 0
 
-        # Useful for printing progress. START
+        if metrics is None:
+            metrics = Metrics([ConsoleSink()])
+
         def remaining(the_dict):
             return sum([len(the_dict[x]) for x in iter(the_dict)])
 
-        def spaces(x):
-            return "".join([" " for i in range(x)])
-
         out = []
-        length = remaining(the_dict)
-        nb_done = 0
-        nb_milp = 0
-        nb_milp_x = 0
-        nb_milp_y = 0
-        discarded = 0
-
-        absolute_time = time.time()
+        # Pairs with a verdict from a previous search.
+        config = self.config()
+        if store is not None:
+            (out, nb_known) = store.prune(config, the_dict)
+
+        # Pairs proven possible by sampling.
+        if sampler is not None:
+            witnesses = sampler.prune(the_dict)
+            if store is not None:
+                verdicts = [(x, y, True, t) for ((x, y), t) in witnesses.items()]
+                store.record_many(config, verdicts)
+            if self.trails is not None:
+                size = len(self.trail_vars())
+                for ((x, y), trail) in witnesses.items():
+                    self.trails.add(x, y, trail, size)
 
-        print(
-            "| {}Message |".format(spaces(len(message) - 7))
-            + " {}Time |".format(spaces(17 - 4))
-            + "  Results / {:10} |".format(length)
-            + " {}MIP queries |".format(spaces(20 - 11))
-            + "  x queries |"
-            + "  y queries |"
-            + " Dis. rate |"
-            + " Found |"
-        )
-
-        def outer_printer():
-            seconds = int(time.time() - absolute_time)
-            minutes = seconds // 60
-            hours = minutes // 60
-            str_time = "{:4}h, {:2}min, {:2}s".format(hours, minutes % 60, seconds % 60)
-
-            return (
-                "| {} | {} |  {:5.1f} % = {:10} |".format(
-                    message, str_time, (100.0 * nb_done) / length, nb_done,
-                )
-                + " {:10} = {:5.2f} % |".format(nb_milp, (100.0 * nb_milp) / length,)
-                + " {:10} |".format(nb_milp_x,)
-                + " {:10} |".format(nb_milp_y,)
-                + "   {:5.1f} % |".format(
-                    (100.0 * discarded) / (nb_milp_x + nb_milp_y)
-                    if nb_milp_x + nb_milp_y != 0
-                    else 0,
-                )
-                + " {:5} |".format(len(out))
-            )
+        length = remaining(the_dict)
+        metrics.start(message, length)
+        if store is not None:
+            metrics.found += len(out)
+            metrics.emit("stored", force=True, known=nb_known, found=len(out))
+        if sampler is not None:
+            metrics.emit("sampled", force=True, proven=len(witnesses))
 
-        # END
+        # Pairs whose query ran out of budget.
+        deferred = {}
 
         # While there are difference pairs to try...
         while len(the_dict) >= 1:
             # x is the input difference we are going to try.
             x = list(the_dict)[0]
             while len(the_dict[x]) >= 1:
-                outer_print = outer_printer()
-                print(outer_print, end="\n")
-
-                # y is the input difference we are going to try.
-                y = the_dict[x].pop()
-
-                # Printing this message while the solver is running
-                # on the main model self (in the function self.is_possible)
-                # This computation can last for a few hours.
-                print(
-                    "MIP query on input {} and output {}".format(
-                        self.format_state(x), self.format_state(y),
-                    ),
-                    end="\r",
-                )
-                possible = self.is_possible(x, y)
-                nb_milp += 1
+                metrics.emit("progress")
 
-                # If we have found an impossible differential, add it to the output.
-                if not possible:
-                    out.append((x, y))
-                # Else use the differential possibility equivalence technique.
+                # ys are the output differences we are going to try,
+                # solved together as the scenarios of one call if batch > 1.
+                ys = [the_dict[x].pop() for _ in range(min(batch, len(the_dict[x])))]
+
+                # This query on the main model can last for a few hours.
+                for y in ys:
+                    metrics.emit("query", x=hex(x), y=hex(y))
+                if batch == 1:
+                    answers = [metrics.query("main", self, x, ys[0], time_limit)]
                 else:
-                    # Get the middle values in the computed path.
-                    x_mid = self.get_state_out_sbox(r_in)
-                    y_mid = self.get_state_in_sbox(self.nb_rounds - r_out - 1)
-
-                    to_discard = []
-
-                    # Printer related stuff. START
-
-                    visited = 0
-                    rem = remaining(the_dict)
-
-                    class inner_printer:
-                        def __init__(self):
-                            self.timer = time.time()
-
-                        def go(self):
-                            if (time.time() - self.timer) >= 0.5:
-                                self.timer = time.time()
-                                print(
-                                    "Discarding progress "
-                                    + "{:.1f} %   rate {:.1f} %".format(
-                                        (100.0 * visited) / rem,
-                                        (100.0 * len(to_discard)) / visited,
-                                    )
-                                    + spaces(30),
-                                    end="\r",
-                                )
-
-                    ip = inner_printer()
-
-                    # END
-
-                    # For each possible input difference...
-                    for x_start in the_dict.keys():
-                        # We first try to compute the beginning of the path
-                        # between x_start and x_mid (if x_start is not the initial x).
-                        try_y = x == x_start
-                        if not try_y:
-                            nb_milp_x += 1
-                            try_y = aux_in.is_possible(x_start, x_mid)
-
-                        # If a path from x_start to x_mid is found...
-                        if try_y:
-                            # For each output difference y to try with input x_start...
-                            for y in the_dict[x_start]:
-                                nb_milp_y += 1
-                                visited += 1
-                                # We check whether there is a path between y_mid and y.
-                                if aux_out.is_possible(y_mid, y):
-                                    # If it is the case, we will discard the pair (x_start, y)
-                                    # from input/output pairs to try.
-                                    to_discard.append((x_start, y))
-                                    discarded += 1
-                                ip.go()
-                        else:
-                            visited += len(the_dict[x_start])
-                            ip.go()
-
-                    for (x, y) in to_discard:
-                        the_dict[x].remove(y)
-
-                nb_done = length - remaining(the_dict)
+                    pairs = [(x, y) for y in ys]
+                    answers = metrics.batch_query("main", self, pairs, time_limit)
+
+                for (s, (y, possible)) in enumerate(zip(ys, answers)):
+                    if batch != 1:
+                        self.select_scenario(s)
+
+                    # If the query ran out of budget, it will be retried later.
+                    if possible is None:
+                        deferred.setdefault(x, set()).add(y)
+                        metrics.deferred += 1
+                    # If we have found an impossible differential, add it to the output.
+                    elif not possible:
+                        out.append((x, y))
+                        metrics.found += 1
+                        metrics.emit("found", force=True, x=hex(x), y=hex(y))
+                        if store is not None:
+                            store.record(config, x, y, False)
+                    # Else use the differential possibility equivalence technique.
+                    else:
+                        # Get the middle values in the computed path.
+                        x_mid = self.get_state_out_sbox(r_in)
+                        y_mid = self.get_state_in_sbox(self.nb_rounds - r_out - 1)
+                        if store is not None:
+                            store.record(config, x, y, True, self.get_trail())
+
+                        visited = 0
+                        rem = remaining(the_dict) + remaining(deferred)
+
+                        # The pairs discarded by the path are the product of the
+                        # inputs reaching x_mid and of the outputs reached from
+                        # y_mid: each auxiliary query is made once per path.
+                        # Inputs x_start with a path to x_mid, deferred ones included
+                        # (x itself has one).
+                        x_ok = []
+                        for pool in [the_dict, deferred]:
+                            for x_start in pool.keys():
+                                if x == x_start or metrics.cached_query(
+                                    "aux_in", aux_in, in_cache, x_start, x_mid
+                                ):
+                                    x_ok.append((pool, x_start))
+                                else:
+                                    visited += len(pool[x_start])
+
+                        # Number of pairs of the inputs of x_ok with each output.
+                        holders = {}
+                        for (pool, x_start) in x_ok:
+                            for y in pool[x_start]:
+                                holders[y] = holders.get(y, 0) + 1
+
+                        # Outputs y with a path from y_mid.
+                        y_ok = set()
+                        path_discarded = 0
+                        for y in sorted(holders):
+                            visited += holders[y]
+                            if metrics.cached_query(
+                                "aux_out", aux_out, out_cache, y_mid, y
+                            ):
+                                y_ok.add(y)
+                                path_discarded += holders[y]
+                            metrics.emit(
+                                "discard",
+                                visited=visited,
+                                remaining=rem,
+                                path_discarded=path_discarded,
+                            )
+
+                        to_discard = [
+                            (pool, x_start, y)
+                            for (pool, x_start) in x_ok
+                            for y in pool[x_start] & y_ok
+                        ]
+                        metrics.discarded += len(to_discard)
+                        for (pool, x_start, y) in to_discard:
+                            pool[x_start].remove(y)
+                        if store is not None:
+                            verdicts = [
+                                (x_s, y, True, None) for (_, x_s, y) in to_discard
+                            ]
+                            store.record_many(config, verdicts)
+
+                metrics.done = length - remaining(the_dict) - remaining(deferred)
 
             # Check and clean the set of input/output pairs to try.
             assert len(the_dict[x]) == 0
@@ -478,9 +1403,17 @@ class AesLike(Primitive):
                 if len(the_dict[key]) == 0:
                     del the_dict[key]
 
-        nb_done = length - remaining(the_dict)
-        outer_print = outer_printer()
-        print(outer_print, end="\n")
+            # Retry the deferred pairs that were not discarded with a larger budget.
+            if len(the_dict) == 0 and remaining(deferred) != 0:
+                the_dict = {key: deferred[key] for key in deferred if deferred[key]}
+                deferred = {}
+                time_limit *= budget_growth
+                metrics.emit(
+                    "retry", force=True, pairs=remaining(the_dict), time_limit=time_limit
+                )
+
+        metrics.done = length
+        metrics.end(profiler=self.profiler)
 
         return out
 
@@ -0,0 +1,142 @@
+"""
+Persistent store of the verdicts of the searches (SQLite).
+
+Each pair (x, y) of a configuration (see AesLike.config) has a verdict,
+possible or not, and, when it was found by a query on the main model,
+the trail of the solution (see Primitive.get_trail). The pairs discarded by
+the differential possibility equivalence technique are possible without trail.
+The rows are written as soon as the verdicts are known, so an interrupted
+search keeps its results, and later searches skip the pairs with a verdict.
+Differences and trails are stored as hexadecimal strings.
+"""
+import sqlite3
+import threading
+import time
+
+schema = """
+CREATE TABLE IF NOT EXISTS results (
+    cipher TEXT NOT NULL,
+    rounds INTEGER NOT NULL,
+    sbox TEXT NOT NULL,
+    mixcol TEXT NOT NULL,
+    x TEXT NOT NULL,
+    y TEXT NOT NULL,
+    possible INTEGER NOT NULL,
+    trail TEXT,
+    time REAL NOT NULL,
+    PRIMARY KEY (cipher, rounds, sbox, mixcol, x, y)
+);
+CREATE INDEX IF NOT EXISTS results_possible
+    ON results (cipher, rounds, sbox, mixcol, possible);
+"""
+
+config_columns = ["cipher", "rounds", "sbox", "mixcol"]
+
+
+class ResultStore:
+    """
+    Results in the SQLite file file_name, created if needed.
+    Can be shared by searches running in different threads.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(file_name, check_same_thread=False)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(schema)
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def record_many(self, config, verdicts):
+        """
+        verdicts: list of (x, y, possible, trail), trail may be None.
+        A verdict replaces the previous one of the same pair.
+        """
+        key = [config[column] for column in config_columns]
+        now = time.time()
+        rows = [
+            key
+            + [
+                hex(x),
+                hex(y),
+                int(possible),
+                hex(trail) if trail is not None else None,
+                now,
+            ]
+            for (x, y, possible, trail) in verdicts
+        ]
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.connection.commit()
+
+    def record(self, config, x, y, possible, trail=None):
+        self.record_many(config, [(x, y, possible, trail)])
+
+    def select(self, config, columns, condition="", parameters=()):
+        where = " AND ".join(["{} = ?".format(column) for column in config_columns])
+        query = "SELECT {} FROM results WHERE {}{}".format(
+            ", ".join(columns), where, condition
+        )
+        key = [config[column] for column in config_columns]
+        with self.lock:
+            return self.connection.execute(query, key + list(parameters)).fetchall()
+
+    def verdict(self, config, x, y):
+        """
+        True or False, None if the pair has no verdict.
+        """
+        rows = self.select(
+            config, ["possible"], " AND x = ? AND y = ?", (hex(x), hex(y))
+        )
+        return bool(rows[0][0]) if len(rows) != 0 else None
+
+    def trail(self, config, x, y):
+        """
+        Trail of a possible pair, None if there is none.
+        """
+        rows = self.select(config, ["trail"], " AND x = ? AND y = ?", (hex(x), hex(y)))
+        if len(rows) == 0 or rows[0][0] is None:
+            return None
+        return int(rows[0][0], 16)
+
+    def verdicts(self, config, x):
+        """
+        Map from the output differences with a verdict for the input x
+        to their verdicts.
+        """
+        rows = self.select(config, ["y", "possible"], " AND x = ?", (hex(x),))
+        return {int(y, 16): bool(possible) for (y, possible) in rows}
+
+    def impossible(self, config):
+        """
+        All the impossible pairs of the configuration.
+        """
+        rows = self.select(config, ["x", "y"], " AND possible = 0")
+        return sorted([(int(x, 16), int(y, 16)) for (x, y) in rows])
+
+    def prune(self, config, the_dict):
+        """
+        Removes the pairs with a verdict from the_dict (see equimip_search).
+        Returns the list of the removed impossible pairs and the number of
+        removed pairs.
+        """
+        out = []
+        nb_known = 0
+        for x in list(the_dict):
+            known = self.verdicts(config, x)
+            for y in [y for y in the_dict[x] if y in known]:
+                the_dict[x].remove(y)
+                nb_known += 1
+                if not known[y]:
+                    out.append((x, y))
+            if len(the_dict[x]) == 0:
+                del the_dict[x]
+        return (out, nb_known)
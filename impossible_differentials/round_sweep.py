@@ -0,0 +1,88 @@
+from campaign import ciphers
+import argparse
+import itertools
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Searches for the longest impossible differentials with one "
+        + "active input cell and one active output cell by extending the model "
+        + "one round at a time."
+    )
+    parser.add_argument("cipher", type=str, choices=list(ciphers))
+    parser.add_argument("start_rounds", type=int, help="First number of rounds.")
+    parser.add_argument("max_rounds", type=int, help="Last number of rounds.")
+    parser.add_argument(
+        "-s", type=str, dest="sbox_file", help="Pickle file of the Sbox model."
+    )
+    parser.add_argument(
+        "-i",
+        type=int,
+        nargs="+",
+        dest="in_cells",
+        default=list(range(16)),
+        help="Active input cells.",
+    )
+    parser.add_argument(
+        "-o",
+        type=int,
+        nargs="+",
+        dest="out_cells",
+        default=list(range(16)),
+        help="Active output cells.",
+    )
+    parser.add_argument(
+        "-u",
+        action="store_true",
+        dest="unit",
+        help="Only the lowest bit of the active cells is set.",
+    )
+    parser.add_argument(
+        "-a",
+        action="store_true",
+        dest="aux",
+        help="Use equimip_search with 2-round auxiliary models.",
+    )
+    parser.add_argument(
+        "-w", type=int, dest="workers", default=1, help="Number of parallel queries."
+    )
+    args = parser.parse_args()
+
+    (cls, default_sbox) = ciphers[args.cipher]
+    sbox_file = default_sbox if args.sbox_file is None else args.sbox_file
+
+    mid = cls(args.start_rounds, sbox_file)
+    mid.model.setParam("LogToConsole", 0)
+
+    aux_in = None
+    aux_out = None
+    if args.aux:
+        aux_in = cls(2, sbox_file)
+        aux_in.model.setParam("LogToConsole", 0)
+        aux_out = cls(2, sbox_file)
+        aux_out.model.setParam("LogToConsole", 0)
+
+    d = mid.nibble_size
+    values = [1] if args.unit else range(1, 1 << d)
+    pairs = [
+        (valx << (d * in_cell), valy << (d * out_cell))
+        for (in_cell, out_cell) in itertools.product(args.in_cells, args.out_cells)
+        for (valx, valy) in itertools.product(values, values)
+    ]
+
+    results = mid.round_sweep(
+        pairs,
+        args.max_rounds,
+        aux_in=aux_in,
+        aux_out=aux_out,
+        workers=args.workers,
+        message=cls.__name__,
+    )
+
+    longest = max([r for r in results if len(results[r]) != 0], default=None)
+    if longest is None:
+        print("No impossible differential on {} rounds.".format(args.start_rounds))
+    else:
+        print("Longest impossible differentials: {} rounds.".format(longest))
+        for (x, y) in results[longest]:
+            print("{} -> {}".format(mid.format_state(x), mid.format_state(y)))
@@ -0,0 +1,180 @@
+"""
+Meet-in-the-middle sampling of trails, to prove pairs possible without MILP.
+
+From each input difference x, random trails go forward through the first
+Sbox layers (a random output of the DDT row of each cell) and the linear
+layers, up to the input of the middle Sbox layer. From each output
+difference y, random trails go backward (a random input of the DDT column
+of each cell) up to the output of the middle Sbox layer. The middle states
+are put in hash tables by their active cells: a forward state a and a
+backward state b with the same active cells meet when every cell of b is in
+the DDT row of the same cell of a. Then (x, y) is possible and the two
+halves make a trail of the model (see Primitive.get_trail), its witness.
+Pairs which are not met are not proven impossible.
+"""
+import numpy as np
+import gf2
+
+
+class Sampler:
+    """
+    Samples nb_samples trails per difference on the model of primitive
+    (AesLike with cells of 8 bits), meeting at the Sbox layer middle
+    (defaults to nb_rounds // 2).
+    max_checks: maximum number of comparisons of a forward and a backward
+    state per set of active cells.
+    """
+
+    def __init__(
+        self, primitive, nb_samples=256, middle=None, seed=0, max_checks=1 << 26
+    ):
+        assert primitive.nibble_size == 8
+        self.primitive = primitive
+        self.nb_samples = nb_samples
+        self.middle = primitive.nb_rounds // 2 if middle is None else middle
+        assert 0 <= self.middle < primitive.nb_rounds
+        self.rng = np.random.default_rng(seed)
+        self.max_checks = max_checks
+        # Comparisons per numpy call.
+        self.block = 1 << 16
+
+        (self.lin, self.inv) = primitive.linear_layer_gf2()
+        (rows, _, _) = primitive.sbox_modelings[primitive.sbox_name]
+        self.support = np.array(
+            [[(row >> b) & 1 for b in range(256)] for row in rows], dtype=bool
+        )
+        # Values of the DDT rows (and columns), flattened with their offsets.
+        self.rows = self.flatten(self.support)
+        self.cols = self.flatten(self.support.T)
+
+    @staticmethod
+    def flatten(support):
+        counts = support.sum(axis=1)
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        values = np.nonzero(support)[1].astype(np.uint8)
+        return (values, offsets, counts)
+
+    def sbox_layer(self, states, table):
+        """
+        A random transition of each cell through table (self.rows or self.cols).
+        """
+        (values, offsets, counts) = table
+        cells = states.view(np.uint8)
+        picks = (self.rng.random(cells.shape) * counts[cells]).astype(np.int64)
+        return values[offsets[cells] + picks].view("<u8")
+
+    def forward(self, xs):
+        """
+        in_sbox and out_sbox states of nb_samples trails per x (in order),
+        up to in_sbox[middle].
+        """
+        n = self.primitive.state_size
+        states = np.repeat(gf2.pack(xs, n), self.nb_samples, axis=0)
+        (ins, outs) = ([states], [])
+        for _ in range(self.middle):
+            outs.append(self.sbox_layer(ins[-1], self.rows))
+            ins.append(self.lin.apply(outs[-1]))
+        return (ins, outs)
+
+    def backward(self, ys):
+        """
+        Same from the output differences ys, from out_sbox[middle]
+        to out_sbox[nb_rounds - 1].
+        """
+        n = self.primitive.state_size
+        model_ys = [self.primitive.to_model_output(y) for y in ys]
+        states = np.repeat(gf2.pack(model_ys, n), self.nb_samples, axis=0)
+        (ins, outs) = ([], [states])
+        for _ in range(self.primitive.nb_rounds - 1 - self.middle):
+            ins.insert(0, self.sbox_layer(outs[0], self.cols))
+            outs.insert(0, self.inv.apply(ins[0]))
+        return (ins, outs)
+
+    @staticmethod
+    def patterns(states):
+        """
+        Active cells of the states, as bytes.
+        """
+        active = states.view(np.uint8) != 0
+        packed = np.packbits(active, axis=1, bitorder="little")
+        return [row.tobytes() for row in packed]
+
+    def trail(self, fwd, i, bwd, j):
+        """
+        Trail (see Primitive.get_trail) made of the forward sample i
+        and of the backward sample j.
+        """
+        n = self.primitive.state_size
+        ins = [(s, i) for s in fwd[0]] + [(s, j) for s in bwd[0]]
+        outs = [(s, i) for s in fwd[1]] + [(s, j) for s in bwd[1]]
+        out = 0
+        for r in range(self.primitive.nb_rounds):
+            for (k, (states, index)) in enumerate([ins[r], outs[r]]):
+                value = gf2.unpack(states[index : index + 1])[0]
+                out |= value << (((2 * r) + k) * n)
+        return out
+
+    def sample(self, the_dict):
+        """
+        Returns a map from the pairs of the_dict (see equimip_search)
+        proven possible to their witness trails.
+        """
+        xs = sorted(the_dict)
+        ys = sorted(set().union(*the_dict.values())) if len(xs) != 0 else []
+        if len(ys) == 0:
+            return {}
+        fwd = self.forward(xs)
+        bwd = self.backward(ys)
+        (a, b) = (fwd[0][self.middle], bwd[1][0])
+
+        # Hash tables of the samples by active cells.
+        (fwd_table, bwd_table) = ({}, {})
+        for (table, states) in [(fwd_table, a), (bwd_table, b)]:
+            for (k, key) in enumerate(self.patterns(states)):
+                table.setdefault(key, []).append(k)
+
+        a_cells = a.view(np.uint8)
+        b_cells = b.view(np.uint8)
+        nb_pairs = sum([len(the_dict[x]) for x in xs])
+        found = {}
+        for key in fwd_table:
+            if key not in bwd_table or len(found) == nb_pairs:
+                continue
+            # Random order, to spread the comparisons over the differences.
+            fwd_samples = self.rng.permutation(fwd_table[key])
+            bwd_samples = self.rng.permutation(bwd_table[key])
+            step = max(1, self.block // len(bwd_samples))
+            checks = 0
+            for start in range(0, len(fwd_samples), step):
+                if checks >= self.max_checks or len(found) == nb_pairs:
+                    break
+                rows = fwd_samples[start : start + step]
+                checks += len(rows) * len(bwd_samples)
+                # meet[k, l]: the Sbox layer maps a[rows[k]] to b[bwd_samples[l]].
+                meet = self.support[
+                    a_cells[rows][:, None, :], b_cells[bwd_samples][None, :, :]
+                ].all(axis=2)
+                (k, l) = np.nonzero(meet)
+                # One witness per pair of differences.
+                codes = (rows[k] // self.nb_samples) * len(ys) + (
+                    bwd_samples[l] // self.nb_samples
+                )
+                (_, first) = np.unique(codes, return_index=True)
+                for m in first.tolist():
+                    (i, j) = (int(rows[k[m]]), int(bwd_samples[l[m]]))
+                    (x, y) = (xs[i // self.nb_samples], ys[j // self.nb_samples])
+                    if y in the_dict[x] and (x, y) not in found:
+                        found[x, y] = self.trail(fwd, i, bwd, j)
+        return found
+
+    def prune(self, the_dict):
+        """
+        Removes the pairs proven possible from the_dict and returns
+        their witnesses (see sample).
+        """
+        found = self.sample(the_dict)
+        for (x, y) in found:
+            the_dict[x].remove(y)
+            if len(the_dict[x]) == 0:
+                del the_dict[x]
+        return found
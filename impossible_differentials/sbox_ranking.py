@@ -0,0 +1,152 @@
+"""
+Ranking of Sbox models of the same DDT by the solve time of the queries.
+
+minimize.py chooses the inequalities of an Sbox model by their number only,
+which is not always the model with the fastest queries. Each candidate
+pickle file is used to build the same model (cipher, number of rounds) and
+the same workload is solved with each of them (see benchmark.py and
+tuning.py), with the Gurobi defaults or the tuned parameters of each
+configuration. All the candidates must give the same answers.
+"""
+from benchmark import ciphers, unit_pairs, timed_build
+import tuning
+import utilities
+import argparse
+import json
+import numpy as np
+import pickle
+
+
+def workload(primitive, nb_queries, seed):
+    """
+    Seeded random queries and unit pairs, as in benchmark.bench_queries.
+    """
+    return (
+        tuning.sample_queries(primitive, nb_queries, seed=seed)
+        + unit_pairs(primitive)[:nb_queries]
+    )
+
+
+def load_ddt(sbox_file):
+    """
+    Returns the possible transitions (boolean array) and the number of
+    inequalities.
+    """
+    with open(sbox_file, "rb") as f:
+        (in_size, out_size, ddt, ineqs) = pickle.load(f)
+    return (utilities.ddt_array(ddt, in_size, out_size) != 0, len(ineqs))
+
+
+def rank(cipher, nb_rounds, sbox_files, nb_queries=20, seed=0, repeat=3, tuned=False):
+    """
+    Returns one row per candidate, the fastest first. The solve time of a
+    candidate is the median over repeat runs of the whole workload.
+    """
+    rows = []
+    reference = None
+    support = None
+    for sbox_file in sbox_files:
+        (sbox_support, nb_ineqs) = load_ddt(sbox_file)
+        if support is None:
+            support = sbox_support
+        assert np.array_equal(sbox_support, support), "{} models another DDT.".format(
+            sbox_file
+        )
+
+        (primitive, build) = timed_build(cipher, sbox_file, nb_rounds)
+        queries = workload(primitive, nb_queries, seed)
+        params = tuning.load_params(primitive.config()) if tuned else None
+        if params is None:
+            params = {}
+
+        times = []
+        for _ in range(repeat):
+            (total, verdicts) = tuning.evaluate(primitive, params, queries)
+            if reference is None:
+                reference = verdicts
+            assert verdicts == reference, "{} changes the answers.".format(sbox_file)
+            times.append(total)
+
+        row = {
+            "sbox": sbox_file,
+            "nb_ineqs": nb_ineqs,
+            "params": params,
+            "solve_time": sorted(times)[len(times) // 2],
+            "nb_queries": len(queries),
+        }
+        row.update(build)
+        rows.append(row)
+        print("{:8.2f}s  {}".format(row["solve_time"], sbox_file))
+
+    rows.sort(key=lambda row: row["solve_time"])
+    return rows
+
+
+def report(rows):
+    best = rows[0]["solve_time"]
+    lines = [
+        "| Rank | {:30} | Ineqs | Constrs | Build (s) | Solve (s) | Ratio |".format(
+            "Sbox model"
+        )
+    ]
+    for (i, row) in enumerate(rows):
+        lines.append(
+            "| {:4} | {:30} | {:5} | {:7} | {:9.2f} | {:9.2f} | {:5.2f} |".format(
+                i + 1,
+                row["sbox"],
+                row["nb_ineqs"],
+                row["nb_constrs"],
+                row["build_time"],
+                row["solve_time"],
+                row["solve_time"] / best if best != 0 else 1.0,
+            )
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Ranks Sbox models of the same DDT by the solve time "
+        + "of a fixed workload of queries."
+    )
+    parser.add_argument("cipher", type=str, choices=list(ciphers))
+    parser.add_argument("nb_rounds", type=int, help="Number of rounds.")
+    parser.add_argument(
+        "sbox_files", type=str, nargs="+", help="Pickle files of the Sbox models."
+    )
+    parser.add_argument(
+        "-n",
+        type=int,
+        dest="nb_queries",
+        default=20,
+        help="Number of random queries (and of unit pairs).",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the queries.")
+    parser.add_argument(
+        "-r", type=int, dest="repeat", default=3, help="Runs of the workload."
+    )
+    parser.add_argument(
+        "--tuned",
+        action="store_true",
+        help="Use the tuned parameters of each configuration (see tuning.py).",
+    )
+    parser.add_argument(
+        "-o", type=str, dest="output_file", help="JSON file for the ranking."
+    )
+    args = parser.parse_args()
+
+    rows = rank(
+        args.cipher,
+        args.nb_rounds,
+        args.sbox_files,
+        nb_queries=args.nb_queries,
+        seed=args.seed,
+        repeat=args.repeat,
+        tuned=args.tuned,
+    )
+    print(report(rows))
+
+    if args.output_file is not None:
+        with open(args.output_file, "w") as f:
+            json.dump(rows, f, indent=2, sort_keys=True)
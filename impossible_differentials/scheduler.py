@@ -0,0 +1,209 @@
+"""
+Asyncio scheduler for equimip_search.
+
+The sequential search waits for the discard phase of a path before the next
+query on the main model, and runs the queries of the discard phase one after
+another. Gurobi releases the GIL during optimize, so the scheduler runs them
+in threads instead:
+    - the queries of a discard phase are all fired at once on a pool of
+      copies of the auxiliary models (one per thread),
+    - the next query on the main model starts as soon as the previous one
+      returns, while its discard phase is running.
+The next main query is speculative: its pair may be discarded in the meantime.
+Its answer is still correct, it is only wasted work. The number of discard
+phases running when a main query starts is bounded (speculation).
+"""
+from metrics import Metrics, ConsoleSink
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import queue
+
+
+class Scheduler:
+    """
+    Runs equimip searches of the main model mid with workers copies of
+    the auxiliary models aux_in and aux_out.
+    speculation: number of discard phases that may still be running when
+    a new main query starts (0 for no speculative main query).
+    """
+
+    def __init__(self, mid, aux_in, aux_out, workers=4, speculation=1):
+        self.mid = mid
+        self.speculation = speculation
+        self.r_in = aux_in.nb_rounds - 1
+        self.r_out = aux_out.nb_rounds - 1
+        assert self.r_in + self.r_out < mid.nb_rounds
+        assert self.r_in >= 0
+        assert self.r_out >= 0
+
+        self.workers = workers
+        self.aux_in = queue.Queue()
+        self.aux_out = queue.Queue()
+        # The auxiliary queries run in parallel with each other and with the
+        # main query: every copy has its own Gurobi environment (see
+        # Primitive.copy), while the original models may share the one of mid.
+        for _ in range(workers):
+            self.aux_in.put(aux_in.copy())
+            self.aux_out.put(aux_out.copy())
+
+    def main_query(self, metrics, x, y):
+        """
+        Runs in the thread of the main model. The middle values of the path
+        are read before the model can be used again.
+        """
+        if not metrics.query("main", self.mid, x, y):
+            return (False, None, None)
+        x_mid = self.mid.get_state_out_sbox(self.r_in)
+        y_mid = self.mid.get_state_in_sbox(self.mid.nb_rounds - self.r_out - 1)
+        return (True, x_mid, y_mid)
+
+    def aux_query(self, metrics, kind, cache, a, b):
+        """
+        Runs in any thread, on the first free copy of the auxiliary model.
+        """
+        models = self.aux_in if kind == "aux_in" else self.aux_out
+        primitive = models.get()
+        try:
+            return metrics.cached_query(kind, primitive, cache, a, b)
+        finally:
+            models.put(primitive)
+
+    async def discard(self, the_dict, x, x_mid, y_mid, metrics, in_cache, out_cache):
+        """
+        Discard phase of a path from x through (x_mid, y_mid).
+        The pairs of the_dict are only removed from the event loop thread.
+        """
+        loop = asyncio.get_running_loop()
+
+        # Same output query for all the inputs.
+        out_queries = {}
+
+        def out_query(y):
+            if y not in out_queries:
+                out_queries[y] = loop.run_in_executor(
+                    self.executor,
+                    self.aux_query,
+                    metrics,
+                    "aux_out",
+                    out_cache,
+                    y_mid,
+                    y,
+                )
+            return out_queries[y]
+
+        async def try_input(x_start, ys):
+            if x_start != x:
+                possible = await loop.run_in_executor(
+                    self.executor,
+                    self.aux_query,
+                    metrics,
+                    "aux_in",
+                    in_cache,
+                    x_start,
+                    x_mid,
+                )
+                if not possible:
+                    return []
+            verdicts = await asyncio.gather(*[out_query(y) for y in ys])
+            return [y for (y, possible) in zip(ys, verdicts) if possible]
+
+        inputs = [(x_start, sorted(ys)) for (x_start, ys) in the_dict.items()]
+        results = await asyncio.gather(*[try_input(*item) for item in inputs])
+
+        for ((x_start, _), ys) in zip(inputs, results):
+            for y in ys:
+                if y in the_dict.get(x_start, ()):
+                    the_dict[x_start].remove(y)
+                    metrics.discarded += 1
+            if x_start in the_dict and len(the_dict[x_start]) == 0:
+                del the_dict[x_start]
+
+    async def run(
+        self, the_dict, message="", in_cache=None, out_cache=None, metrics=None
+    ):
+        """
+        Same as AesLike.equimip_search (without time limit).
+        the_dict is emptied during the search.
+        """
+        if metrics is None:
+            metrics = Metrics([ConsoleSink()])
+
+        def remaining():
+            return sum([len(the_dict[x]) for x in iter(the_dict)])
+
+        loop = asyncio.get_running_loop()
+        out = []
+        length = remaining()
+        metrics.start(message, length)
+
+        main = ThreadPoolExecutor(max_workers=1)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        main_task = None
+        discards = set()
+
+        while len(the_dict) != 0 or main_task is not None or len(discards) != 0:
+            # Speculative: the discard phases still running may remove this pair.
+            if (
+                main_task is None
+                and len(the_dict) != 0
+                and len(discards) <= self.speculation
+            ):
+                x = next(iter(the_dict))
+                y = the_dict[x].pop()
+                if len(the_dict[x]) == 0:
+                    del the_dict[x]
+                metrics.emit("query", x=hex(x), y=hex(y))
+                main_task = asyncio.ensure_future(
+                    loop.run_in_executor(main, self.main_query, metrics, x, y)
+                )
+                main_pair = (x, y)
+
+            waiting = set(discards)
+            if main_task is not None:
+                waiting.add(main_task)
+            (finished, _) = await asyncio.wait(
+                waiting, return_when=asyncio.FIRST_COMPLETED
+            )
+
+            for task in finished:
+                task.result()
+                if task is not main_task:
+                    discards.remove(task)
+                    continue
+                main_task = None
+                (possible, x_mid, y_mid) = task.result()
+                (x, y) = main_pair
+                if not possible:
+                    out.append((x, y))
+                    metrics.found += 1
+                    metrics.emit("found", force=True, x=hex(x), y=hex(y))
+                else:
+                    discards.add(
+                        asyncio.ensure_future(
+                            self.discard(
+                                the_dict, x, x_mid, y_mid, metrics, in_cache, out_cache
+                            )
+                        )
+                    )
+
+            in_flight = 0 if main_task is None else 1
+            metrics.done = length - remaining() - in_flight
+            metrics.emit("progress")
+
+        main.shutdown()
+        self.executor.shutdown()
+
+        metrics.done = length
+        metrics.end(profiler=self.mid.profiler)
+
+        return out
+
+
+def equimip_search(mid, the_dict, aux_in, aux_out, workers=4, speculation=1, **kwargs):
+    """
+    Blocking version of Scheduler.run.
+    """
+    scheduler = Scheduler(
+        mid, aux_in, aux_out, workers=workers, speculation=speculation
+    )
+    return asyncio.run(scheduler.run(the_dict, **kwargs))
@@ -3,6 +3,13 @@ from primitive import AesLike
 from itertools import product as itp
 from itertools import starmap as itsm
 import utilities
+import gf2
+import random
+import tempfile
+import os
+from metrics import Metrics
+from results_store import ResultStore
+from sampler import Sampler
 
 shift_rows = [0, 1, 2, 3, 7, 4, 5, 6, 10, 11, 8, 9, 13, 14, 15, 12]
 
@@ -31,6 +38,7 @@ class Skinny(AesLike):
             self.mixcol = mixcol_equiv
         else:
             self.mixcol = mixcol_origin
+        self.mixcol_name = mixcol
         AesLike.__init__(self, 128, nb_rounds, sbox_file)
 
     def linear_layer(self, x_in, x_out):
@@ -85,6 +93,11 @@ def lin_layer(x):
     return out
 
 
+def lin_layer_gf2():
+    """ Skinny linear layer as a gf2.BitMatrix, for many states at once. """
+    return gf2.BitMatrix.from_function(lin_layer, 128)
+
+
 def test_linear_layer():
     """
     Testing the modeling of the linear layer with identity Sbox.
@@ -118,6 +131,22 @@ def test_linear_layer():
     print("Linear layer test OK.")
 
 
+def test_gf2_linear_layer():
+    """
+    Testing the packed linear layer against lin_layer and the model.
+    """
+    mid = Skinny(2, "identity_sbox_8.pkl")
+    (lin, inv) = mid.linear_layer_gf2()
+    assert lin == lin_layer_gf2()
+
+    states = [random.getrandbits(128) for _ in range(1000)]
+    images = lin.apply_ints(states)
+    assert images == [lin_layer(x) for x in states]
+    assert inv.apply_ints(images) == states
+
+    print("GF(2) linear layer test OK.")
+
+
 def test_paper_single_impossible_diff():
     """
     Testing the model with arbitrary Sbox against
@@ -165,11 +194,234 @@ def test_paper_all_impossible_diff():
     print("All impossible differentials test OK.")
 
 
+def random_cells(x, rng):
+    """
+    Replaces the active cells of x by random non-zero values,
+    as the arbitrary Sbox allows.
+    """
+    out = 0
+    for i in range(16):
+        if (x >> (8 * i)) & 0xFF != 0:
+            out |= rng.randrange(1, 256) << (8 * i)
+    return out
+
+
+def test_zero_fixings():
+    """
+    Testing that the zero fixings of the active cells keep all the pairs
+    that the model without them accepts.
+    Pairs from random trails with one active input (or output) cell are
+    possible, the same pairs with an output (or input) bit flipped may not be.
+    """
+    n = 3
+    mid = Skinny(n, "arbitrary_sbox_8_8.pkl")
+    mid.model.setParam("LogToConsole", 0)
+    (lin, inv) = mid.linear_layer_gf2()
+    rng = random.Random(0)
+
+    for cell in [0, 6, 13]:
+        pairs = []
+        for _ in range(3):
+            x = rng.randrange(1, 256) << (8 * cell)
+            y = random_cells(x, rng)
+            for _ in range(n - 1):
+                y = random_cells(lin.apply_ints([y])[0], rng)
+            pairs += [(x, y), (x, y ^ (1 << rng.randrange(128)))]
+        expected = [mid.is_possible(x, y) for (x, y) in pairs]
+        assert any(expected)
+        mid.set_active_input_cell(cell)
+        assert [mid.is_possible(x, y) for (x, y) in pairs] == expected
+        mid.unset_active_input_cell()
+
+        pairs = []
+        for _ in range(3):
+            y = rng.randrange(1, 256) << (8 * cell)
+            x = random_cells(y, rng)
+            for _ in range(n - 1):
+                x = random_cells(inv.apply_ints([x])[0], rng)
+            pairs += [(x, y), (x ^ (1 << rng.randrange(128)), y)]
+        expected = [mid.is_possible(x, y) for (x, y) in pairs]
+        assert any(expected)
+        mid.set_active_output_cell(cell)
+        assert [mid.is_possible(x, y) for (x, y) in pairs] == expected
+        mid.unset_active_output_cell()
+
+    print("Zero fixings test OK.")
+
+
+def random_pairs(mid, nb_pairs, rng):
+    """
+    Pairs of random trails of mid (arbitrary Sbox) from one active cell,
+    every other one with an output bit flipped.
+    """
+    (lin, _) = mid.linear_layer_gf2()
+    pairs = []
+    for k in range(nb_pairs):
+        x = rng.randrange(1, 256) << (8 * rng.randrange(16))
+        y = random_cells(x, rng)
+        for _ in range(mid.nb_rounds - 1):
+            y = random_cells(lin.apply_ints([y])[0], rng)
+        if k % 2 == 1:
+            y ^= 1 << rng.randrange(128)
+        pairs.append((x, y))
+    return pairs
+
+
+def test_sbox_modes():
+    """
+    Testing that the full, lazy and callback Sbox modelings give the same
+    answers, and that the full one comes back with its constraints.
+    The core has 4 of the 16 inequalities of the arbitrary Sbox.
+    """
+    mid = Skinny(3, "arbitrary_sbox_8_8.pkl")
+    mid.model.setParam("LogToConsole", 0)
+    pairs = random_pairs(mid, 8, random.Random(1))
+
+    mid.model.update()
+    sizes = {key: len(constrs) for (key, constrs) in mid.sbox_constrs.items()}
+    nb_constrs = mid.model.NumConstrs
+
+    expected = [mid.is_possible(x, y) for (x, y) in pairs]
+    assert any(expected) and not all(expected)
+    for mode in ["lazy", "callback", "full"]:
+        mid.set_sbox_mode(mode, core=4)
+        assert [mid.is_possible(x, y) for (x, y) in pairs] == expected
+
+    mid.model.update()
+    assert {key: len(constrs) for (key, constrs) in mid.sbox_constrs.items()} == sizes
+    assert mid.model.NumConstrs == nb_constrs
+
+    print("Sbox modes test OK.")
+
+
+def test_batch():
+    """
+    Testing is_possible_batch against is_possible in the three Sbox modes,
+    with a solution limit, then the model without the scenarios.
+    """
+    mid = Skinny(3, "arbitrary_sbox_8_8.pkl")
+    mid.model.setParam("LogToConsole", 0)
+    pairs = random_pairs(mid, 8, random.Random(2))
+
+    expected = [mid.is_possible(x, y) for (x, y) in pairs]
+    assert any(expected) and not all(expected)
+    for mode in ["full", "lazy", "callback"]:
+        mid.set_sbox_mode(mode, core=4)
+        assert mid.is_possible_batch(pairs) == expected
+        assert [mid.is_possible(x, y) for (x, y) in pairs] == expected
+
+    # As tuning.py may set it.
+    mid.set_sbox_mode("full")
+    mid.model.setParam("SolutionLimit", 1)
+    assert mid.is_possible_batch(pairs) == expected
+    assert mid.model.Params.SolutionLimit == 1
+    mid.model.setParam("SolutionLimit", gurobipy.GRB.MAXINT)
+
+    mid.is_possible_batch(pairs)
+    mid.clear_scenarios()
+    mid.model.update()
+    assert mid.model.NumScenarios == 0
+    for ((x, y), possible) in zip(pairs, expected):
+        assert mid.is_possible(x, y) == possible
+        if possible:
+            assert mid.last_input_diff() == x
+            assert mid.last_output_diff() == y
+
+    print("Batch test OK.")
+
+
+def test_result_store():
+    """
+    Testing the verdicts of a ResultStore, then that a search with the
+    store of the same search makes no query.
+    """
+    mid = Skinny(4, "arbitrary_sbox_8_8.pkl")
+    aux_in = Skinny(2, "arbitrary_sbox_8_8.pkl")
+    aux_out = Skinny(1, "arbitrary_sbox_8_8.pkl")
+    for primitive in [mid, aux_in, aux_out]:
+        primitive.model.setParam("LogToConsole", 0)
+    # Small enough for a size-limited license.
+    mid.set_sbox_mode("callback", core=4)
+    config = mid.config()
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = ResultStore(os.path.join(directory, "results.db"))
+        store.record(config, 1, 2, False)
+        store.record_many(config, [(1, 3, True, 0xABC), (4, 5, True, None)])
+        assert store.verdict(config, 1, 2) is False
+        assert store.verdict(config, 1, 3) is True
+        assert store.verdict(config, 1, 4) is None
+        assert store.trail(config, 1, 3) == 0xABC
+        assert store.trail(config, 4, 5) is None
+        assert store.impossible(config) == [(1, 2)]
+        other = dict(config, rounds=config["rounds"] + 1)
+        assert store.verdict(other, 1, 2) is None
+
+        the_dict = {1: {2, 3, 4}, 4: {5}}
+        assert store.prune(config, the_dict) == ([(1, 2)], 3)
+        assert the_dict == {1: {4}}
+        store.close()
+
+        store = ResultStore(os.path.join(directory, "search.db"))
+        results = []
+        for _ in range(2):
+            ys = {w << (8 * k) for (w, k) in itp(range(1, 3), range(16))}
+            the_dict = {
+                v << (8 * cell): set(ys) for (v, cell) in itp(range(1, 3), [0, 5])
+            }
+            metrics = Metrics()
+            res = mid.equimip_search(
+                the_dict, aux_in, aux_out, metrics=metrics, store=store
+            )
+            results.append(sorted(res))
+        assert len(results[0]) != 0
+        assert results[1] == results[0]
+        assert sum(metrics.queries.values()) == 0
+        store.close()
+
+    print("Result store test OK.")
+
+
+def test_sampler():
+    """
+    Testing the pairs proven possible by the Sampler and their trails
+    with the identity Sbox, where each pair has at most one trail.
+    """
+    n = 3
+    mid = Skinny(n, "identity_sbox_8.pkl")
+    mid.model.setParam("LogToConsole", 0)
+
+    the_dict = {}
+    expected = set()
+    for i in range(16):
+        x = 0x5A << (8 * i)
+        y = x
+        for j in range(n - 1):
+            y = lin_layer(y)
+        the_dict[x] = {y, y ^ 1, 1 << (8 * i)}
+        expected.add((x, y))
+
+    found = Sampler(mid, nb_samples=4).prune(the_dict)
+    assert set(found) == expected
+    assert all(len(ys) == 2 for ys in the_dict.values())
+    for ((x, y), trail) in found.items():
+        assert mid.is_possible(x, y)
+        assert mid.get_trail() == trail
+
+    print("Sampler test OK.")
+
+
 if __name__ == "__main__":
     """
     This section aims at testing this MIP model of Skinny
     for impossible differential search.
     """
     test_linear_layer()
+    test_gf2_linear_layer()
     test_paper_single_impossible_diff()
     test_paper_all_impossible_diff()
+    test_zero_fixings()
+    test_sbox_modes()
+    test_batch()
+    test_result_store()
+    test_sampler()
@@ -0,0 +1,143 @@
+"""
+Cell permutation symmetries of AES-like primitives.
+
+Since the same Sbox is applied on every cell, a permutation p of the cells
+that commutes with the linear layer maps every differential trail to another
+differential trail. Then (x, y) and (p(x), p(y)) are either both possible or
+both impossible and only one of them has to be searched.
+"""
+
+
+class CellSymmetry:
+    """
+    Group of the cell permutations that commute with the linear layer
+    of an AES-like primitive.
+    A permutation is a tuple perm where perm[i] is the image of cell i.
+    """
+
+    def __init__(self, primitive):
+        self.nb_nibbles = primitive.nb_nibbles
+        self.nibble_size = primitive.nibble_size
+
+        n = self.nb_nibbles
+        d = self.nibble_size
+        mask = (1 << d) - 1
+        rows = primitive.linear_layer_matrix()
+
+        # blocks[i][j] is the d x d block of the linear layer from
+        # input cell j to output cell i.
+        self.blocks = [
+            [
+                tuple((rows[(d * i) + k] >> (d * j)) & mask for k in range(d))
+                for j in range(n)
+            ]
+            for i in range(n)
+        ]
+
+        self.perms = self.automorphisms()
+
+    def automorphisms(self):
+        """
+        Computes all the cell permutations p such that
+        blocks[p[i]][p[j]] == blocks[i][j] for all cells i and j,
+        with a simple backtracking.
+        """
+        n = self.nb_nibbles
+        b = self.blocks
+        out = []
+        perm = []
+        used = [False] * n
+
+        def extend():
+            k = len(perm)
+            if k == n:
+                out.append(tuple(perm))
+                return
+            for c in range(n):
+                if used[c] or b[c][c] != b[k][k]:
+                    continue
+                if all(
+                    b[c][perm[l]] == b[k][l] and b[perm[l]][c] == b[l][k]
+                    for l in range(k)
+                ):
+                    used[c] = True
+                    perm.append(c)
+                    extend()
+                    perm.pop()
+                    used[c] = False
+
+        extend()
+        return out
+
+    def apply(self, perm, x):
+        """
+        Moves cell i of the state x to cell perm[i].
+        """
+        d = self.nibble_size
+        mask = (1 << d) - 1
+        out = 0
+        for i in range(self.nb_nibbles):
+            out ^= ((x >> (d * i)) & mask) << (d * perm[i])
+        return out
+
+    def inverse(self, perm):
+        out = [0] * len(perm)
+        for i in range(len(perm)):
+            out[perm[i]] = i
+        return tuple(out)
+
+    def canonical_pair(self, x, y):
+        """
+        Returns (x', y', perm) where (x', y') is the smallest image
+        of (x, y) under the group and perm maps (x, y) to it.
+        """
+        best = None
+        for perm in self.perms:
+            image = (self.apply(perm, x), self.apply(perm, y))
+            if best is None or image < best[:2]:
+                best = image + (perm,)
+        return best
+
+    def reduce_pairs(self, pairs):
+        """
+        Groups the pairs (x, y) by canonical representative.
+        Returns a map from the representatives to the list of
+        pairs they stand for.
+        """
+        classes = {}
+        for (x, y) in pairs:
+            (cx, cy, _) = self.canonical_pair(x, y)
+            classes.setdefault((cx, cy), []).append((x, y))
+        return classes
+
+    def replay(self, results, classes):
+        """
+        Given the list of the impossible representatives, returns
+        the list of all the impossible pairs they stand for.
+        """
+        out = []
+        for pair in results:
+            out += classes[pair]
+        return out
+
+    def cell_pair_orbits(self, cell_pairs):
+        """
+        Groups pairs of cells (in_cell, out_cell) by orbit.
+        Returns a map from the canonical pair of each orbit to the list of
+        (pair, perm) where perm maps the canonical pair to pair.
+        """
+        orbits = {}
+        for (i, o) in cell_pairs:
+            rep = min((perm[i], perm[o]) for perm in self.perms)
+            for perm in self.perms:
+                if (perm[rep[0]], perm[rep[1]]) == (i, o):
+                    break
+            orbits.setdefault(rep, []).append(((i, o), perm))
+        return orbits
+
+    def replay_cells(self, results, perm):
+        """
+        Maps the list results of impossible pairs found for a canonical
+        pair of cells to the pair of cells perm sends it to.
+        """
+        return [(self.apply(perm, x), self.apply(perm, y)) for (x, y) in results]
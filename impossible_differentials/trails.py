@@ -0,0 +1,112 @@
+"""
+Warm start of the queries with the trails of previous feasible queries.
+
+A trail is the packed solution of the variables of Primitive.trail_vars
+(the input and output of every Sbox layer for AesLike). After a feasible
+query (x, y), the trail is stored under (x, y); the next queries give the
+trail of the nearest stored pair to Gurobi as a hint (VarHintVal) or as a
+MIP start (Start). It is only a guide: the answers do not change.
+Pairs are compared by the Hamming distance of x then of y, the pairs with the
+same input first (eg. the consecutive queries of equimip_search).
+The trails of a library all have the same number of variables: a trail of
+another size (eg. after Primitive.add_round) drops the stored ones.
+"""
+from collections import OrderedDict
+import threading
+import utilities
+
+
+class TrailLibrary:
+    """
+    Stores the trails of the last capacity feasible pairs.
+    attribute: "VarHintVal" or "Start".
+    The library can be shared between copies of a model (or threads).
+    """
+
+    def __init__(self, capacity=1024, attribute="VarHintVal"):
+        assert attribute in ["VarHintVal", "Start"]
+        self.capacity = capacity
+        self.attribute = attribute
+        self.lock = threading.Lock()
+        # (x, y) -> trail, least recently used first.
+        self.trails = OrderedDict()
+        # x -> set of y with a trail.
+        self.by_input = {}
+        # Number of variables of the stored trails.
+        self.size = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.trails)
+
+    def clear(self):
+        with self.lock:
+            self.trails.clear()
+            self.by_input.clear()
+            self.size = None
+
+    def check_size(self, size):
+        """
+        Drops the stored trails if they do not have size variables.
+        Called with the lock held.
+        """
+        if size != self.size:
+            self.trails.clear()
+            self.by_input.clear()
+            self.size = size
+
+    def add(self, x, y, trail, size):
+        """
+        Stores the trail of (x, y) on size variables.
+        """
+        with self.lock:
+            self.check_size(size)
+            self.trails[x, y] = trail
+            self.trails.move_to_end((x, y))
+            self.by_input.setdefault(x, set()).add(y)
+            while len(self.trails) > self.capacity:
+                ((old_x, old_y), _) = self.trails.popitem(last=False)
+                self.by_input[old_x].discard(old_y)
+                if len(self.by_input[old_x]) == 0:
+                    del self.by_input[old_x]
+
+    def nearest(self, x, y, size):
+        """
+        Trail of the nearest stored pair or None if the library has no trail
+        on size variables.
+        """
+        with self.lock:
+            self.check_size(size)
+            if x in self.by_input:
+                candidates = [(x, y_lib) for y_lib in self.by_input[x]]
+            else:
+                candidates = list(self.trails)
+            if len(candidates) == 0:
+                self.misses += 1
+                return None
+            self.hits += 1
+            pair = min(
+                candidates,
+                key=lambda p: (utilities.hwt(p[0] ^ x), utilities.hwt(p[1] ^ y)),
+            )
+            self.trails.move_to_end(pair)
+            return self.trails[pair]
+
+    def warm_start(self, primitive, x, y):
+        """
+        Gives the nearest trail of (x, y) to the model of primitive.
+        """
+        variables = primitive.trail_vars()
+        trail = self.nearest(x, y, len(variables))
+        if trail is None:
+            return
+        values = utilities.bits_array(trail, len(variables)).tolist()
+        primitive.model.setAttr(self.attribute, variables, values)
+
+    def record(self, primitive, x, y):
+        """
+        Stores the trail of the last (feasible) solution of primitive.
+        """
+        self.add(x, y, primitive.get_trail(), len(primitive.trail_vars()))
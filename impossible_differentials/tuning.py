@@ -0,0 +1,168 @@
+"""
+Tuning of the Gurobi parameters for the feasibility queries of is_possible.
+
+The best parameter set found for a configuration (cipher, rounds, Sbox model,
+MixColumns model) is stored in a JSON file and applied automatically by
+AesLike when it builds a model with the same configuration.
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+default_file = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "tuned_params.json"
+)
+
+# Parameter sets tried by default. The empty set stands for Gurobi defaults.
+candidate_params = [
+    {},
+    {"SolutionLimit": 1},
+    {"MIPFocus": 1},
+    {"MIPFocus": 1, "SolutionLimit": 1},
+    {"MIPFocus": 1, "Heuristics": 0.5},
+    {"MIPFocus": 3},
+    {"Presolve": 2},
+    {"Presolve": 0},
+    {"Cuts": 0},
+    {"Cuts": 2},
+    {"Heuristics": 0},
+    {"Threads": 1},
+]
+
+
+def config_key(config):
+    return "{cipher}/{rounds}/{sbox}/{mixcol}".format(**config)
+
+
+def load_params(config, file_name=default_file):
+    """
+    Returns the tuned parameters of the configuration or None.
+    """
+    if not os.path.exists(file_name):
+        return None
+    with open(file_name, "r") as f:
+        table = json.load(f)
+    entry = table.get(config_key(config))
+    return None if entry is None else entry["params"]
+
+
+def save_params(config, params, timings=None, file_name=default_file):
+    table = {}
+    if os.path.exists(file_name):
+        with open(file_name, "r") as f:
+            table = json.load(f)
+    table[config_key(config)] = {"params": params, "timings": timings}
+    with open(file_name, "w") as f:
+        json.dump(table, f, indent=2, sort_keys=True)
+
+
+def apply_tuned_params(primitive, file_name=default_file):
+    params = load_params(primitive.config(), file_name)
+    if params is not None:
+        for (name, value) in params.items():
+            primitive.model.setParam(name, value)
+
+
+def sample_queries(primitive, nb_queries, seed=0, cells=None):
+    """
+    Samples nb_queries pairs (x, y) with one active input cell and one active
+    output cell, like the ones of main_aes.py and main_skinny.py.
+    cells: optional list of (in_cell, out_cell) to pick from.
+    """
+    rng = random.Random(seed)
+    d = primitive.nibble_size
+    if cells is None:
+        n = primitive.nb_nibbles
+        cells = [(i, o) for i in range(n) for o in range(n)]
+
+    queries = []
+    for _ in range(nb_queries):
+        (in_cell, out_cell) = rng.choice(cells)
+        x = rng.randrange(1, 1 << d) << (d * in_cell)
+        y = rng.randrange(1, 1 << d) << (d * out_cell)
+        queries.append((x, y))
+    return queries
+
+
+def evaluate(primitive, params, queries):
+    """
+    Solves the queries with the parameter set params.
+    Returns the total time and the list of answers.
+    """
+    primitive.model.resetParams()
+    primitive.model.setParam("LogToConsole", 0)
+    for (name, value) in params.items():
+        primitive.model.setParam(name, value)
+
+    verdicts = []
+    start = time.time()
+    for (x, y) in queries:
+        # No warm start from the previous query.
+        primitive.model.reset()
+        verdicts.append(primitive.is_possible(x, y))
+    return (time.time() - start, verdicts)
+
+
+def tune(primitive, queries, candidates=candidate_params):
+    """
+    Evaluates all the candidate parameter sets on the queries.
+    Returns the fastest one and the timings of all of them.
+    All the parameter sets must give the same answers.
+    """
+    timings = []
+    reference = None
+    for params in candidates:
+        (total, verdicts) = evaluate(primitive, params, queries)
+        if reference is None:
+            reference = verdicts
+        assert verdicts == reference, "Parameters {} change the answers.".format(params)
+        timings.append((params, total))
+        print("{:8.2f}s  {}".format(total, params))
+
+    (best, _) = min(timings, key=lambda t: t[1])
+
+    primitive.model.resetParams()
+    primitive.model.setParam("LogToConsole", 0)
+    for (name, value) in best.items():
+        primitive.model.setParam(name, value)
+
+    return (best, timings)
+
+
+if __name__ == "__main__":
+    from aes import Aes
+    from skinny import Skinny
+
+    ciphers = {"aes": Aes, "skinny": Skinny}
+
+    parser = argparse.ArgumentParser(
+        description="Tunes the Gurobi parameters of is_possible for one configuration."
+    )
+    parser.add_argument("cipher", type=str, choices=list(ciphers))
+    parser.add_argument("nb_rounds", type=int, help="Number of rounds.")
+    parser.add_argument("sbox_file", type=str, help="Pickle file of the Sbox model.")
+    parser.add_argument(
+        "-m", type=str, dest="mixcol", default="equiv", help="MixColumns model."
+    )
+    parser.add_argument(
+        "-n", type=int, dest="nb_queries", default=20, help="Number of queries."
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the queries.")
+    parser.add_argument(
+        "-f", type=str, dest="file_name", default=default_file, help="JSON file."
+    )
+    args = parser.parse_args()
+
+    primitive = ciphers[args.cipher](args.nb_rounds, args.sbox_file, mixcol=args.mixcol)
+    queries = sample_queries(primitive, args.nb_queries, seed=args.seed)
+    (best, timings) = tune(primitive, queries)
+
+    save_params(
+        primitive.config(),
+        best,
+        timings=[[params, total] for (params, total) in timings],
+        file_name=args.file_name,
+    )
+    print("Best parameters for {}: {}".format(config_key(primitive.config()), best))
@@ -1,3 +1,7 @@
+import itertools
+import numpy as np
+
+
 def bits(n, size):
     output = [0] * size
     for i in range(size):
@@ -5,28 +9,59 @@ def bits(n, size):
     return output
 
 
+def bits_array(n, size):
+    """
+    Same as bits but as a numpy array of uint8 (the bits of n above size
+    are ignored).
+    """
+    data = (n & ((1 << size) - 1)).to_bytes((size + 7) // 8, "little")
+    return np.unpackbits(np.frombuffer(data, dtype=np.uint8), bitorder="little")[:size]
+
+
+def from_bits(values):
+    """
+    Packs values (bit i first, eg. the values of binary variables
+    in a solution) into an integer.
+    """
+    bit_array = np.asarray(values) >= 0.5
+    return int.from_bytes(np.packbits(bit_array, bitorder="little").tobytes(), "little")
+
+
 def log2(n):
     return n.bit_length() - 1
 
 
-def ddt_rows(ddt, in_size, out_size):
-    out = {}
-    for a in range(1 << in_size):
-        out[a] = set()
-        for b in range(1 << out_size):
-            if ddt[a, b] != 0:
-                out[a].add(b)
-    return out
+def ddt_array(ddt, in_size, out_size):
+    """
+    The DDT of a pickle file (python dict (a, b) -> number of solutions)
+    as a numpy array of shape (2^in_size, 2^out_size).
+    """
+    if isinstance(ddt, np.ndarray):
+        return ddt
+    keys = np.fromiter(
+        itertools.chain.from_iterable(ddt.keys()), dtype=np.int64, count=2 * len(ddt)
+    ).reshape(-1, 2)
+    values = np.fromiter(ddt.values(), dtype=np.int64, count=len(ddt))
+    table = np.zeros((1 << in_size, 1 << out_size), dtype=np.int64)
+    table[keys[:, 0], keys[:, 1]] = values
+    return table
+
+
+def support_masks(support):
+    """
+    Bit j of out[i] is support[i, j] (boolean array).
+    """
+    packed = np.packbits(support, axis=1, bitorder="little")
+    return [int.from_bytes(row.tobytes(), "little") for row in packed]
 
 
-def ddt_cols(ddt, in_size, out_size):
-    out = {}
-    for b in range(1 << out_size):
-        out[b] = set()
-        for a in range(1 << in_size):
-            if ddt[a, b] != 0:
-                out[b].add(a)
-    return out
+def ddt_masks(ddt, in_size, out_size):
+    """
+    Row and column supports of the DDT as integers: bit b of rows[a]
+    (and bit a of cols[b]) is set when the transition a -> b is possible.
+    """
+    support = ddt_array(ddt, in_size, out_size) != 0
+    return (support_masks(support), support_masks(support.T))
 
 
 # def product(my_list, repeat=1):
@@ -42,3 +77,21 @@ def ddt_cols(ddt, in_size, out_size):
 
 def hwt(x):
     return bin(x).count("1")
+
+
+def inverse_matrix(rows):
+    """
+    Inverse of an invertible binary matrix given as a list of integers
+    (bit j of rows[i] is the coefficient (i, j)), in the same format.
+    """
+    n = len(rows)
+    # Gauss-Jordan on (rows | I).
+    aug = [rows[i] | (1 << (n + i)) for i in range(n)]
+    for col in range(n):
+        pivot = [i for i in range(col, n) if (aug[i] >> col) & 1]
+        assert len(pivot) != 0, "Matrix is not invertible."
+        (aug[col], aug[pivot[0]]) = (aug[pivot[0]], aug[col])
+        for i in range(n):
+            if i != col and (aug[i] >> col) & 1:
+                aug[i] ^= aug[col]
+    return [aug[i] >> n for i in range(n)]
@@ -1,3 +1,4 @@
+from ddt import arbitrary_table, ddt_dict
 import pickle
 import sys
 
@@ -17,10 +18,7 @@ def generate_arbitrary_sbox(in_size, out_size):
         ineg[inp] = -1
         ineg_set.add(tuple(ineg))
 
-    ddt = {}
-    for a in range(1 << in_size):
-        for b in range(1 << out_size):
-            ddt[a, b] = 1 if a != b else 0
+    ddt = ddt_dict(arbitrary_table(in_size, out_size))
 
     with open("arbitrary_sbox_{}_{}.pkl".format(in_size, out_size), "wb") as f:
         pickle.dump((in_size, out_size, ddt, ineg_set), f, 3)
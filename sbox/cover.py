@@ -0,0 +1,216 @@
+"""
+Compact format of the set cover instances of convex_hull.sage.
+
+An instance is a big set of inequalities and the impossible points of a DDT
+that each of them discards: minimize.py chooses inequalities discarding all
+the points. The pickle files of convex_hull.sage hold it as python sets,
+with the incidence twice (ineq_to_points and point_to_ineqs). A CoverInstance
+is a directory of .npy files, which numpy can memory-map:
+- ineqs.npy: one inequality per row (constant last, as in the pickle files),
+  as int8 (or a larger type if a coefficient does not fit).
+- points.npy: the impossible points in_diff + (out_diff << in_size), sorted.
+- indptr.npy and indices.npy: the incidence in CSR format, inequality i
+  discards the points of indices indices[indptr[i] : indptr[i + 1]].
+- ddt.npy: the DDT as an array (see ddt.py).
+"""
+import numpy as np
+import argparse
+import os
+import pickle
+
+files = ["ineqs", "points", "indptr", "indices", "ddt"]
+
+
+def smallest_int_type(matrix):
+    """
+    Smallest signed integer type holding all the values of matrix.
+    """
+    for dtype in [np.int8, np.int16, np.int32]:
+        info = np.iinfo(dtype)
+        if len(matrix) == 0 or (matrix.min() >= info.min and matrix.max() <= info.max):
+            return dtype
+    return np.int64
+
+
+class CoverInstance:
+    """
+    Inequalities and impossible points of one DDT (see the module docstring).
+    """
+
+    def __init__(self, ddt, ineqs, points, indptr, indices):
+        self.ddt = ddt
+        self.ineqs = ineqs
+        self.points = points
+        self.indptr = indptr
+        self.indices = indices
+
+        self.in_size = int(ddt.shape[0]).bit_length() - 1
+        self.out_size = int(ddt.shape[1]).bit_length() - 1
+        self.nb_ineqs = len(ineqs)
+        self.nb_points = len(points)
+
+    @classmethod
+    def from_sets(cls, ddt, ineq_set, point_set, ineq_to_points):
+        """
+        Instance of the python objects of convex_hull.sage (ddt is a dict or
+        an array). The inequalities and the points are sorted.
+        """
+        if isinstance(ddt, dict):
+            (nb_in, nb_out) = [1 + max([key[k] for key in ddt]) for k in range(2)]
+            table = np.zeros((nb_in, nb_out), dtype=np.int64)
+            for ((a, b), value) in ddt.items():
+                table[a, b] = value
+            ddt = table
+
+        ineq_list = sorted(ineq_set)
+        points = np.array(sorted(point_set), dtype=np.int64)
+        matrix = np.array(ineq_list, dtype=np.int64).reshape(len(ineq_list), -1)
+        ineqs = matrix.astype(smallest_int_type(matrix))
+
+        counts = [len(ineq_to_points[ineq]) for ineq in ineq_list]
+        indptr = np.zeros(len(ineq_list) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(counts)
+        flat = np.fromiter(
+            (p for ineq in ineq_list for p in ineq_to_points[ineq]),
+            dtype=np.int64,
+            count=int(indptr[-1]),
+        )
+        indices = np.searchsorted(points, flat).astype(np.int32)
+        # Indices are sorted within each row.
+        rows = np.repeat(np.arange(len(ineq_list)), counts)
+        indices = indices[np.lexsort((indices, rows))]
+        return cls(ddt, ineqs, points, indptr, indices)
+
+    @classmethod
+    def from_pickle(cls, file_name):
+        """
+        Instance of a pickle file of convex_hull.sage.
+        """
+        with open(file_name, "rb") as f:
+            (_, _, ddt, ineq_set, point_set, ineq_to_points, _) = pickle.load(f)
+        return cls.from_sets(ddt, ineq_set, point_set, ineq_to_points)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name in files:
+            np.save(os.path.join(directory, name + ".npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Loads an instance saved by save. With mmap, the arrays are
+        memory-mapped and only the parts which are used are read.
+        """
+        mode = "r" if mmap else None
+        arrays = {
+            name: np.load(os.path.join(directory, name + ".npy"), mmap_mode=mode)
+            for name in files
+        }
+        return cls(**arrays)
+
+    def counts(self):
+        """
+        Number of points discarded by each inequality.
+        """
+        return np.diff(self.indptr)
+
+    def points_of(self, i):
+        """
+        Indices of the points discarded by inequality i.
+        """
+        return self.indices[self.indptr[i] : self.indptr[i + 1]]
+
+    def chunks(self, size=1 << 12):
+        """
+        Yields (start, indptr, indices) for the inequalities start to
+        start + size: the incidence of this block in CSR format, with
+        indptr starting at 0. Only this block is read from the files.
+        """
+        for start in range(0, self.nb_ineqs, size):
+            stop = min(start + size, self.nb_ineqs)
+            indptr = np.array(self.indptr[start : stop + 1])
+            indices = np.array(self.indices[indptr[0] : indptr[-1]])
+            yield (start, indptr - indptr[0], indices)
+
+    def transpose(self):
+        """
+        Incidence from the points to the inequalities in CSR format
+        (indptr, indices): the inequalities discarding point j are
+        indices[indptr[j] : indptr[j + 1]], in increasing order.
+        """
+        rows = np.repeat(np.arange(self.nb_ineqs, dtype=np.int32), self.counts())
+        order = np.argsort(self.indices, kind="stable")
+        indptr = np.zeros(self.nb_points + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(self.indices, minlength=self.nb_points))
+        return (indptr, rows[order])
+
+    def restrict(self, ineq_ids, point_ids):
+        """
+        Instance of the inequalities ineq_ids and of the points point_ids
+        (sorted arrays of indices) with the incidence between them.
+        """
+        new_index = np.full(self.nb_points, -1, dtype=np.int64)
+        new_index[point_ids] = np.arange(len(point_ids))
+        rows = [new_index[self.points_of(i)] for i in ineq_ids]
+        rows = [row[row >= 0] for row in rows]
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(row) for row in rows])
+        indices = np.concatenate([np.zeros(0, dtype=np.int64)] + rows)
+        return CoverInstance(
+            self.ddt,
+            np.asarray(self.ineqs[ineq_ids]),
+            np.asarray(self.points[point_ids]),
+            indptr,
+            indices.astype(np.int32),
+        )
+
+    def inequality(self, i):
+        return tuple(int(c) for c in self.ineqs[i])
+
+    def inequalities(self, indices):
+        """
+        Set of the inequalities of indices, in the format of the pickle files.
+        """
+        return set(self.inequality(i) for i in indices)
+
+    def find(self, ineq_set):
+        """
+        Indices of the inequalities of ineq_set (a KeyError is raised if
+        one of them is not in the instance).
+        """
+        index = {self.inequality(i): i for i in range(self.nb_ineqs)}
+        return sorted(index[tuple(ineq)] for ineq in ineq_set)
+
+    def check(self):
+        """
+        Checks the incidence against the inequalities and the DDT.
+        """
+        n = self.in_size + self.out_size
+        points = (self.points[:, None] >> np.arange(n)[None, :]) & 1
+        mask = (1 << self.in_size) - 1
+        (a, b) = (self.points & mask, self.points >> self.in_size)
+        assert (self.ddt[a, b] == 0).all()
+        assert len(self.points) == (np.asarray(self.ddt) == 0).sum()
+        for (start, indptr, indices) in self.chunks():
+            ineqs = np.asarray(self.ineqs[start : start + len(indptr) - 1], np.int64)
+            values = points @ ineqs[:, :-1].T + ineqs[:, -1]
+            for i in range(len(ineqs)):
+                discarded = np.nonzero(values[:, i] < 0)[0]
+                assert np.array_equal(discarded, indices[indptr[i] : indptr[i + 1]])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Converts a pickle file of convex_hull.sage to the compact format."
+    )
+    parser.add_argument("ineq_file", type=str, help="Pickle file of convex_hull.sage.")
+    parser.add_argument("directory", type=str, help="Directory of the .npy files.")
+    args = parser.parse_args()
+
+    instance = CoverInstance.from_pickle(args.ineq_file)
+    instance.save(args.directory)
+    print(
+        "{} inequalities, {} points, {} incidences.".format(
+            instance.nb_ineqs, instance.nb_points, len(instance.indices)
+        )
+    )
@@ -0,0 +1,48 @@
+"""
+DDTs of Sboxes with numpy, without SageMath.
+
+The table of an Sbox given by its lookup table is computed in one pass over
+all the pairs (x, a). ddt_dict gives the format of the pickle files
+(python dict (a, b) -> number of solutions).
+"""
+import numpy as np
+
+
+def ddt_table(lut, out_size=None):
+    """
+    DDT of the Sbox x -> lut[x] as an array of shape (2^in_size, 2^out_size).
+    """
+    lut = np.asarray(lut, dtype=np.int64)
+    nb_in = len(lut)
+    assert nb_in & (nb_in - 1) == 0, "The size of the lookup table is not a power of 2."
+    if out_size is None:
+        out_size = int(lut.max()).bit_length()
+    nb_out = 1 << out_size
+
+    x = np.arange(nb_in)
+    a = x[:, None]
+    b = lut[x] ^ lut[x ^ a]
+    counts = np.bincount((a * nb_out + b).ravel(), minlength=nb_in * nb_out)
+    return counts.reshape(nb_in, nb_out)
+
+
+def arbitrary_table(in_size, out_size):
+    """
+    Arbitrary Sbox of Sasaki Todo EC17: only the transitions between zero
+    and a non zero difference are impossible.
+    """
+    a = np.arange(1 << in_size)[:, None]
+    b = np.arange(1 << out_size)[None, :]
+    return ((a == 0) == (b == 0)).astype(np.int64)
+
+
+def ddt_dict(table):
+    """
+    The table in the format of the pickle files.
+    """
+    (nb_in, nb_out) = table.shape
+    values = table.ravel().tolist()
+    return {
+        (a, b): values[(a * nb_out) + b] for a in range(nb_in) for b in range(nb_out)
+    }
+
@@ -1,3 +1,4 @@
+from ddt import ddt_table, ddt_dict
 import pickle
 import sys
 
@@ -14,12 +15,7 @@ def generate_identity_sbox(size):
         ineg[i + size] = 1
         ineg_set.add(tuple(ineg))
 
-    ddt = {}
-    ddt[0, 0] = 1
-    for a in range(1, 1 << size):
-        for b in range(1 << size):
-            ddt[a, b] = 0 if a != b else 1
-        ddt[0, a] = 0
+    ddt = ddt_dict(ddt_table(range(1 << size), size))
 
     with open("identity_sbox_{}.pkl".format(size), "wb") as f:
         pickle.dump((size, size, ddt, ineg_set), f, 3)
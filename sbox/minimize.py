@@ -1,6 +1,13 @@
 import argparse
+import os
 import pickle
+import sys
+import numpy as np
 from gurobipy import *
+from cover import CoverInstance
+from ddt import ddt_dict
+from presolve import Presolve
+from concurrent.futures import ThreadPoolExecutor
 
 
 def build_model(ineq_set, point_set, ineq_to_points, point_to_ineqs, start=None):
@@ -87,7 +94,20 @@ def optimize(
         )
 
     model.optimize()
+    check_status(model)
 
+    final_ineq_set = set()
+    for ineq in ineq_set:
+        if z[ineq].x >= 0.5:
+            final_ineq_set.add(ineq)
+
+    return final_ineq_set
+
+
+def check_status(model):
+    """
+    Exits if the model was not solved to optimality.
+    """
     status = model.getAttr(GRB.Attr.Status)
 
     if status == GRB.INF_OR_UNBD or status == GRB.INFEASIBLE or status == GRB.UNBOUNDED:
@@ -97,12 +117,62 @@ def optimize(
         print("Optimization was stopped with status ", status)
         sys.exit(1)
 
-    final_ineq_set = set()
-    for ineq in ineq_set:
-        if z[ineq].x >= 0.5:
-            final_ineq_set.add(ineq)
 
-    return final_ineq_set
+def optimize_cover(instance, number=None, start=None, threshold=None, env=None):
+    """
+    Same as optimize on a cover.CoverInstance, without python sets:
+    the constraints come from the incidence of the points.
+    start: optional list of indices of inequalities.
+    env: Gurobi environment of the model (the default one if None).
+    Returns the sorted list of the indices of the chosen inequalities.
+    """
+    counts = instance.counts()
+    (indptr, indices) = instance.transpose()
+    in_start = np.zeros(instance.nb_ineqs, dtype=bool)
+    if start is not None:
+        in_start[list(start)] = True
+
+    if threshold is None:
+        used = np.arange(instance.nb_ineqs)
+    else:
+        # Each point keeps its <threshold> best ineqs, the ones of start
+        # are kept for all the points.
+        keep = in_start[indices]
+        for j in range(instance.nb_points):
+            row = indices[indptr[j] : indptr[j + 1]]
+            best = np.argsort(counts[row], kind="stable")[:threshold]
+            keep[indptr[j] + best] = True
+        lengths = np.bincount(
+            np.repeat(np.arange(instance.nb_points), np.diff(indptr))[keep],
+            minlength=instance.nb_points,
+        )
+        indices = indices[keep]
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        used = np.union1d(np.unique(indices), np.nonzero(in_start)[0])
+
+    model = Model("small milp", env=env)
+    z = model.addVars(used.tolist(), vtype=GRB.BINARY, name="z")
+    if start is not None:
+        for i in z:
+            z[i].start = 1.0 if in_start[i] else 0.0
+
+    for j in range(instance.nb_points):
+        row = indices[indptr[j] : indptr[j + 1]].tolist()
+        model.addConstr(
+            quicksum(z[i] for i in row) >= 1,
+            name="point {}".format(int(instance.points[j])),
+        )
+
+    if number is None:
+        model.setObjective(z.sum(), GRB.MINIMIZE)
+    else:
+        model.addConstr(z.sum() <= number)
+        model.setObjective(quicksum(z[i] * int(counts[i]) for i in z), GRB.MAXIMIZE)
+
+    model.optimize()
+    check_status(model)
+
+    return sorted(i for i in z if z[i].x >= 0.5)
 
 
 def greedy_start(
@@ -138,6 +208,78 @@ def greedy_start(
     return greedy_ineqs
 
 
+def greedy_cover(instance, chunk_size=1 << 12):
+    """
+    Same as greedy_start on a cover.CoverInstance: at each step, the number
+    of points not discarded yet of each inequality is computed from the
+    incidence, one block of chunk_size inequalities at a time.
+    Returns the list of the indices of the chosen inequalities.
+    """
+    remaining = np.ones(instance.nb_points, dtype=np.int64)
+    greedy_ineqs = []
+
+    while remaining.any():
+        # Search for best ineq
+        (best, best_gain) = (None, 0)
+        for (start, indptr, indices) in instance.chunks(chunk_size):
+            sums = np.zeros(len(indices) + 1, dtype=np.int64)
+            np.cumsum(remaining[indices], out=sums[1:])
+            gains = sums[indptr[1:]] - sums[indptr[:-1]]
+            i = int(np.argmax(gains))
+            if gains[i] > best_gain:
+                (best, best_gain) = (start + i, int(gains[i]))
+        assert best is not None, "Some points are discarded by no inequality."
+
+        greedy_ineqs.append(best)
+        remaining[instance.points_of(best)] = 0
+
+    return greedy_ineqs
+
+
+def presolved_cover(instance, mode="greedy", start=None, threshold=None, workers=1):
+    """
+    Runs greedy_cover (mode greedy) or optimize_cover (mode milp, minimizing
+    the number of inequalities) on the components of the presolved instance
+    (see presolve.py), workers of them at the same time.
+    start: optional list of indices of inequalities, restricted to each component.
+    Returns the sorted list of the indices of the chosen inequalities,
+    the forced ones included.
+    """
+    presolve = Presolve(instance)
+    print(
+        "Presolve: {} forced inequalities, {} components ".format(
+            len(presolve.forced), len(presolve.components)
+        )
+        + "of {} inequalities and {} points.".format(
+            sum([sub.nb_ineqs for (sub, _) in presolve.components]),
+            sum([sub.nb_points for (sub, _) in presolve.components]),
+        )
+    )
+    in_start = np.zeros(instance.nb_ineqs, dtype=bool)
+    if start is not None:
+        in_start[list(start)] = True
+
+    def solve(component):
+        (sub, ineq_ids) = component
+        if mode == "greedy":
+            chosen = greedy_cover(sub)
+        else:
+            sub_start = None
+            if start is not None:
+                sub_start = np.nonzero(in_start[ineq_ids])[0].tolist()
+            # Gurobi environments are not thread-safe: one per component.
+            chosen = optimize_cover(
+                sub, start=sub_start, threshold=threshold, env=Env()
+            )
+        return ineq_ids[chosen].tolist()
+
+    out = list(presolve.forced)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for chosen in executor.map(solve, presolve.components):
+            out += chosen
+    return sorted(out)
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(
@@ -148,7 +290,7 @@ if __name__ == "__main__":
         type=str,
         help="Pickle file containing tuple "
         + "(in_size, out_size, ddt, ineq_set, point_set, "
-        + "ineq_to_points, point_to_ineqs).",
+        + "ineq_to_points, point_to_ineqs), or directory of a cover.CoverInstance.",
     )
     parser.add_argument(
         "-m",
@@ -178,32 +320,77 @@ if __name__ == "__main__":
         help="Pickle file with a starting solution (set of inequalities)"
         + " if the chosen mode is milp.",
     )
+    parser.add_argument(
+        "-p",
+        action="store_true",
+        dest="presolve",
+        help="Presolve the instance and solve its components separately"
+        + " (not with -n).",
+    )
+    parser.add_argument(
+        "-w",
+        type=int,
+        dest="workers",
+        default=1,
+        help="Number of components solved in parallel with -p.",
+    )
     args = parser.parse_args()
-
-    output_file = "sbox_{}".format(args.ineq_file)
-
-    with open(args.ineq_file, "rb") as f:
-        (
-            in_size,
-            out_size,
-            ddt,
-            ineq_set,
-            point_set,
-            ineq_to_points,
-            point_to_ineqs,
-        ) = pickle.load(f)
-
-    if args.mode == "greedy":
-        final_set = greedy_start(ineq_set, point_set, ineq_to_points)
-        output_file = "greedy_" + output_file
+    if args.presolve and args.number is not None:
+        parser.error("-p keeps the minimum number of inequalities only, not -n.")
+
+    # The compact format is read without building python sets.
+    if os.path.isdir(args.ineq_file):
+        instance = CoverInstance.load(args.ineq_file)
+        (in_size, out_size) = (instance.in_size, instance.out_size)
+        ddt = ddt_dict(np.asarray(instance.ddt))
+        output_file = "sbox_{}.pkl".format(os.path.normpath(args.ineq_file))
     else:
-        if args.start_file is not None:
-            with open(args.start_file, "rb") as f:
-                (_, _, ddt_start, ineq_start) = pickle.load(f)
-            assert ddt_start == ddt
-        else:
-            ineq_start = None
+        instance = None
+        output_file = "sbox_{}".format(args.ineq_file)
+
+        with open(args.ineq_file, "rb") as f:
+            (
+                in_size,
+                out_size,
+                ddt,
+                ineq_set,
+                point_set,
+                ineq_to_points,
+                point_to_ineqs,
+            ) = pickle.load(f)
+
+    if args.presolve and instance is None:
+        instance = CoverInstance.from_sets(ddt, ineq_set, point_set, ineq_to_points)
+
+    if args.start_file is not None:
+        with open(args.start_file, "rb") as f:
+            (_, _, ddt_start, ineq_start) = pickle.load(f)
+        assert ddt_start == ddt
+        if instance is not None:
+            ineq_start = instance.find(ineq_start)
+    else:
+        ineq_start = None
 
+    if args.presolve:
+        chosen = presolved_cover(
+            instance,
+            mode=args.mode,
+            start=ineq_start,
+            threshold=args.threshold,
+            workers=args.workers,
+        )
+        final_set = instance.inequalities(chosen)
+    elif args.mode == "greedy":
+        if instance is not None:
+            final_set = instance.inequalities(greedy_cover(instance))
+        else:
+            final_set = greedy_start(ineq_set, point_set, ineq_to_points)
+    elif instance is not None:
+        chosen = optimize_cover(
+            instance, number=args.number, start=ineq_start, threshold=args.threshold
+        )
+        final_set = instance.inequalities(chosen)
+    else:
         final_set = optimize(
             ineq_set,
             point_set,
@@ -214,10 +401,12 @@ if __name__ == "__main__":
             threshold=args.threshold,
         )
 
-        if args.number is None:
-            output_file = "milp_minimal_" + output_file
-        else:
-            output_file = "milp_{}_".format(args.number) + output_file
+    if args.mode == "greedy":
+        output_file = "greedy_" + output_file
+    elif args.number is None:
+        output_file = "milp_minimal_" + output_file
+    else:
+        output_file = "milp_{}_".format(args.number) + output_file
 
     with open(output_file, "wb") as f:
         pickle.dump((in_size, out_size, ddt, final_set), f, 3)
@@ -0,0 +1,277 @@
+"""
+Presolve of the set cover instances of minimize.py (see cover.py).
+
+The reductions are applied until none of them changes the instance:
+- a point discarded by only one inequality forces this inequality, which
+  is chosen, and the points it discards are removed;
+- an inequality whose points are all discarded by another inequality is
+  dominated (the other one can replace it in any cover) and removed, as
+  well as the inequalities without points;
+- a point whose inequalities all discard another point is dominated
+  (covering the other point covers it) and removed.
+Then the points and the inequalities left are split into the connected
+components of their incidence graph, which are independent instances.
+These reductions keep the minimum number of inequalities.
+
+The inclusion tests count the common points (or inequalities) on the
+incidence in CSR format of the instance and its transpose, so a
+memory-mapped instance is only read where it is used.
+"""
+import numpy as np
+
+
+def gather(indptr, indices, rows):
+    """
+    Concatenation of the given rows of the CSR matrix (indptr, indices).
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return np.asarray(indices[offsets + np.arange(len(offsets))])
+
+
+class Presolve:
+    """
+    Presolve of a cover.CoverInstance.
+    forced: indices of the inequalities that are chosen in any cover.
+    components: list of (sub-instance, indices of its inequalities in the
+    instance), see CoverInstance.restrict.
+    """
+
+    def __init__(self, instance, split=True):
+        self.instance = instance
+        (self.indptr, self.indices) = instance.transpose()
+
+        self.alive_ineqs = np.ones(instance.nb_ineqs, dtype=bool)
+        self.alive_points = np.ones(instance.nb_points, dtype=bool)
+        self.forced = []
+
+        changed = True
+        while changed:
+            changed = self.force()
+            changed |= self.remove_dominated_ineqs()
+            changed |= self.remove_dominated_points()
+        self.forced.sort()
+
+        ineqs = np.nonzero(self.alive_ineqs)[0]
+        points = np.nonzero(self.alive_points)[0]
+        if split:
+            self.components = [
+                (instance.restrict(c_ineqs, c_points), c_ineqs)
+                for (c_ineqs, c_points) in self.split()
+            ]
+        elif len(points) != 0:
+            self.components = [(instance.restrict(ineqs, points), ineqs)]
+        else:
+            self.components = []
+
+    def ineqs_of(self, points):
+        """
+        Inequalities left discarding the points (with repetitions).
+        """
+        ineqs = gather(self.indptr, self.indices, points)
+        return ineqs[self.alive_ineqs[ineqs]]
+
+    def points_of(self, ineqs):
+        """
+        Points left discarded by the inequalities (with repetitions).
+        """
+        points = gather(self.instance.indptr, self.instance.indices, ineqs)
+        return points[self.alive_points[points]]
+
+    def degrees(self):
+        """
+        Number of inequalities left discarding each point.
+        """
+        sums = np.zeros(len(self.indices) + 1, dtype=np.int64)
+        np.cumsum(self.alive_ineqs[self.indices], out=sums[1:])
+        return sums[self.indptr[1:]] - sums[self.indptr[:-1]]
+
+    def sizes(self):
+        """
+        Number of points left discarded by each inequality.
+        """
+        out = np.zeros(self.instance.nb_ineqs, dtype=np.int64)
+        for (start, indptr, indices) in self.instance.chunks():
+            sums = np.zeros(len(indices) + 1, dtype=np.int64)
+            np.cumsum(self.alive_points[indices], out=sums[1:])
+            out[start : start + len(indptr) - 1] = sums[indptr[1:]] - sums[indptr[:-1]]
+        return out
+
+    def force(self):
+        """
+        Chooses the only inequality of the points discarded by one inequality.
+        """
+        degrees = self.degrees()
+        uncovered = self.alive_points & (degrees == 0)
+        assert not uncovered.any(), "Some points are discarded by no inequality."
+        single = np.nonzero(self.alive_points & (degrees == 1))[0]
+        for j in single:
+            if not self.alive_points[j]:
+                continue
+            i = int(self.ineqs_of([j])[0])
+            self.forced.append(i)
+            self.alive_ineqs[i] = False
+            self.alive_points[self.instance.points_of(i)] = False
+        return len(single) != 0
+
+    def remove_dominated_ineqs(self):
+        """
+        Removes the inequalities without points or whose points are all
+        discarded by another inequality (the first one of equal inequalities
+        is kept).
+        """
+        sizes = self.sizes()
+        empty = self.alive_ineqs & (sizes == 0)
+        self.alive_ineqs &= ~empty
+        changed = empty.any()
+
+        for i in np.nonzero(self.alive_ineqs)[0]:
+            points = self.points_of([i])
+            # Number of points of i discarded by each inequality.
+            (others, counts) = np.unique(self.ineqs_of(points), return_counts=True)
+            contains = (counts == len(points)) & (others != i)
+            equal = sizes[others] == len(points)
+            if (contains & (~equal | (others < i))).any():
+                self.alive_ineqs[i] = False
+                changed = True
+        return changed
+
+    def remove_dominated_points(self):
+        """
+        Removes the points whose inequalities all discard another point
+        (the first one of the points with the same inequalities is kept).
+        """
+        changed = False
+        for j in np.nonzero(self.alive_points)[0]:
+            if not self.alive_points[j]:
+                continue
+            ineqs = self.ineqs_of([j])
+            # Number of inequalities of j discarding each point.
+            (points, counts) = np.unique(self.points_of(ineqs), return_counts=True)
+            dominated = points[(counts == len(ineqs)) & (points != j)]
+            if len(dominated) != 0:
+                self.alive_points[dominated] = False
+                changed = True
+        return changed
+
+    def split(self):
+        """
+        Yields (inequalities, points) of the connected components of the
+        incidence graph of the inequalities and the points left.
+        """
+        label = np.full(self.instance.nb_points, -1, dtype=np.int64)
+        nb_components = 0
+        for j in np.nonzero(self.alive_points)[0]:
+            if label[j] != -1:
+                continue
+            label[j] = nb_components
+            frontier = np.array([j])
+            while len(frontier) != 0:
+                ineqs = np.unique(self.ineqs_of(frontier))
+                reached = np.unique(self.points_of(ineqs))
+                frontier = reached[label[reached] == -1]
+                label[frontier] = nb_components
+            nb_components += 1
+
+        # The label of an inequality is the label of its points.
+        ineqs = np.nonzero(self.alive_ineqs)[0]
+        ineq_label = np.array(
+            [label[self.points_of([i])[0]] for i in ineqs], dtype=np.int64
+        )
+        for k in range(nb_components):
+            yield (ineqs[ineq_label == k], np.nonzero(label == k)[0])
+
+
+def random_instance(nb_ineqs, nb_points, density, nb_blocks, rng):
+    """
+    Random cover.CoverInstance whose points are split into nb_blocks blocks,
+    each inequality discarding a fraction density of the points of one block.
+    The inequalities and the DDT are placeholders.
+    """
+    from cover import CoverInstance
+
+    block = nb_points // nb_blocks
+    ineq_to_points = {}
+    for i in range(nb_ineqs):
+        start = block * rng.integers(nb_blocks)
+        size = max(1, int(density * block))
+        ineq_to_points[i, 0] = set((start + rng.integers(block, size=size)).tolist())
+    # Every point is discarded by some inequality.
+    for p in set(range(block * nb_blocks)) - set().union(*ineq_to_points.values()):
+        ineq_to_points[int(rng.integers(nb_ineqs)), 0].add(p)
+    points = set().union(*ineq_to_points.values())
+    ddt = np.zeros((16, 16), dtype=np.int64)
+    return CoverInstance.from_sets(ddt, set(ineq_to_points), points, ineq_to_points)
+
+
+def test_cover_instance():
+    """
+    Testing that an instance saved and memory-mapped has the same incidence,
+    also after restrict.
+    """
+    import tempfile
+    from cover import CoverInstance
+
+    rng = np.random.default_rng(0)
+    instance = random_instance(300, 200, 0.05, 4, rng)
+    with tempfile.TemporaryDirectory() as directory:
+        instance.save(directory)
+        loaded = CoverInstance.load(directory, mmap=True)
+        assert isinstance(loaded.indices, np.memmap)
+        for name in ["ineqs", "points", "indptr", "indices", "ddt"]:
+            assert np.array_equal(getattr(loaded, name), getattr(instance, name))
+        for (a, b) in zip(loaded.chunks(64), instance.chunks(64)):
+            assert all(np.array_equal(x, y) for (x, y) in zip(a, b))
+        (indptr, indices) = loaded.transpose()
+        for j in range(instance.nb_points):
+            ineqs = [i for i in range(instance.nb_ineqs) if j in instance.points_of(i)]
+            assert indices[indptr[j] : indptr[j + 1]].tolist() == ineqs
+
+        ineq_ids = np.sort(rng.choice(instance.nb_ineqs, 100, replace=False))
+        point_ids = np.sort(rng.choice(instance.nb_points, 80, replace=False))
+        sub = loaded.restrict(ineq_ids, point_ids)
+        assert np.array_equal(sub.ineqs, instance.ineqs[ineq_ids])
+        assert np.array_equal(sub.points, instance.points[point_ids])
+        for (k, i) in enumerate(ineq_ids):
+            expected = np.nonzero(np.isin(point_ids, instance.points_of(i)))[0]
+            assert np.array_equal(sub.points_of(k), expected)
+        del loaded
+
+    print("Cover instance test OK.")
+
+
+def test_presolve():
+    """
+    Testing that the minimum cover of the presolved instance is a cover of
+    the same size as the minimum cover of the instance.
+    """
+    import gurobipy
+    from minimize import optimize_cover, presolved_cover
+
+    gurobipy.setParam("OutputFlag", 0)
+    rng = np.random.default_rng(1)
+    for _ in range(10):
+        nb_blocks = int(rng.choice([1, 2, 5]))
+        instance = random_instance(
+            int(rng.integers(20, 200)),
+            int(rng.integers(10, 150)),
+            float(rng.choice([0.02, 0.05, 0.1, 0.3])),
+            nb_blocks,
+            rng,
+        )
+        minimum = optimize_cover(instance)
+        chosen = presolved_cover(instance, mode="milp", workers=2)
+        assert len(chosen) == len(minimum)
+        covered = np.zeros(instance.nb_points, dtype=bool)
+        for i in chosen:
+            covered[instance.points_of(i)] = True
+        assert covered.all()
+
+    print("Presolve test OK.")
+
+
+if __name__ == "__main__":
+    test_cover_instance()
+    test_presolve()